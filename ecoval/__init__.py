@@ -11,6 +11,11 @@ from ecoval.helpers import matchup_starting_point
 from ecoval.session import session_info
 import webbrowser
 from ecoval.chunkers import add_chunks
+from ecoval.rendering import render_notebooks
+from ecoval.execution import execute_notebooks
+from ecoval.statistics import compute_statistics
+from ecoval.comparison import compare_results
+from ecoval.manifest import load_manifest, save_manifest, build_manifest, reusable_notebooks, stash_notebooks, restore_notebooks
 import os
 import re
 
@@ -148,7 +153,7 @@ def fix_toc_comparison():
         x = f.write(f"  - file: notebooks/comparison_point_bottom.ipynb\n")
 
 
-def compare(model_dict=None):
+def compare(model_dict=None, cores=None):
     """
     Compare pre-validated simulations.
     This function will compare the validition output from two models.
@@ -159,6 +164,8 @@ def compare(model_dict=None):
         A dictionary of model names and the paths to the validation output. Default is None.
         Example: {"model1": "/path/to/model1", "model2": "/path/to/model2"}
         If the models have different grids, put the model with the smallest grid first.
+    cores : int
+        The number of simulations to read at once. Default is None, which means all cores are used.
 
 
     """
@@ -361,40 +368,11 @@ def compare(model_dict=None):
         
 
 
-    # sync the notebooks
+    # the cross-model tables, from one read of each simulation's results
+    compare_results(model_dict, out = "book/compare/results/comparison.csv", cores = cores)
 
-    os.system("jupytext --set-formats ipynb,py:percent book/compare/notebooks/*.ipynb")
-
-    add_chunks()
-
-    # replace the test status in the notebooks
-    books = glob.glob("book/compare/notebooks/*.py")
-    for book in books:
-        with open(book, "r") as file:
-            filedata = file.read()
-
-        # Replace the target string
-        filedata = filedata.replace("the_test_status", "False")
-
-        # Write the file out again
-        with open(book, "w") as file:
-            file.write(filedata)
-
-    # fix the chunks
-    os.system("jupytext --sync book/compare/notebooks/*.ipynb")
-
-    # loop through notebooks and change fast_plot_value to fast_plot
-
-    for ff in glob.glob("book/compare/notebooks/*.ipynb"):
-        with open(ff, "r") as file:
-            filedata = file.read()
-
-        # Replace the target string
-        filedata = filedata.replace("fast_plot_value", "False")
-
-        # Write the file out again
-        with open(ff, "w") as file:
-            file.write(filedata)
+    # insert the chunks and fill in the build settings
+    render_notebooks("book/compare/notebooks", test = False, fast_plot = False, r_options = False)
 
     os.system("jupyter-book build book/compare/")
     import webbrowser
@@ -402,7 +380,7 @@ def compare(model_dict=None):
     webbrowser.open("file://" + os.path.abspath("book/compare/_build/html/index.html"))
 
 
-def validate(title="Automated model evaluation", author=None, variables = "all", r_warnings = False, build = "html", model = None, test = False):
+def validate(title="Automated model evaluation", author=None, variables = "all", r_warnings = False, build = "html", model = None, test = False, cores = None, timeout = 3600, incremental = False):
     # docstring
     """
     Run the model evaluation for all of the available datasets, and generate a validation report.
@@ -422,6 +400,13 @@ def validate(title="Automated model evaluation", author=None, variables = "all",
     model : str
         The name of the model. This is only for providing model info and a schematic.
         The only option right now is "ersem". 
+    cores : int
+        The number of notebooks to execute at once. Default is None, which means all cores are used.
+    timeout : int
+        The maximum time in seconds to execute each notebook. Default is 3600
+    incremental : bool
+        Only re-run the notebooks whose matched data, templates or chunks have changed since the last build.
+        Existing results are kept. Default is False
 
 
     Returns
@@ -443,9 +428,18 @@ def validate(title="Automated model evaluation", author=None, variables = "all",
     i = 0
     book_dir = f"book_{build}"
 
+    previous = None
+    stash = None
     if os.path.exists(book_dir):
-        #get user input to decide if it should be removed
-        user_input = input("book directory already exists. This will be emptied and replaced. Do you want to proceed? (y/n): ")
+        if incremental:
+            # keep the executed notebooks, so unchanged ones can be reused
+            previous = load_manifest(book_dir)
+            if previous is not None:
+                stash = stash_notebooks(book_dir)
+            user_input = "y"
+        else:
+            #get user input to decide if it should be removed
+            user_input = input("book directory already exists. This will be emptied and replaced. Do you want to proceed? (y/n): ")
         if user_input.lower() == "y":
             while True:
                 files = glob.glob(f"{book_dir}/**/**/**", recursive=True)
@@ -469,7 +463,7 @@ def validate(title="Automated model evaluation", author=None, variables = "all",
 
     # remove the results directory
     x_path = "results"
-    if os.path.exists(x_path):
+    if os.path.exists(x_path) and not incremental:
         if x_path == "results":
             shutil.rmtree(x_path)
     import os
@@ -839,85 +833,8 @@ def validate(title="Automated model evaluation", author=None, variables = "all",
         with open(f"{book_dir}/notebooks/{i_pad}_summary.ipynb", "w") as file:
             file.write(filedata)
 
-        # pair the notebooks using jupyter text
-
-        os.system(f"jupytext --set-formats ipynb,py:percent {book_dir}/notebooks/*.ipynb")
-
-        # add the chunks
-        add_chunks(build)
-
-        # loop through the notebooks and set r warnings options
-        for ff in glob.glob(f"{book_dir}/notebooks/*.py"):
-            with open(ff, "r") as file:
-                filedata = file.read()
-        
-            # loop through line by line, and rewrite the original file
-            lines = filedata.split("\n")
-            new_lines = []
-            for line in lines:
-                if "%%R" in line:
-                    new_lines.append(line)
-                    new_lines.append("options(warn=-1)")
-                else:
-                    new_lines.append(line)
-            # loop through all lines in lines and replace the_test_status with True
-            for i in range(len(new_lines)):
-                if build == "html":
-                    new_lines[i] = new_lines[i].replace("latexpagebreak", "")
-                if "the_test_status" in new_lines[i]:
-                    if test:  
-                        new_lines[i] = new_lines[i].replace("the_test_status", "True")
-                    else:
-                        new_lines[i] = new_lines[i].replace("the_test_status", "False")
-
-
-            
-            # write the new lines to the file
-            with open(ff, "w") as file:
-                for line in new_lines:
-                    file.write(line + "\n")
-
-
-
-
-
-
-
-        # sync the notebooks
-        #
-        os.system(f"jupytext --sync {book_dir}/notebooks/*.ipynb")
-
-    #        return None
-
-    # return None
-
-    # loop through notebooks and change fast_plot_value to fast_plot
-
-    for ff in glob.glob(f"{book_dir}/notebooks/*.ipynb"):
-        with open(ff, "r") as file:
-            filedata = file.read()
-
-        # Replace the target string
-        filedata = filedata.replace("fast_plot_value", str(fast_plot))
-
-        # fix linees using the above
-        def fix_r_magic(x):
-            if "%%R" in x:
-                # x = x.sp
-                x =  re.sub(r" -r\s+\d+", "", x)
-                x = x.replace("%%R", "%%R -r 120 ") 
-            return x
-
-        # lines = filedata.split("\n")
-        # new_lines = []
-        # for line in lines:
-        #     new_lines.append(fix_r_magic(line))
-
-        # filedata = "\n".join(new_lines)
-
-        # Write the file out again
-        with open(ff, "w") as file:
-            file.write(filedata)
+        # insert the chunks and fill in the build settings, writing each notebook once
+        render_notebooks(f"{book_dir}/notebooks", build = build, test = test, fast_plot = fast_plot)
 
     # fix the toc using the function
 
@@ -933,6 +850,20 @@ def validate(title="Automated model evaluation", author=None, variables = "all",
 
     shutil.copyfile(pkg_resources.resource_filename(__name__, "data/pml_logo.jpg"), f"pml_logo.jpg")
 
+    # compute the report statistics once, so the notebooks only load and plot them
+    compute_statistics(variables = variables, cores = cores, incremental = incremental)
+
+    # only notebooks that have changed since the last build need to be run
+    manifest = build_manifest(book_dir, previous)
+    reuse = reusable_notebooks(manifest, previous, stash)
+    restore_notebooks(book_dir, reuse, stash)
+    if len(reuse) > 0:
+        print(f"Reusing {len(reuse)} unchanged notebooks from the previous build")
+
+    # execute the notebooks in parallel, so jupyter-book only has to render them
+    execute_notebooks(book_dir, cores = cores, timeout = timeout, notebooks = [x for x in manifest if x not in reuse])
+    save_manifest(book_dir, manifest)
+
     if build == "html":
         os.system(f"jupyter-book build {book_dir}/")
     else:
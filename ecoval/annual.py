@@ -0,0 +1,500 @@
+import os
+import multiprocessing
+import numpy as np
+import xarray as xr
+from tqdm import tqdm
+from ecoval.kernels import linear_trends, trend_names
+from ecoval.utils import fvcom_drop, _coordinate_names
+
+
+layer_names = ["surface", "bottom"]
+
+
+def _horizontal_dims(ds, lon_name, lat_name):
+    return list(ds[lat_name].dims) + [
+        x for x in ds[lon_name].dims if x not in ds[lat_name].dims
+    ]
+
+
+def _time_name(da):
+    names = [x for x in da.dims if "time" in x.lower()]
+    if len(names) == 0:
+        return None
+    return names[0]
+
+
+def layer_field(da, layer="surface", surface_level="top", horizontal=None):
+    """
+    The surface or bottom values of a variable, with time as the first dimension
+
+    Zeros are treated as missing, as they are land in NEMO output. The bottom is the deepest
+    level with data in each cell.
+
+    Parameters
+    ----------
+    da : xarray.DataArray
+        A variable with a time dimension
+    layer : str
+        "surface" or "bottom"
+    surface_level : str
+        "top" or "bottom". Which end of the vertical dimension is the surface
+    horizontal : list
+        The horizontal dimensions. Default is the last two dimensions
+
+    Returns
+    -------
+    values : numpy.ndarray
+        Values with shape (time, *horizontal)
+
+    """
+    if layer not in layer_names:
+        raise ValueError(f"layer must be one of {layer_names}")
+    if horizontal is None:
+        horizontal = list(da.dims[-2:])
+    time_name = _time_name(da)
+    vertical = [x for x in da.dims if x not in horizontal and x != time_name]
+    # anything beyond a single vertical dimension only needs its first element
+    for dim in vertical[1:]:
+        da = da.isel({dim: 0})
+    vertical = vertical[:1]
+    if layer == "surface" and len(vertical) > 0:
+        da = da.isel({vertical[0]: 0 if surface_level == "top" else -1})
+        vertical = []
+    da = da.transpose(time_name, *(vertical + horizontal))
+    values = da.values.astype("float64")
+    values[values == 0] = np.nan
+    if len(vertical) == 0:
+        return values
+    valid = np.isfinite(values).any(axis=0)
+    if surface_level == "top":
+        index = valid.shape[0] - 1 - np.argmax(valid[::-1], axis=0)
+    else:
+        index = np.argmax(valid, axis=0)
+    return np.take_along_axis(values, index[np.newaxis, np.newaxis], axis=1)[:, 0]
+
+
+def file_years(ff):
+    """
+    The years in the time dimension of a file
+    """
+    with xr.open_dataset(ff, drop_variables=fvcom_drop) as ds:
+        time_name = [x for x in ds.coords if "time" in x.lower() and ds[x].ndim == 1]
+        if len(time_name) == 0:
+            return []
+        return sorted(set(int(x) for x in ds[time_name[0]].dt.year.values))
+
+
+def _layer_years(ff, selections, layers, surface_level, years):
+    """
+    The layers of each selected variable in a file, with the year of each time step
+    """
+    with xr.open_dataset(ff, drop_variables=fvcom_drop) as ds:
+        lon_name, lat_name = _coordinate_names(ds)
+        horizontal = _horizontal_dims(ds, lon_name, lat_name)
+        for variable, model_variable in selections.items():
+            components = model_variable.split("+")
+            if len([x for x in components if x not in ds.variables]) > 0:
+                continue
+            da = sum(ds[x] for x in components)
+            time_name = _time_name(da)
+            if time_name is None:
+                continue
+            step_years = da[time_name].dt.year.values.astype("int64")
+            keep = np.ones(len(step_years), dtype="bool")
+            if years is not None:
+                keep = np.isin(step_years, years)
+            if not keep.any():
+                continue
+            da = da.isel({time_name: np.flatnonzero(keep)})
+            step_years = step_years[keep]
+            for layer in layers.get(variable, ["surface"]):
+                yield (variable, layer), step_years, layer_field(
+                    da, layer, surface_level, horizontal
+                )
+
+
+def file_annual_sums(ff, selections, layers=None, surface_level="top", years=None):
+    """
+    Sums and counts of the surface and bottom values of variables in one file, by year
+
+    The file is opened once for all of the variables.
+
+    Parameters
+    ----------
+    ff : str
+        A model output file
+    selections : dict
+        The model variable of each variable, e.g. {"temperature": "votemper"}. Model variables
+        such as "P1_c+P2_c" are summed
+    layers : dict
+        The layers of each variable, e.g. {"oxygen": ["surface", "bottom"]}. Default is the
+        surface
+    surface_level : str
+        "top" or "bottom". Which end of the vertical dimension is the surface
+    years : list
+        The years to use. Default is None, which means all years
+
+    Returns
+    -------
+    sums : dict
+        For each (variable, layer), the sum and count of the values in each cell, by year
+
+    """
+    if layers is None:
+        layers = dict()
+    sums = dict()
+    for key, step_years, values in _layer_years(ff, selections, layers, surface_level, years):
+        valid = np.isfinite(values)
+        values = np.where(valid, values, 0)
+        by_year = sums.setdefault(key, dict())
+        for year in np.unique(step_years):
+            step = step_years == year
+            by_year[int(year)] = (values[step].sum(axis=0), valid[step].sum(axis=0))
+    return sums
+
+
+def merge_annual_sums(total, partial):
+    """
+    Add the annual sums of one file to the running totals, in place
+    """
+    for key, by_year in partial.items():
+        total_key = total.setdefault(key, dict())
+        for year, (year_sum, year_count) in by_year.items():
+            if year in total_key:
+                total_sum, total_count = total_key[year]
+                year_sum = total_sum + year_sum
+                year_count = total_count + year_count
+            total_key[year] = (year_sum, year_count)
+    return total
+
+
+def annual_means(by_year):
+    """
+    Annual means from annual sums and counts
+
+    Returns
+    -------
+    years : numpy.ndarray
+    means : numpy.ndarray
+        Fields with year as the first dimension. Cells without values are missing
+    """
+    years = np.array(sorted(by_year))
+    sums = np.stack([by_year[x][0] for x in years])
+    counts = np.stack([by_year[x][1] for x in years])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return years, np.where(counts > 0, sums / counts, np.nan)
+
+
+def reduce_files(reader, jobs, merge, cores=None):
+    """
+    Reduce model output files in parallel, merging the partial results as they arrive
+
+    Parameters
+    ----------
+    reader : function
+        Reduces one file. Called with the arguments of each job
+    jobs : list
+        The arguments of each call to reader
+    merge : function
+        Adds the result of one call to the running totals, in place
+    cores : int
+        Number of files to read at once. Default is None, which means all cores
+
+    Returns
+    -------
+    total : dict
+    """
+    if cores is None:
+        cores = os.cpu_count()
+    cores = max(1, min(cores, len(jobs)))
+    total = dict()
+    if cores > 1:
+        pool = multiprocessing.Pool(cores)
+        running = [pool.apply_async(reader, job) for job in jobs]
+        pool.close()
+        for job in tqdm(running):
+            merge(total, job.get())
+        pool.join()
+    else:
+        for job in tqdm(jobs):
+            merge(total, reader(*job))
+    return total
+
+
+def _horizontal_coords(ff, model_variable):
+    """
+    The horizontal dimensions, coordinates and units of a variable, for writing its fields
+    """
+    with xr.open_dataset(ff, drop_variables=fvcom_drop) as ds:
+        lon_name, lat_name = _coordinate_names(ds)
+        dims = _horizontal_dims(ds, lon_name, lat_name)
+        coords = {
+            x: (ds[x].dims, ds[x].values, ds[x].attrs)
+            for x in [lon_name, lat_name]
+            if set(ds[x].dims).issubset(dims)
+        }
+        units = ds[model_variable.split("+")[0]].attrs.get("units", "")
+    return dims, coords, units
+
+
+def annual_trends(
+    files, layers=None, surface_level="top", years=None, cores=None, out_dir="trends", min_n=3
+):
+    """
+    Annual means and per-cell linear trends of model variables, from one pass over the files
+
+    Every selected variable in a file is read at once, and each file is reduced to annual
+    sums in a worker pool. Time steps have equal weight within a year. The trend of each cell
+    is a least squares fit to its annual means, see kernels.linear_trends.
+
+    For each variable, {variable}.nc has the annual means of the surface and
+    {variable}_trend.nc has the trends. Bottom values are in {variable}_bottom.nc and
+    {variable}_bottom_trend.nc.
+
+    Parameters
+    ----------
+    files : dict
+        The variables to read from each file, as a dict of variables and model variables
+    layers : dict
+        The layers of each variable, e.g. {"oxygen": ["surface", "bottom"]}. Default is the
+        surface
+    surface_level : str
+        "top" or "bottom". Which end of the vertical dimension is the surface
+    years : list
+        The years to use. Default is None, which means all years
+    cores : int
+        Number of files to read at once. Default is None, which means all cores
+    out_dir : str
+        Directory the files are saved to
+    min_n : int
+        Minimum number of years for a trend
+
+    Returns
+    -------
+    outputs : list
+        The files written
+    """
+    if layers is None:
+        layers = dict()
+    jobs = [
+        (ff, selections, layers, surface_level, years) for ff, selections in files.items()
+    ]
+    if len(jobs) == 0:
+        raise ValueError("There are no files to calculate trends from")
+    totals = reduce_files(file_annual_sums, jobs, merge_annual_sums, cores)
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    outputs = []
+    for (variable, layer), by_year in sorted(totals.items()):
+        ff, selections = [(x, y) for x, y in files.items() if variable in y][0]
+        dims, coords, units = _horizontal_coords(ff, selections[variable])
+        ds_years, means = annual_means(by_year)
+        trends = linear_trends(ds_years, means, min_n=min_n)
+
+        name = variable if layer == "surface" else f"{variable}_{layer}"
+        ds_mean = xr.Dataset(
+            {variable: (["year"] + dims, means.astype("float32"), {"units": units})},
+            coords=dict(year=ds_years, **coords),
+        )
+        ds_trend = xr.Dataset(
+            {x: (dims, trends[x].astype("float32")) for x in trend_names},
+            coords=coords,
+        )
+        ds_trend["slope"].attrs["units"] = f"{units} per year".strip()
+        for ds, out in [
+            (ds_mean, f"{out_dir}/{name}.nc"),
+            (ds_trend, f"{out_dir}/{name}_trend.nc"),
+        ]:
+            if os.path.exists(out):
+                os.remove(out)
+            ds.to_netcdf(out)
+            outputs.append(out)
+    return outputs
+
+
+drift_columns = ["variable", "layer", "region", "year", "unit", "mean", "anomaly"]
+
+
+def drift_regions(ff, matched_dir="matched"):
+    """
+    The regions and cell weights used for the drift diagnostics of a model grid
+
+    The regions are the whole domain plus any subdomains that fit the grid, see
+    statistics._region_masks. Cells are weighted by the areas in the model grid information
+    if they fit the grid, and otherwise by areas worked out from the coordinates.
+
+    Parameters
+    ----------
+    ff : str
+        A model output file
+    matched_dir : str
+        Directory with the model grid information
+
+    Returns
+    -------
+    regions : tuple
+        Flattened labels, the membership of each label, the region names and the flattened
+        weights. See masks.label_regions
+    """
+    from ecoval.grid import _spherical_areas, get_grid_info
+    from ecoval.masks import label_regions
+    from ecoval.statistics import _region_masks
+
+    with xr.open_dataset(ff, drop_variables=fvcom_drop) as ds:
+        lon_name, lat_name = _coordinate_names(ds)
+        dims = _horizontal_dims(ds, lon_name, lat_name)
+        shape = tuple(ds.sizes[x] for x in dims)
+        lons = ds[lon_name].values.astype("float64")
+        lats = ds[lat_name].values.astype("float64")
+
+    weights = None
+    grid_file = os.path.join(matched_dir, "model_grid.npz")
+    if os.path.exists(grid_file):
+        area = get_grid_info(path=grid_file).area
+        if area is not None and np.size(area) == np.prod(shape):
+            weights = np.asarray(area, dtype="float64").reshape(shape)
+    if weights is None and len(shape) == 2 and lons.ndim in [1, 2]:
+        weights = _spherical_areas(lons, lats)
+    if weights is None or weights.shape != shape:
+        weights = np.ones(shape)
+    weights = np.where(np.isfinite(weights) & (weights > 0), weights, 0)
+
+    if lons.ndim == 1 and len(shape) == 2:
+        masks = _region_masks(shape, matched_dir, lons, lats)
+    else:
+        masks = _region_masks(shape, matched_dir)
+    labels, membership, names = label_regions(masks)
+    return labels.ravel(), membership, names, weights.ravel()
+
+
+def file_regional_sums(
+    ff, selections, labels, membership, weights, layers=None, surface_level="top", years=None
+):
+    """
+    Area-weighted sums of the surface and bottom values of variables in each region, by year
+
+    The file is opened once for all of the variables, and each year of each variable is
+    reduced with one bincount over the labelled cells.
+
+    Parameters
+    ----------
+    ff : str
+        A model output file
+    selections : dict
+        The model variable of each variable, see file_annual_sums
+    labels, membership, weights
+        The flattened labels and weights of the cells and the membership of the labels, see
+        drift_regions
+    layers : dict
+        The layers of each variable. Default is the surface
+    surface_level : str
+        "top" or "bottom". Which end of the vertical dimension is the surface
+    years : list
+        The years to use. Default is None, which means all years
+
+    Returns
+    -------
+    sums : dict
+        For each (variable, layer), the weighted sum of the values and the sum of the weights
+        in each region, by year
+    """
+    if layers is None:
+        layers = dict()
+    n_labels = membership.shape[0]
+    membership = membership.astype("float64")
+    sums = dict()
+    for key, step_years, values in _layer_years(ff, selections, layers, surface_level, years):
+        values = values.reshape(len(step_years), -1)
+        if values.shape[1] != labels.size:
+            raise ValueError(f"The regions do not match the grid of {ff}")
+        valid = np.isfinite(values) & (labels >= 0)
+        by_year = sums.setdefault(key, dict())
+        for year in np.unique(step_years):
+            step = step_years == year
+            year_valid = valid[step]
+            index = np.broadcast_to(labels, year_valid.shape)[year_valid]
+            year_weights = np.broadcast_to(weights, year_valid.shape)[year_valid]
+            total = np.bincount(
+                index, year_weights * values[step][year_valid], minlength=n_labels
+            )
+            weight = np.bincount(index, year_weights, minlength=n_labels)
+            by_year[int(year)] = (total @ membership, weight @ membership)
+    return sums
+
+
+def drift_table(
+    files, regions, layers=None, surface_level="top", years=None, cores=None, out=None
+):
+    """
+    Annual area-weighted means of model variables in each region, from one pass over the files
+
+    Each file is reduced to regional sums in a worker pool, and the sums of the files are
+    added up, so no fields are kept. Time steps have equal weight within a year.
+
+    Parameters
+    ----------
+    files : dict
+        The variables to read from each file, as a dict of variables and model variables
+    regions : tuple
+        The labels, membership, region names and weights of the grid, see drift_regions
+    layers : dict
+        The layers of each variable, e.g. {"oxygen": ["surface", "bottom"]}. Default is the
+        surface
+    surface_level : str
+        "top" or "bottom". Which end of the vertical dimension is the surface
+    years : list
+        The years to use. Default is None, which means all years
+    cores : int
+        Number of files to read at once. Default is None, which means all cores
+    out : str
+        Optional csv file the table is saved to
+
+    Returns
+    -------
+    drift : pandas.DataFrame
+        One row per variable, layer, region and year, with the columns in drift_columns. The
+        anomaly is the change from the first year
+    """
+    import pandas as pd
+
+    labels, membership, names, weights = regions
+    if layers is None:
+        layers = dict()
+    jobs = [
+        (ff, selections, labels, membership, weights, layers, surface_level, years)
+        for ff, selections in files.items()
+    ]
+    if len(jobs) == 0:
+        raise ValueError("There are no files to calculate drift from")
+    totals = reduce_files(file_regional_sums, jobs, merge_annual_sums, cores)
+
+    drift = []
+    for (variable, layer), by_year in sorted(totals.items()):
+        ff, selections = [(x, y) for x, y in files.items() if variable in y][0]
+        units = _horizontal_coords(ff, selections[variable])[2]
+        ds_years, means = annual_means(by_year)
+        drift.append(
+            pd.DataFrame(
+                {
+                    "variable": variable,
+                    "layer": layer,
+                    "region": np.tile(names, len(ds_years)),
+                    "year": np.repeat(ds_years, len(names)),
+                    "unit": units,
+                    "mean": means.ravel(),
+                    "anomaly": (means - means[0]).ravel(),
+                }
+            )
+        )
+    if len(drift) > 0:
+        drift = pd.concat(drift).reset_index(drop=True)
+    else:
+        drift = pd.DataFrame(columns=drift_columns)
+    drift = drift.loc[:, drift_columns]
+
+    if out is not None:
+        if os.path.dirname(out) != "" and not os.path.exists(os.path.dirname(out)):
+            os.makedirs(os.path.dirname(out))
+        drift.to_csv(out, index=False)
+    return drift
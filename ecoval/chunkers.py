@@ -1,13 +1,10 @@
 
-from ecoval.matchall import matchup
-import pandas as pd
 import glob
 import os
-
-import nctoolkit as nc
-import webbrowser
-
 import pkg_resources
+import xarray as xr
+from ecoval.grid import covers_globe
+from ecoval.utils import _coordinate_names
 
 import re
 def is_chunk(x):
@@ -17,91 +14,139 @@ def is_chunk(x):
     except:
         return False
 
+# chunk files are read once per process
+_chunk_cache = dict()
+
+
+def _gridded_covers_globe(ff):
+    """
+    Check if the coordinates of a matched gridded file span the globe, see grid.covers_globe
+    """
+    with xr.open_dataset(ff) as ds:
+        lon_name, lat_name = _coordinate_names(ds)
+        return covers_globe(ds[lon_name].values, ds[lat_name].values)
+
+
+def build_context(build = "html"):
+    """
+    Facts about the matched data that decide which chunks go into the notebooks
+
+    These are worked out once per build, so inserting the chunks does not need to look at the
+    matched data again.
+
+    Parameters
+    ----------
+    build : str
+        "html" or "pdf"
+
+    Returns
+    -------
+    context : dict
+        The build, whether there is gridded data for the northwest European shelf ("nws"),
+        whether the matched gridded data spans the globe ("global_grid", see
+        grid.covers_globe), and the matched gridded and point files ("gridded", "point")
+
+    """
+    gridded = sorted(glob.glob("matched/gridded/**/*.nc", recursive = True))
+    point = sorted(glob.glob("matched/point/**/*.csv", recursive = True))
+    point = [x for x in point if os.path.basename(x) != "paths.csv" and not x.endswith("_unit.csv")]
+
+    global_grid = False
+    if len(gridded) > 0:
+        try:
+            global_grid = _gridded_covers_globe(gridded[0])
+        except Exception:
+            # if the grid cannot be worked out, the global chunk is used, as it covers any grid
+            global_grid = True
+
+    return {
+        "build": build,
+        "nws": len(glob.glob("matched/gridded/nws/**/*.nc")) > 0,
+        "global_grid": global_grid,
+        "gridded": gridded,
+        "point": point,
+    }
+
+
+def chunk_file(chunk, context):
+    """
+    The file a chunk is read from, or None if the chunk is not used in this build
+
+    Parameters
+    ----------
+    chunk : str
+        Name of the chunk, e.g. "chunk_start"
+    context : dict
+        The build context, from build_context
+
+    """
+    if chunk == "chunk_globals":
+        if len(context["gridded"]) > 0 and context["global_grid"]:
+            return "chunk_globals.py"
+        return "chunk_empty.py"
+    if chunk == "chunk_cdf" and not context["nws"]:
+        return None
+    return chunk + ".py"
+
+
+def chunk_source(chunk, context):
+    """
+    The contents of a chunk, or None if the chunk is not used in this build
+    """
+    ff = chunk_file(chunk, context)
+    if ff is None:
+        return None
+    key = (ff, context["build"])
+    if key not in _chunk_cache:
+        data_path = pkg_resources.resource_filename(__name__, f"data/{ff}")
+        with open(data_path, 'r') as file:
+            source = file.read()
+        if context["build"] == "pdf":
+            source = source.replace("book_build", "pdf")
+        _chunk_cache[key] = source
+    return _chunk_cache[key]
+
+
+def expand_chunks(text, context = None):
+    """
+    Replace the chunk_* lines of a notebook in py:percent format with the contents of the chunks
+
+    Parameters
+    ----------
+    text : str
+        The notebook as py:percent text
+    context : dict
+        The build context, from build_context. Default is None, which means it is worked out
+        from the matched data
+
+    Returns
+    -------
+    text : str
+
+    """
+    if context is None:
+        context = build_context()
+
+    new_lines = []
+    for line in text.splitlines(keepends = True):
+        if is_chunk(line):
+            chunk = chunk_source(line.replace("\n", ""), context)
+            if chunk is not None:
+                new_lines.append(chunk)
+        else:
+            new_lines.append(line)
+    return "".join(new_lines)
+
+
 def add_chunks(build = "html"):
 
-    nws = False
-    if len(glob.glob("matched/gridded/nws/**/*.nc")) > 0:
-        nws = True
+    context = build_context(build)
 
     paths = glob.glob(f"book_{build}/notebooks/*.py")
     paths += glob.glob("book/compare/notebooks/*.py")
 
     for path in paths:
-        # read file line by line
-        # Using readlines()
-        file1 = open(path, 'r')
-        Lines = file1.readlines()
-
-        count = 0
-        # Strips the newline character
-        # generate new lines
-        new_lines = []
-        for line in Lines:
-            if is_chunk(line):
-                # get the file names
-                chunk_file = line.replace("\n", "") + ".py"
-                # check if globals is in chunk file
-                if "globals" in chunk_file:
-                #     # now, we need to figure out if it's a global grid
-                    try:
-                        file_paths = nc.create_ensemble("matched/gridded/")
-                        if len(file_paths) == 0:
-                            chunk_file = "chunk_empty.py" 
-                        else:
-                            file_path = file_paths[0]
-                            ds = nc.open_data(file_path)
-                            ds = ds.to_xarray()
-                            lon_name = [x for x in ds.coords if "lon" in x][0]
-                            lat_name = [x for x in ds.coords if "lat" in x][0]
-                            # now, get the lon and lat min/max
-                            lon_min = float(ds[lon_name].min())
-                            lon_max = float(ds[lon_name].max())
-                            lat_min = float(ds[lat_name].min())
-                            lat_max = float(ds[lat_name].max())
-                            lon_range = lon_max - lon_min
-                            lat_range = lat_max - lat_min
-                            if lon_range > 340 and lat_range > 160:
-                                chunk_file = "chunk_globals.py"
-                            else:
-                                chunk_file = "chunk_empty.py"
-                            raise ValueError(chunk_file)
-                    except:
-                        chunk_file = chunk_file
-
-
-                if not nws:
-                    if "cdf" in chunk_file:
-                        continue
-                data_path = pkg_resources.resource_filename(__name__, f"data/{chunk_file}")
-
-                # read the chunk file in line by line
-
-                # Using readlines()
-                file2 = open(data_path, 'r')
-                chunk_lines = file2.readlines()
-
-                # add the chunk lines to the new lines
-                for chunk_line in chunk_lines:
-
-                    if build == "pdf":
-                        new_lines.append(chunk_line.replace("book_build", "pdf"))
-                    else:
-                        new_lines.append(chunk_line)
-
-                # close the chunk file
-                file2.close()
-
-                count += 1
-            else:
-                new_lines.append(line)
-
-        # close the original file
-        file1.close()
-
-        # write the new lines to the file
-        file1 = open(path, 'w')
-        file1.writelines(new_lines)
-        file1.close()
-
-        
-
+        with open(path, 'r') as file:
+            text = file.read()
+        with open(path, 'w') as file:
+            file.write(expand_chunks(text, context))
@@ -0,0 +1,282 @@
+import os
+import glob
+import hashlib
+import multiprocessing
+import numpy as np
+import pandas as pd
+import xarray as xr
+from tqdm import tqdm
+from ecoval.fvcom import _unit_vectors
+from ecoval.grid import _spherical_areas
+from ecoval.utils import _coordinate_names
+
+
+comparison_columns = [
+    "variable",
+    "model",
+    "n",
+    "unit",
+    "bias",
+    "mae",
+    "norm_bias",
+    "spatial_cor",
+    "temporal_cor",
+]
+
+# nearest-neighbour indices between grids, by source and target grid
+_nn_weights = dict()
+
+
+def _read_fields(ff):
+    """
+    Read the 2D fields of a results file, with their coordinates and units
+    """
+    with xr.open_dataset(ff) as ds:
+        lon_name, lat_name = _coordinate_names(ds)
+        fields = dict()
+        units = dict()
+        for vv in ds.data_vars:
+            da = ds[vv]
+            extra = [x for x in da.dims if da.sizes[x] == 1]
+            da = da.isel({x: 0 for x in extra}, drop=True)
+            if da.ndim != 2:
+                continue
+            fields[vv] = da.values.astype("float64")
+            units[vv] = da.attrs.get("units", "")
+        lons = ds[lon_name].values.astype("float64")
+        lats = ds[lat_name].values.astype("float64")
+    return {"lon": lons, "lat": lats, "fields": fields, "units": units}
+
+
+def load_results(directory, kind="annual_mean"):
+    """
+    Read every netCDF file in one results folder of a validated simulation
+
+    Parameters
+    ----------
+    directory : str
+        The directory the simulation was validated in
+    kind : str
+        The results folder, e.g. "annual_mean" or "temporals"
+
+    Returns
+    -------
+    results : dict
+        The fields of each file, by file name
+    """
+    results = dict()
+    for ff in sorted(glob.glob(f"{directory}/results/{kind}/*.nc")):
+        results[os.path.basename(ff)] = _read_fields(ff)
+    return results
+
+
+def _grid_key(lons, lats):
+    hasher = hashlib.sha1()
+    for values in [lons, lats]:
+        hasher.update(str(values.shape).encode())
+        hasher.update(np.ascontiguousarray(values).tobytes())
+    return hasher.hexdigest()
+
+
+def _lonlat_grid(lons, lats):
+    if lons.ndim == 1:
+        return np.meshgrid(lons, lats)
+    return lons, lats
+
+
+def nn_index(lons, lats, target_lons, target_lats):
+    """
+    Nearest source cell of each target cell, worked out once per pair of grids
+
+    Target cells further than two source cells from any source cell are -1.
+
+    Parameters
+    ----------
+    lons, lats : numpy.ndarray
+        Coordinates of the source grid, 1D or 2D
+    target_lons, target_lats : numpy.ndarray
+        Coordinates of the target grid, 1D or 2D
+
+    Returns
+    -------
+    index : numpy.ndarray
+        Index of the flattened source grid, with the shape of the target grid
+    """
+    key = (_grid_key(lons, lats), _grid_key(target_lons, target_lats))
+    if key in _nn_weights:
+        return _nn_weights[key]
+
+    from scipy.spatial import cKDTree
+
+    lon_grid, lat_grid = _lonlat_grid(lons, lats)
+    target_lon_grid, target_lat_grid = _lonlat_grid(target_lons, target_lats)
+    spacing = max(
+        np.nanmedian(np.abs(np.diff(lon_grid, axis=-1))) if lon_grid.shape[-1] > 1 else 0,
+        np.nanmedian(np.abs(np.diff(lat_grid, axis=0))) if lat_grid.shape[0] > 1 else 0,
+    )
+    tree = cKDTree(_unit_vectors(lon_grid.ravel(), lat_grid.ravel()))
+    bound = np.inf if spacing == 0 else 2 * np.deg2rad(spacing)
+    distance, index = tree.query(
+        _unit_vectors(target_lon_grid.ravel(), target_lat_grid.ravel()),
+        distance_upper_bound=bound,
+    )
+    index = np.where(np.isfinite(distance), index, -1).reshape(target_lon_grid.shape)
+    _nn_weights[key] = index
+    return index
+
+
+def _regrid(values, index):
+    return np.where(index >= 0, values.ravel()[np.clip(index, 0, None)], np.nan)
+
+
+def cross_model_statistics(model, observation, weights):
+    """
+    Area-weighted statistics of each model, over the cells where every model has values
+
+    Parameters
+    ----------
+    model, observation : numpy.ndarray
+        Fields of each model on a common grid, with shape (models, y, x)
+    weights : numpy.ndarray
+        Weight of each cell, e.g. its area
+
+    Returns
+    -------
+    statistics : dict
+        n, bias, mae, norm_bias and spatial_cor, each with one value per model
+    """
+    common = np.all(np.isfinite(model) & np.isfinite(observation), axis=0)
+    w = np.where(common, weights, 0)
+    x = np.where(common, model, 0)
+    y = np.where(common, observation, 0)
+    axes = (-2, -1)
+    total = w.sum()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        difference = ((x - y) * w).sum(axis=axes)
+        x_mean = (x * w).sum(axis=axes) / total
+        y_mean = (y * w).sum(axis=axes) / total
+        dx = np.where(common, x - x_mean[:, None, None], 0)
+        dy = np.where(common, y - y_mean[:, None, None], 0)
+        cor = (w * dx * dy).sum(axis=axes) / np.sqrt(
+            (w * dx**2).sum(axis=axes) * (w * dy**2).sum(axis=axes)
+        )
+        statistics = {
+            "n": np.full(model.shape[0], int(common.sum())),
+            "bias": difference / total,
+            "mae": (np.abs(x - y) * w).sum(axis=axes) / total,
+            "norm_bias": difference / (y * w).sum(axis=axes),
+            "spatial_cor": cor,
+        }
+    return statistics
+
+
+def _common_files(results):
+    """
+    Files found for more than one model, with the models that have them in order
+    """
+    files = dict()
+    for model_name, model_results in results.items():
+        for ff in model_results:
+            files.setdefault(ff, []).append(model_name)
+    return {ff: names for ff, names in files.items() if len(names) > 1}
+
+
+def _on_target(results, ff, names, vv):
+    """
+    Fields of a variable for each model, regridded to the grid of the first model
+    """
+    target = results[names[0]][ff]
+    fields = []
+    for name in names:
+        source = results[name][ff]
+        index = nn_index(source["lon"], source["lat"], target["lon"], target["lat"])
+        fields.append(_regrid(source["fields"][vv], index))
+    return np.stack(fields), target
+
+
+def compare_results(model_dict, out=None, cores=None):
+    """
+    Cross-model statistics of the validation results of several simulations
+
+    Each simulation's annual means and temporal correlations are read once, in parallel. The
+    fields are regridded to the grid of the first simulation with cached nearest-neighbour
+    indices. The statistics of every simulation are then computed in one pass, over the
+    cells where all of them have values.
+
+    Parameters
+    ----------
+    model_dict : dict
+        Model names and the directories they were validated in
+    out : str
+        Optional csv file the table is saved to
+    cores : int
+        Number of simulations to read at once. Default is None, which means all cores
+
+    Returns
+    -------
+    comparison : pandas.DataFrame
+        One row per variable and model, with the columns in comparison_columns
+
+    """
+    if not isinstance(model_dict, dict) or len(model_dict) < 2:
+        raise ValueError("model_dict must have at least two models")
+    if cores is None:
+        cores = os.cpu_count()
+    cores = max(1, min(cores, len(model_dict)))
+
+    jobs = [(name, kind) for name in model_dict for kind in ["annual_mean", "temporals"]]
+    results = {"annual_mean": dict(), "temporals": dict()}
+    if cores > 1:
+        pool = multiprocessing.Pool(cores)
+        running = [
+            pool.apply_async(load_results, [model_dict[name], kind]) for name, kind in jobs
+        ]
+        pool.close()
+        for (name, kind), job in zip(jobs, tqdm(running)):
+            results[kind][name] = job.get()
+        pool.join()
+    else:
+        for name, kind in tqdm(jobs):
+            results[kind][name] = load_results(model_dict[name], kind)
+
+    rows = []
+    for ff, names in _common_files(results["annual_mean"]).items():
+        fields = results["annual_mean"][names[0]][ff]["fields"]
+        if "model" not in fields or "observation" not in fields:
+            continue
+        model, target = _on_target(results["annual_mean"], ff, names, "model")
+        observation = _on_target(results["annual_mean"], ff, names, "observation")[0]
+        lon_grid, lat_grid = _lonlat_grid(target["lon"], target["lat"])
+        areas = _spherical_areas(lon_grid, lat_grid)
+        areas = np.where(np.isfinite(areas) & (areas > 0), areas, 1)
+        statistics = cross_model_statistics(model, observation, areas)
+        variable = ff.split("_")[1].replace(".nc", "")
+        for i, name in enumerate(names):
+            row = {"variable": variable, "model": name, "unit": target["units"].get("model", "")}
+            for key in statistics:
+                row[key] = statistics[key][i]
+            rows.append(row)
+    comparison = pd.DataFrame(rows, columns=comparison_columns)
+
+    # mean temporal correlation, over the cells where every model has one
+    for ff, names in _common_files(results["temporals"]).items():
+        if "cor" not in results["temporals"][names[0]][ff]["fields"]:
+            continue
+        cor, target = _on_target(results["temporals"], ff, names, "cor")
+        lon_grid, lat_grid = _lonlat_grid(target["lon"], target["lat"])
+        areas = _spherical_areas(lon_grid, lat_grid)
+        areas = np.where(np.isfinite(areas) & (areas > 0), areas, 1)
+        common = np.all(np.isfinite(cor), axis=0)
+        if common.sum() == 0:
+            continue
+        means = (np.where(common, cor, 0) * areas).sum(axis=(-2, -1)) / areas[common].sum()
+        variable = ff.split("_")[0]
+        for i, name in enumerate(names):
+            selection = (comparison.variable == variable) & (comparison.model == name)
+            comparison.loc[selection, "temporal_cor"] = means[i]
+
+    if out is not None:
+        if os.path.dirname(out) != "" and not os.path.exists(os.path.dirname(out)):
+            os.makedirs(os.path.dirname(out))
+        comparison.to_csv(out, index=False)
+    return comparison
@@ -6,31 +6,37 @@ md(f"## Assessing model bias for {layer} {vv_name}")
 
 
 # %% tags=["remove-input"]
-ds_bias = ds_model.copy()
-ds_bias - ds_obs
-ds_bias.tmean()
-ds_bias.run()
-# model plot
-
-df_bias = ds_bias.to_dataframe().reset_index()
-if "model" == ds_bias.variables[0]:
-    ds_bias.set_longnames({"model": Variable + " bias"})
+# the statistics stage normally computes the bias before the notebooks run
+bias_file = f"../../results/bias/bias_{variable}.nc"
+stats_file = "../../results/statistics/summary.csv"
+df_stats = None
+if os.path.exists(bias_file) and os.path.exists(stats_file):
+    df_stats = pd.read_csv(stats_file).query("variable == @variable and region == 'all'")
+if df_stats is not None and len(df_stats) == 1:
+    ds_bias = nc.open_data(bias_file, checks = False)
+    ds_bias.set_longnames({ds_bias.variables[0]: Variable + " bias"})
+    ave_bias = df_stats.bias.values[0]
+    positive_bias = round(df_stats.positive_bias.values[0], 1)
+    the_unit = ds_bias.contents.unit.values[0]
 else:
-    ds_bias.set_longnames({variable: Variable + " bias"})
-
-# get th
-ds_ave = ds_bias.copy()
-ds_ave.spatial_mean()
-ds_ave.rename({ds_ave.variables[0]: "bias"})
-ave_bias = ds_ave.to_dataframe().bias.values[0]
-ds_summary = ds_bias.copy()
-ds_summary > 0 
-ds_summary.spatial_mean()
-ds_summary.rename({ds_summary.variables[0]: "bias"})
-positive_bias = ds_summary.to_dataframe().bias.values[0] * 100
-# as a percentage to 1 dp
-positive_bias = round(positive_bias, 1)
-the_unit = ds_summary.contents.unit.values[0]
+    ds_bias = ds_model.copy()
+    ds_bias - ds_obs
+    ds_bias.tmean()
+    ds_bias.run()
+    ds_bias.set_longnames({ds_bias.variables[0]: Variable + " bias"})
+
+    ds_ave = ds_bias.copy()
+    ds_ave.spatial_mean()
+    ds_ave.rename({ds_ave.variables[0]: "bias"})
+    ave_bias = ds_ave.to_dataframe().bias.values[0]
+    ds_summary = ds_bias.copy()
+    ds_summary > 0 
+    ds_summary.spatial_mean()
+    ds_summary.rename({ds_summary.variables[0]: "bias"})
+    positive_bias = ds_summary.to_dataframe().bias.values[0] * 100
+    # as a percentage to 1 dp
+    positive_bias = round(positive_bias, 1)
+    the_unit = ds_summary.contents.unit.values[0]
 
 md(f"Figure {chapter}{i_figure} shows the average bias of {layer} {vv_name} simulated by the model. A positive bias indicates that the model overestimates the observation, while a negative bias indicates that the model overpredicts the observation.") 
 if positive_bias > 50:
@@ -47,9 +53,9 @@ else:
 if fix_grid:
     ds_bias_1 = ds_bias.copy()
     ds_bias_1.to_latlon(lon = [lon_min , lon_max], lat = [lat_min, lat_max], res = [lon_res, lat_res])
-    ds_bias_1.pub_plot(robust = True)
+    map_plot(ds_bias_1, robust = True)
 else:
-    ds_bias.pub_plot(robust = True)
+    map_plot(ds_bias, robust = True)
 
 
 # %% tags=["remove-input"]
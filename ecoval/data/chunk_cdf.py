@@ -18,47 +18,55 @@
 
 # %% tags=["remove-input"]
 md(f"The ability of the model to reproduce the broad-scale statistical distribution of {layer} {vv_name} is assessed by comparing the cumulative distribution function (CDF) of the modelled and observed {vv_name}. The CDF is a function that maps the probability that a random variable is less than or equal to a given value. The CDF is calculated by counting the number of values less than or equal to a given value and dividing by the total number of values. The CDF is a non-parametric measure of the statistical distribution of a random variable. It is a more robust measure of the statistical distribution than the mean and standard deviation, which are sensitive to outliers.")
+# the statistics stage normally sketches the distribution of each month
+from ecoval.statistics import sketch_cdf
+df = sketch_cdf(variable, region = "Shelf", results_dir = "../../results")
+sketched = df is not None
 ds = nc.open_data(f"../../results/monthly_mean/monthlymean_{variable}.nc")
-data_path = pkg_resources.resource_filename("ecoval", "data/amm7_val_subdomains.nc")
-ds_regions = nc.open_data(data_path, checks = False)
-
-
-ds_regions.subset(variable = "Shelf")
-ds_regions.as_missing(0)
-ds_regions.regrid(ds)
-ds * ds_regions
-df = (
-    ds
-    .to_dataframe()
-    .dropna()
-    .reset_index()
-    )
-time_name = [x for x in df.columns if "time" in x][0]
-df.rename(columns = {time_name: "time"}, inplace = True)
-lon_name = [x for x in df.columns if "lon" in x][0]
-lat_name = [x for x in df.columns if "lat" in x][0]
-df.rename(columns = {lon_name: "lon", lat_name: "lat"}, inplace = True)
-df = (
-    df
-    .assign(month = lambda x: x.time.dt.month)
-    .loc[:,["lon", "lat", "model", "observation", "month"]]
-    .drop_duplicates()
-    )
-lon_name = [x for x in df.columns if "lon" in x][0]
-lat_name = [x for x in df.columns if "lat" in x][0]
-# rename
-df = df.melt(["lon", "lat", "month"])
+if not sketched:
+    from ecoval.masks import mask_dataset
+    if not mask_dataset(ds, "Shelf", regrid = True):
+        # grids without 1D coordinates are masked with cdo
+        data_path = pkg_resources.resource_filename("ecoval", "data/amm7_val_subdomains.nc")
+        ds_regions = nc.open_data(data_path, checks = False)
+        ds_regions.subset(variable = "Shelf")
+        ds_regions.as_missing(0)
+        ds_regions.regrid(ds)
+        ds * ds_regions
+    df = (
+        ds
+        .to_dataframe()
+        .dropna()
+        .reset_index()
+        )
+    time_name = [x for x in df.columns if "time" in x][0]
+    df.rename(columns = {time_name: "time"}, inplace = True)
+    lon_name = [x for x in df.columns if "lon" in x][0]
+    lat_name = [x for x in df.columns if "lat" in x][0]
+    df.rename(columns = {lon_name: "lon", lat_name: "lat"}, inplace = True)
+    df = (
+        df
+        .assign(month = lambda x: x.time.dt.month)
+        .loc[:,["lon", "lat", "model", "observation", "month"]]
+        .drop_duplicates()
+        )
+    lon_name = [x for x in df.columns if "lon" in x][0]
+    lat_name = [x for x in df.columns if "lat" in x][0]
+    # rename
+    df = df.melt(["lon", "lat", "month"])
 units = ds.contents.unit[0]
 
 
 # %% tags=["remove-input"]
 %%capture --no-display
-%%R -i df -i units -i variable -w 10 -h 10 --units in -r 100
+%%R -i df -i units -i variable -i sketched -w 10 -h 10 --units in -r 100
 library(dplyr)
 library(tidyverse)
 library(ggridges)
 library(ggthemes)
 
+# sketched distributions are already capped
+if (!sketched){
 df <- df %>%
     group_by(variable, month) %>%
     # calculate 98th percentile of value
@@ -68,6 +76,7 @@ df <- df %>%
     filter(value < limit) %>%
     # remove limit column
     select(-limit)
+}
 
 
 # ggplot(iris, aes(x = Sepal.Length, y = Species, group = Species)) + 
@@ -91,8 +100,14 @@ x_lab <- str_replace(x_lab, "/m\\^3", "m<sup>-3</sup>")
 df <- df %>%
     mutate(variable = str_to_title(variable))
 
-ggplot(df, aes(x = value, colour = variable)) +
-    stat_ecdf()+
+if (sketched){
+    gg <- ggplot(df, aes(x = value, y = probability, colour = variable)) +
+        geom_step()
+} else {
+    gg <- ggplot(df, aes(x = value, colour = variable)) +
+        stat_ecdf()
+}
+gg +
     facet_wrap(~month)+
     labs(y = "Cumulative probability", x = x_lab)+ 
     theme_bw(base_size = 14)+
@@ -46,7 +46,7 @@ if lon_max < 90:
 fix_grid = False
 if build != "pdf":
     try:
-        plot_model = ds_annual.pub_plot(limits = ["0%", "98%"], trans = transformation)
+        plot_model = map_plot(ds_annual, limits = ["0%", "98%"], trans = transformation)
     except:
         # this needs to be regridded
         ds_plot = ds_annual.copy()
@@ -64,14 +64,14 @@ if build != "pdf":
         # regrid
         ds_plot.to_latlon(lon = [lon_min , lon_max], lat = [lat_min, lat_max], res = [lon_res, lat_res]) 
         ds_plot.run()
-        plot_model = ds_plot.pub_plot(limits = ["0%", "98%"], trans = transformation)
+        plot_model = map_plot(ds_plot, limits = ["0%", "98%"], trans = transformation)
         fix_grid = True 
 
 # %% tags=["remove-input", "remove-output"]
 
 if build == "pdf":
     try:
-        plot_model = ds_annual.pub_plot(limits = ["0%", "98%"], trans = transformation)
+        plot_model = map_plot(ds_annual, limits = ["0%", "98%"], trans = transformation)
     except:
         # this needs to be regridded
         ds_plot = ds_annual.copy()
@@ -89,7 +89,7 @@ if build == "pdf":
         # regrid
         ds_plot.to_latlon(lon = [lon_min , lon_max], lat = [lat_min, lat_max], res = [lon_res, lat_res]) 
         ds_plot.run()
-        plot_model = ds_plot.pub_plot(limits = ["0%", "98%"], trans = transformation)
+        plot_model = map_plot(ds_plot, limits = ["0%", "98%"], trans = transformation)
         fix_grid = True 
 
 
@@ -135,11 +135,11 @@ if lon_max < 90:
 
 if build != "pdf":
     if not fix_grid:
-        plot_obs = ds_annual.pub_plot(limits = ["0%", "98%"], trans = transformation)
+        plot_obs = map_plot(ds_annual, limits = ["0%", "98%"], trans = transformation)
     else:
         ds_plot = ds_annual.copy()
         ds_plot.to_latlon(lon = [lon_min , lon_max], lat = [lat_min, lat_max], res = [lon_res, lat_res])
-        plot_obs = ds_plot.pub_plot(limits = ["0%", "98%"], trans = transformation)
+        plot_obs = map_plot(ds_plot, limits = ["0%", "98%"], trans = transformation)
 
 # %% tags=["remove-input"]
 if build != "pdf":
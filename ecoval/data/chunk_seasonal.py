@@ -1,33 +1,37 @@
 # %% tags=["remove-cell"]
-ds1 = ds_model.copy()
-ds1.cdo_command("setname,model")
-ds1.run()
-ds2 = ds_obs.copy()
-ds2.cdo_command("setname,observation")
-ds2.run()
-ds_cor = nc.open_data([ds1.current[0], ds2.current[0]])
-ds_cor.merge(match=["month"])
-ds_cor.run()
-ds_ts = ds_cor.copy()
-ds_cor.cor_time("model", "observation")
+# the statistics stage normally computes the correlations before the notebooks run
+cor_file = f"../../results/temporals/{variable}_cor.nc"
 title = f"Seasonal temporal correlation between {variable} for model and observations"
-ds_cor.run()
-
-# output to nc
-
-out = f"../../results/temporals/{variable}_cor.nc"
-if not os.path.exists(os.path.dirname(out)):
-    os.makedirs(os.path.dirname(out))
-ds_cor.to_nc(out, zip = True, overwrite = True)
-
-# output to csv
-
-df_cor = ds_cor.to_dataframe().reset_index()
-df_cor = df_cor.dropna()
-out = f"../../results/temporals/{variable}_cor.csv"
-if not os.path.exists(os.path.dirname(out)):
-    os.makedirs(os.path.dirname(out))
-df_cor.to_csv(out, index = False)
+if os.path.exists(cor_file):
+    ds_cor = nc.open_data(cor_file, checks = False)
+else:
+    ds1 = ds_model.copy()
+    ds1.cdo_command("setname,model")
+    ds1.run()
+    ds2 = ds_obs.copy()
+    ds2.cdo_command("setname,observation")
+    ds2.run()
+    ds_cor = nc.open_data([ds1.current[0], ds2.current[0]])
+    ds_cor.merge(match=["month"])
+    ds_cor.run()
+    ds_cor.cor_time("model", "observation")
+    ds_cor.run()
+
+    # output to nc
+
+    out = f"../../results/temporals/{variable}_cor.nc"
+    if not os.path.exists(os.path.dirname(out)):
+        os.makedirs(os.path.dirname(out))
+    ds_cor.to_nc(out, zip = True, overwrite = True)
+
+    # output to csv
+
+    df_cor = ds_cor.to_dataframe().reset_index()
+    df_cor = df_cor.dropna()
+    out = f"../../results/temporals/{variable}_cor.csv"
+    if not os.path.exists(os.path.dirname(out)):
+        os.makedirs(os.path.dirname(out))
+    df_cor.to_csv(out, index = False)
 
 
 # %% tags=["remove-input"]
@@ -36,9 +40,9 @@ df_cor = ds_cor.to_dataframe().reset_index()
 if fix_grid:
     ds_cor_plot = ds_cor.copy()
     ds_cor_plot.to_latlon(lon = [lon_min , lon_max], lat = [lat_min, lat_max], res = [lon_res, lat_res])
-    ds_cor_plot.pub_plot("cor")
+    map_plot(ds_cor_plot, "cor")
 else:
-    ds_cor.pub_plot("cor")
+    map_plot(ds_cor, "cor")
 
 
 
@@ -69,7 +73,8 @@ ds_regions.regrid(ds_model)
 regions_contents = ds_regions.contents
 
 # figure out if you can sensibly do a regional analysis for nws
-grid = pd.read_csv("../../matched/model_grid.csv")
+from ecoval.grid import get_grid_info
+grid = get_grid_info(path = "../../matched/model_grid.npz").to_dataframe()
 lon = grid.loc[:,[x for x in grid.columns if "lon" in x]].values
 lon = np.unique(lon)
 lon.sort()
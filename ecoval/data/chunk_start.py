@@ -11,6 +11,7 @@ import jellyfish
 compact = False
 import pickle
 import ecoval
+from ecoval.maps import map_plot
 import copy
 import calendar
 import nctoolkit as nc
@@ -0,0 +1,207 @@
+import os
+import numpy as np
+import xarray as xr
+import nctoolkit as nc
+from ecoval.utils import _file_key, fvcom_drop
+
+
+# depth fields are computed once per thickness file, variable and surface level
+_depth_cache = dict()
+# whether files have time-varying thickness
+_vvl_cache = dict()
+
+
+def _thickness_variable(ds, variable=None):
+    if variable is not None:
+        return variable
+    if "e3t" in ds.data_vars:
+        return "e3t"
+    return list(ds.data_vars)[0]
+
+
+def _time_dim(da):
+    time_dims = [x for x in da.dims if "time" in x.lower()]
+    if len(time_dims) == 0:
+        return None
+    return time_dims[0]
+
+
+def _level_dim(da):
+    levels = [x for x in da.dims if "time" not in x.lower()]
+    return levels[0]
+
+
+def layer_depths(e3t, surface_level="top"):
+    """
+    Work out the depths of the layer centres from the layer thicknesses
+
+    Parameters
+    ----------
+    e3t : numpy.ndarray
+        Layer thicknesses, with levels as the first dimension. Zeros and missing values are land
+    surface_level : str
+        "top" if the first level is the surface, "bottom" if the last level is the surface
+
+    Returns
+    -------
+    depths : numpy.ndarray
+        Depths of the layer centres, missing over land
+
+    """
+    e3t = np.asarray(e3t, dtype="float64")
+    land = ~np.isfinite(e3t) | (e3t == 0)
+    e3t = np.where(land, 0, e3t)
+    if surface_level == "bottom":
+        e3t = e3t[::-1]
+        land = land[::-1]
+    depths = np.cumsum(e3t, axis=0) - e3t / 2
+    depths[land] = np.nan
+    if surface_level == "bottom":
+        depths = depths[::-1]
+    return depths
+
+
+def water_depth(e3t):
+    """
+    Work out the bathymetry, i.e. the total thickness of the water column
+
+    Parameters
+    ----------
+    e3t : numpy.ndarray
+        Layer thicknesses, with levels as the first dimension
+
+    Returns
+    -------
+    bathymetry : numpy.ndarray
+        Missing where there is no water
+
+    """
+    e3t = np.asarray(e3t, dtype="float64")
+    wet = np.isfinite(e3t) & (e3t != 0)
+    bathymetry = np.where(wet, e3t, 0).sum(axis=0)
+    bathymetry[~wet.any(axis=0)] = np.nan
+    return bathymetry
+
+
+def is_vvl(ff, variable=None):
+    """
+    Check if a file has time-varying layer thicknesses, i.e. it is from a variable volume run
+
+    Only the thickness in the model output is used for time-varying depths, as its time steps
+    line up with the matched variables. Separate thickness files are treated as fixed.
+    """
+    key = _file_key(ff)
+    if key in _vvl_cache:
+        return _vvl_cache[key]
+    vvl = False
+    with xr.open_dataset(ff, decode_times=False, drop_variables=fvcom_drop) as ds:
+        if variable is None and "e3t" not in ds.data_vars:
+            _vvl_cache[key] = False
+            return False
+        da = ds[_thickness_variable(ds, variable)]
+        time_dim = _time_dim(da)
+        if time_dim is not None and da.sizes[time_dim] > 1:
+            first = da.isel({time_dim: 0}).values
+            second = da.isel({time_dim: 1}).values
+            vvl = not np.allclose(first, second, equal_nan=True)
+    _vvl_cache[key] = vvl
+    return vvl
+
+
+def _read_thickness(ff, variable=None, time=0):
+    """
+    Read the thickness at one time step, and a template for writing fields on its grid
+    """
+    with xr.open_dataset(ff, decode_times=False, drop_variables=fvcom_drop) as ds:
+        da = ds[_thickness_variable(ds, variable)]
+        time_dim = _time_dim(da)
+        if time_dim is not None:
+            da = da.isel({time_dim: time})
+        da = da.transpose(_level_dim(da), ...).load()
+    return da
+
+
+def depth_fields(ff, variable=None, surface_level="top"):
+    """
+    Layer-centre depths and bathymetry for a grid, from the first time step of the thickness
+
+    The results are cached per thickness file, variable and surface level. Files that have
+    changed since they were cached are read again.
+
+    Parameters
+    ----------
+    ff : str
+        File with the layer thicknesses
+    variable : str
+        Name of the thickness variable. Defaults to e3t, or the only variable in the file
+    surface_level : str
+        "top" or "bottom"
+
+    Returns
+    -------
+    depths : xarray.DataArray
+    bathymetry : xarray.DataArray
+
+    """
+    key = _file_key(ff) + (variable, surface_level)
+    if key in _depth_cache:
+        return _depth_cache[key]
+    da = _read_thickness(ff, variable=variable, time=0)
+    depths = da.copy(data=layer_depths(da.values, surface_level=surface_level).astype("float32"))
+    depths.name = "depth"
+    depths.attrs = {"long_name": "depth of layer centre", "units": "m"}
+    bathymetry = da.isel({_level_dim(da): 0}, drop=True).copy(
+        data=water_depth(da.values).astype("float32")
+    )
+    bathymetry.name = "bathymetry"
+    bathymetry.attrs = {"long_name": "model bathymetry", "units": "m"}
+    _depth_cache[key] = (depths, bathymetry)
+    return depths, bathymetry
+
+
+def depth_dataset(ff, variable=None, surface_level="top"):
+    """
+    Layer-centre depths as an nctoolkit dataset, for use in match_points
+    """
+    depths, bathymetry = depth_fields(ff, variable=variable, surface_level=surface_level)
+    ds_depths = nc.from_xarray(depths.to_dataset())
+    ds_depths.run()
+    return ds_depths
+
+
+def write_bathymetry(ff, out, variable=None):
+    """
+    Save the model bathymetry to a netCDF file
+    """
+    depths, bathymetry = depth_fields(ff, variable=variable)
+    if os.path.dirname(out) != "" and not os.path.exists(os.path.dirname(out)):
+        os.makedirs(os.path.dirname(out))
+    bathymetry.to_dataset().to_netcdf(
+        out, encoding={"bathymetry": {"zlib": True, "complevel": 5}}
+    )
+
+
+def timestep_depths(ff, time, variable=None, surface_level="top"):
+    """
+    Layer-centre depths for a single time step of a variable volume run
+
+    Only one time step of the thickness is read, so the full 4D depths are never held in memory.
+
+    Parameters
+    ----------
+    ff : str
+        File with time-varying layer thicknesses
+    time : int
+        Index of the time step
+
+    Returns
+    -------
+    ds_depths : nctoolkit.DataSet
+
+    """
+    da = _read_thickness(ff, variable=variable, time=time)
+    depths = da.copy(data=layer_depths(da.values, surface_level=surface_level).astype("float32"))
+    depths.name = "depth"
+    ds_depths = nc.from_xarray(depths.to_dataset())
+    ds_depths.run()
+    return ds_depths
@@ -0,0 +1,396 @@
+import os
+import glob
+import time
+import multiprocessing
+import multiprocessing.util
+import pandas as pd
+from tqdm import tqdm
+
+
+# the analysis stack imported by chunk_start, which warm kernels load before any notebook runs
+warm_modules = [
+    "numpy",
+    "pandas",
+    "xarray",
+    "nctoolkit",
+    "matplotlib.pyplot",
+    "geopandas",
+    "holoviews",
+    "hvplot.xarray",
+    "hvplot.pandas",
+    "plotnine",
+    "cmocean",
+    "holteandtalley",
+    "jellyfish",
+    "ecoval",
+]
+
+# module-level state that depends on the run, rather than only on the files it was built from.
+# It is cleared between notebooks on a warm kernel. Caches keyed by grid fingerprints, or by file
+# paths with their size and modification time, stay valid and are kept, e.g. the masks in
+# ecoval.masks, the fingerprints in ecoval.utils and the depths in ecoval.depths
+process_caches = {
+    "ecoval.statistics": ["_labels"],
+}
+
+# nctoolkit options a notebook may change, restored between notebooks on a warm kernel
+nctoolkit_options = ["lazy", "precision", "parallel", "progress", "checks", "cores", "temp_dir"]
+
+# the nctoolkit options of a warm kernel before any notebook ran
+_default_options = dict()
+
+
+def save_options():
+    """
+    Record the nctoolkit options of a freshly started kernel
+    """
+    import sys
+
+    if "nctoolkit" not in sys.modules:
+        return None
+    session_info = sys.modules["nctoolkit"].session.session_info
+    for key in nctoolkit_options:
+        if key in session_info:
+            _default_options[key] = session_info[key]
+
+
+def reset_process_state():
+    """
+    Clear the module state a notebook leaves behind in a warm kernel
+
+    The caches in process_caches are emptied and the nctoolkit options are put back to their
+    values when the kernel started, so each notebook sees the same state as in a fresh
+    kernel. Imported modules, the R session and the caches of immutable inputs are kept.
+    """
+    import sys
+
+    for name, caches in process_caches.items():
+        if name in sys.modules:
+            for cache in caches:
+                getattr(sys.modules[name], cache).clear()
+    if "nctoolkit" in sys.modules:
+        sys.modules["nctoolkit"].session.session_info.update(_default_options)
+
+
+_warm_code = """
+import importlib
+for _module in {modules!r}:
+    try:
+        importlib.import_module(_module)
+    except Exception:
+        pass
+try:
+    importlib.import_module("ecoval.execution").save_options()
+except Exception:
+    pass
+try:
+    get_ipython().run_line_magic("load_ext", "rpy2.ipython")
+    get_ipython().run_cell_magic("R", "", "invisible(NULL)")
+except Exception:
+    pass
+"""
+
+# clears everything the previous notebook defined, including the run state and nctoolkit
+# options, but keeps the imported modules, file caches and R running
+_reset_code = """%reset -f
+import os as _os, sys as _sys
+if "ecoval.execution" in _sys.modules:
+    _sys.modules["ecoval.execution"].reset_process_state()
+if "rpy2.ipython" in get_ipython().extension_manager.loaded:
+    get_ipython().run_cell_magic("R", "", "rm(list = ls())")
+if "matplotlib.pyplot" in _sys.modules:
+    _sys.modules["matplotlib.pyplot"].close("all")
+_os.chdir({cwd!r})
+del _os, _sys
+"""
+
+
+class WarmKernel(object):
+    """
+    A kernel that has already imported the analysis stack, and is reused for several notebooks
+
+    Attributes
+    ----------
+    km : jupyter_client.KernelManager
+    kc : jupyter_client.BlockingKernelClient
+    startup_timeout : int
+        Maximum time in seconds for the kernel to start and load the analysis stack
+
+    """
+
+    def __init__(self, startup_timeout=600):
+        self.startup_timeout = startup_timeout
+        self.km = None
+        self.kc = None
+
+    def __repr__(self):
+        return f"<WarmKernel: {'running' if self.alive else 'stopped'}>"
+
+    @property
+    def alive(self):
+        return self.km is not None and self.km.is_alive()
+
+    def start(self):
+        from jupyter_client import KernelManager
+
+        self.km = KernelManager(kernel_name="python3")
+        self.km.start_kernel()
+        self.kc = self.km.client()
+        self.kc.start_channels()
+        self.kc.wait_for_ready(timeout=self.startup_timeout)
+        self.run(_warm_code.format(modules=warm_modules), timeout=self.startup_timeout)
+        return self
+
+    def run(self, code, timeout=None):
+        self.kc.execute_interactive(
+            code, store_history=False, timeout=timeout, output_hook=lambda msg: None
+        )
+
+    def reset(self, cwd):
+        """
+        Clear the state left by the previous notebook and move to the directory of the next one
+        """
+        self.run(_reset_code.format(cwd=cwd), timeout=self.startup_timeout)
+
+    def restart(self):
+        self.shutdown()
+        return self.start()
+
+    def shutdown(self):
+        if self.kc is not None:
+            self.kc.stop_channels()
+        if self.km is not None and self.km.has_kernel:
+            self.km.shutdown_kernel(now=True)
+        self.kc = None
+        self.km = None
+
+
+# the warm kernel of this process, if there is one
+_warm_kernel = None
+
+
+def start_warm_kernel(startup_timeout=600):
+    """
+    Start the warm kernel of this process. It is shut down when the process exits
+    """
+    global _warm_kernel
+    _warm_kernel = WarmKernel(startup_timeout).start()
+    multiprocessing.util.Finalize(None, stop_warm_kernel, exitpriority=10)
+    return _warm_kernel
+
+
+def stop_warm_kernel():
+    global _warm_kernel
+    if _warm_kernel is not None:
+        _warm_kernel.shutdown()
+    _warm_kernel = None
+
+
+def execute_notebook(path, timeout=3600, cell_timeout=500):
+    """
+    Execute a notebook, in its own directory, and save the outputs in place
+
+    If the process has a warm kernel, see start_warm_kernel, the notebook runs on it after its
+    state has been reset. Otherwise a new kernel is started.
+
+    Parameters
+    ----------
+    path : str
+        Path to the notebook
+    timeout : int
+        Maximum time in seconds for the whole notebook. None for no limit
+    cell_timeout : int
+        Maximum time in seconds for each cell
+
+    Returns
+    -------
+    timing : dict
+        The notebook, the time taken in seconds, and the status: "ok", "error" or "timeout"
+
+    """
+    import nbformat
+    from nbclient import NotebookClient
+    from nbclient.exceptions import CellExecutionError, CellTimeoutError
+
+    start = time.time()
+    nb = nbformat.read(path, as_version=4)
+    cwd = os.path.dirname(os.path.abspath(path))
+
+    def cell_limit(cell):
+        # the notebook time limit is enforced through nbclient's cell timeouts, so it works
+        # in any thread and on any platform
+        if timeout is None:
+            return cell_timeout
+        remaining = max(1, int(start + timeout - time.time()))
+        if cell_timeout is None:
+            return remaining
+        return min(cell_timeout, remaining)
+
+    client = NotebookClient(
+        nb,
+        timeout_func=cell_limit,
+        resources={"metadata": {"path": cwd}},
+    )
+    warm = _warm_kernel
+    if warm is not None:
+        # run on the warm kernel of this process, rather than starting a new one
+        if not warm.alive:
+            warm.restart()
+        warm.reset(cwd)
+        client.km = warm.km
+        client.kc = warm.kc
+        client.owns_km = False
+    status = "ok"
+    try:
+        client.execute()
+    except CellTimeoutError:
+        status = "timeout"
+    except CellExecutionError:
+        status = "error"
+    except Exception:
+        status = "error"
+    seconds = round(time.time() - start, 2)
+    if warm is not None and (status == "timeout" or not warm.alive):
+        # the kernel may still be busy, or have died, so the next notebook needs a fresh one
+        warm.restart()
+    # partially executed notebooks are kept, so the book shows where they failed
+    nbformat.write(nb, path)
+    return {
+        "notebook": os.path.basename(path),
+        "seconds": seconds,
+        "status": status,
+    }
+
+
+def cache_path(book_dir):
+    """
+    The execution cache jupyter-book uses for a book
+    """
+    return os.path.abspath(f"{book_dir}/_build/.jupyter_cache")
+
+
+def _cache_notebooks(book_dir, paths):
+    """
+    Add executed notebooks to the book's execution cache, and tell jupyter-book to use it
+
+    If jupyter-cache is not installed, or the cache cannot be written, the book is built from
+    the outputs stored in the notebooks. Either way the notebooks are not run again.
+
+    Returns
+    -------
+    mode : str
+        The execute_notebooks setting written to the book's _config.yml, "cache" or "off"
+    """
+    try:
+        from jupyter_cache import get_cache
+    except ImportError:
+        get_cache = None
+    mode = "off"
+    if get_cache is None:
+        print("jupyter-cache is not installed, so the book uses the outputs stored in the notebooks")
+    else:
+        try:
+            cache = get_cache(cache_path(book_dir))
+            for ff in paths:
+                cache.cache_notebook_file(
+                    ff, uri=os.path.abspath(ff), check_validity=False, overwrite=True
+                )
+            mode = "cache"
+        except Exception as e:
+            print(f"Unable to cache the executed notebooks ({e}), so the book uses their stored outputs")
+
+    config = f"{book_dir}/_config.yml"
+    with open(config, "r") as file:
+        lines = file.read().split("\n")
+    new_lines = []
+    for line in lines:
+        if line.strip().startswith("execute_notebooks:"):
+            new_lines.append(f"  execute_notebooks: \"{mode}\"")
+            if mode == "cache":
+                new_lines.append(f"  cache: {cache_path(book_dir)}")
+        elif line.strip().startswith("cache:"):
+            continue
+        else:
+            new_lines.append(line)
+    with open(config, "w") as file:
+        file.write("\n".join(new_lines))
+    return mode
+
+
+def execute_notebooks(
+    book_dir, cores=None, timeout=3600, cell_timeout=500, notebooks=None, warm=True
+):
+    """
+    Execute the notebooks of a book concurrently, so the book build does not re-run them
+
+    Parameters
+    ----------
+    book_dir : str
+        The book directory
+    cores : int
+        Number of notebooks to execute at once. Default is None, which means all cores are used
+    timeout : int
+        Maximum time in seconds for each notebook
+    cell_timeout : int
+        Maximum time in seconds for each cell
+    notebooks : list
+        The notebooks to execute. Default is None, which means all notebooks in the book.
+        The others are assumed to have been executed already
+    warm : bool
+        Run the notebooks on a pool of kernels that have already imported the analysis stack
+        and started R, so each notebook only pays for its own work. Default is True
+
+    Returns
+    -------
+    timings : pandas.DataFrame
+        The time taken for each notebook, which is also saved to {book_dir}/execution_times.csv
+
+    """
+    all_paths = sorted(glob.glob(f"{book_dir}/notebooks/*.ipynb"))
+    if len(all_paths) == 0:
+        return None
+    paths = all_paths
+    if notebooks is not None:
+        notebooks = [os.path.basename(x) for x in notebooks]
+        paths = [x for x in all_paths if os.path.basename(x) in notebooks]
+    if len(paths) == 0:
+        # every notebook was reused, so there is no need to start any kernels
+        _cache_notebooks(book_dir, all_paths)
+        return pd.DataFrame(columns=["notebook", "seconds", "status"])
+    if cores is None:
+        cores = os.cpu_count()
+    cores = max(1, min(cores, len(paths)))
+
+    timings = []
+    if cores > 1:
+        if warm:
+            # each worker keeps one warm kernel, which is reset between notebooks
+            pool = multiprocessing.Pool(cores, initializer=start_warm_kernel)
+        else:
+            # each notebook gets a fresh worker, so nothing leaks between them
+            pool = multiprocessing.Pool(cores, maxtasksperchild=1)
+        jobs = [
+            pool.apply_async(execute_notebook, [ff, timeout, cell_timeout])
+            for ff in paths
+        ]
+        pool.close()
+        for job in tqdm(jobs):
+            timings.append(job.get())
+        pool.join()
+    else:
+        if warm:
+            start_warm_kernel()
+        try:
+            for ff in tqdm(paths):
+                timings.append(execute_notebook(ff, timeout, cell_timeout))
+        finally:
+            stop_warm_kernel()
+
+    timings = pd.DataFrame(timings, columns=["notebook", "seconds", "status"])
+    timings.to_csv(f"{book_dir}/execution_times.csv", index=False)
+    failed = timings.query("status != 'ok'")
+    for i in range(len(failed)):
+        print(f"Warning: {failed.notebook.values[i]} did not run successfully ({failed.status.values[i]})")
+
+    _cache_notebooks(book_dir, all_paths)
+    return timings
@@ -0,0 +1,214 @@
+import multiprocessing
+import numpy as np
+import xarray as xr
+import nctoolkit as nc
+from tqdm import tqdm
+from ecoval.session import session_info
+from ecoval.utils import bin_value, grid_fingerprint, fvcom_drop, _coordinate_names
+
+
+# node-to-target weights, computed once per mesh and target grid
+_fvcom_weights = dict()
+
+
+def _unit_vectors(lon, lat):
+    """
+    Convert lon/lat in degrees to points on the unit sphere
+    """
+    lon = np.deg2rad(np.asarray(lon, dtype="float64"))
+    lat = np.deg2rad(np.asarray(lat, dtype="float64"))
+    return np.column_stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+    )
+
+
+def _target_grid(target):
+    """
+    Read the target grid coordinates, as 1D lon/lat if the grid is regular
+    """
+    with xr.open_dataset(target, decode_times=False) as ds:
+        lon_name, lat_name = _coordinate_names(ds)
+        lons = ds[lon_name].values.astype("float64")
+        lats = ds[lat_name].values.astype("float64")
+    return lons, lats
+
+
+def fvcom_weights(ff, target, coverage_res=0.25):
+    """
+    Work out the nearest-neighbour weights from an FVCOM mesh to a target grid
+
+    Parameters
+    ----------
+    ff : str
+        An FVCOM output file
+    target : str
+        A netCDF file on the target grid
+    coverage_res : float
+        Resolution of the bins used to decide which target cells are covered by the mesh. A
+        target cell is covered if its bin holds at least one node. This replaces the CDO
+        coverage mask, which was bilinearly interpolated from the bins, so at the edges of the
+        mesh cells are kept whose own bin has nodes, even if a neighbouring bin has none
+
+    Returns
+    -------
+    weights : dict
+        Nearest node of each target cell ("index"), cells covered by the mesh ("coverage"),
+        the target coordinates ("lon", "lat") and the extent of the mesh ("extent")
+
+    """
+    key = (grid_fingerprint(ff), grid_fingerprint(target), coverage_res)
+    if key in _fvcom_weights:
+        return _fvcom_weights[key]
+
+    from scipy.spatial import cKDTree
+
+    with xr.open_dataset(ff, drop_variables=fvcom_drop, decode_times=False) as ds:
+        node_lon = ds.lon.values.astype("float64")
+        node_lat = ds.lat.values.astype("float64")
+
+    # handle longitudes over 180 appropriately
+    node_lon = np.where(node_lon > 180, node_lon - 360, node_lon)
+    extent = [
+        float(node_lon.min()),
+        float(node_lon.max()),
+        float(node_lat.min()),
+        float(node_lat.max()),
+    ]
+
+    lons, lats = _target_grid(target)
+    if lons.ndim == 1:
+        lon_grid, lat_grid = np.meshgrid(lons, lats)
+    else:
+        lon_grid, lat_grid = lons, lats
+
+    tree = cKDTree(_unit_vectors(node_lon, node_lat))
+    distance, index = tree.query(_unit_vectors(lon_grid.flatten(), lat_grid.flatten()))
+
+    # cells are covered if their bin holds at least one node
+    def bin_keys(lon, lat):
+        lon = np.round(bin_value(np.asarray(lon), coverage_res) / coverage_res).astype("int64")
+        lat = np.round(bin_value(np.asarray(lat), coverage_res) / coverage_res).astype("int64")
+        return lon * 100000 + lat
+
+    node_bins = np.unique(bin_keys(node_lon, node_lat))
+    target_lon = np.where(lon_grid > 180, lon_grid - 360, lon_grid)
+    coverage = np.isin(bin_keys(target_lon.flatten(), lat_grid.flatten()), node_bins)
+
+    weights = {
+        "index": index.reshape(lon_grid.shape),
+        "coverage": coverage.reshape(lon_grid.shape),
+        "lon": lons,
+        "lat": lats,
+        "extent": extent,
+    }
+    _fvcom_weights[key] = weights
+    return weights
+
+
+def fvcom_remap(ff, target, variables, coverage_res=0.25):
+    """
+    Remap the surface layer of FVCOM variables to a target grid
+
+    Parameters
+    ----------
+    ff : str
+        An FVCOM output file
+    target : str
+        A netCDF file on the target grid
+    variables : list or str
+        Variables to remap
+
+    Returns
+    -------
+    ds : xarray.Dataset
+        The remapped variables, with zeros and cells outside the mesh set to missing
+
+    """
+    if isinstance(variables, str):
+        variables = [variables]
+    weights = fvcom_weights(ff, target, coverage_res=coverage_res)
+    index = weights["index"]
+    coverage = weights["coverage"]
+    lons = weights["lon"]
+    lats = weights["lat"]
+    if lons.ndim == 1:
+        horizontal = ["lat", "lon"]
+        coords = {"lon": ("lon", lons), "lat": ("lat", lats)}
+    else:
+        horizontal = ["y", "x"]
+        coords = {"lon": (("y", "x"), lons), "lat": (("y", "x"), lats)}
+
+    with xr.open_dataset(ff, drop_variables=fvcom_drop, decode_times=False) as ds:
+        data_vars = dict()
+        other_coords = set()
+        for vv in variables:
+            da = ds[vv]
+            # only the surface layer is needed
+            for dim in da.dims:
+                if dim.startswith("siglay") or dim.startswith("siglev"):
+                    da = da.isel({dim: 0})
+            node_dim = [x for x in da.dims if x in ds.lon.dims][0]
+            other_dims = [x for x in da.dims if x != node_dim]
+            values = da.transpose(*(other_dims + [node_dim])).values.astype("float64")
+            values = values[..., index]
+            values[..., ~coverage] = np.nan
+            values[values == 0] = np.nan
+            data_vars[vv] = (other_dims + horizontal, values.astype("float32"), da.attrs)
+            other_coords.update([x for x in other_dims if x in ds.coords])
+        for dim in other_coords:
+            coords[dim] = ds[dim]
+    return xr.Dataset(data_vars, coords=coords)
+
+
+def fvcom_regrid_files(files, target, variables, cores=1, coverage_res=0.25):
+    """
+    Remap the surface layer of a set of FVCOM files to a target grid
+
+    The weights and coverage mask are worked out once, and the files are remapped
+    across a worker pool.
+
+    Parameters
+    ----------
+    files : list
+        FVCOM output files, all on the same mesh
+    target : str
+        A netCDF file on the target grid
+    variables : list or str
+        Variables to remap
+    cores : int
+        Number of worker processes
+
+    Returns
+    -------
+    ds : nctoolkit.DataSet
+        The remapped files, merged in time
+
+    """
+    if isinstance(files, str):
+        files = [files]
+    files = sorted(files)
+    # workers inherit the weights, so they are only computed once
+    weights = fvcom_weights(files[0], target, coverage_res=coverage_res)
+    session_info["extent"] = weights["extent"]
+
+    results = []
+    if cores > 1 and len(files) > 1:
+        pool = multiprocessing.Pool(cores)
+        jobs = [
+            pool.apply_async(fvcom_remap, [ff, target, variables, coverage_res])
+            for ff in files
+        ]
+        pool.close()
+        for job in tqdm(jobs):
+            results.append(job.get())
+        pool.join()
+    else:
+        for ff in tqdm(files):
+            results.append(fvcom_remap(ff, target, variables, coverage_res))
+
+    time_dims = [x for x in results[0].dims if "time" in x.lower()]
+    if len(time_dims) > 0 and len(results) > 1:
+        ds_xr = xr.concat(results, dim=time_dims[0])
+    else:
+        ds_xr = results[0]
+    return nc.from_xarray(ds_xr)
@@ -0,0 +1,427 @@
+import os
+import numpy as np
+import xarray as xr
+import pkg_resources
+from ecoval.session import session_info
+from ecoval.utils import fvcom_drop, grid_descriptor, grid_fingerprint, _coordinate_names, _file_key
+from ecoval.registry import builtin_grids, registered_name
+
+
+# grid information is loaded lazily and shared by everything in the process, by the size and
+# modification time of the saved file
+_grid_info = dict()
+
+
+def is_global_grid(extent):
+    """
+    Check if a grid extent covers the globe, or at least more than the north-west European shelf
+
+    Parameters
+    ----------
+    extent : list
+        A list of the form [lon_min, lon_max, lat_min, lat_max]
+
+    Returns
+    -------
+    global_grid : bool
+
+    """
+    lon_min, lon_max, lat_min, lat_max = extent
+    if lon_max - lon_min > 350:
+        return True
+    if lat_max - lat_min > 170:
+        return True
+    if lon_max > 50:
+        return True
+    return False
+
+
+def covers_globe(lons, lats):
+    """
+    Check if coordinates span the globe, the rule the report notebooks use for global grids
+
+    The chunks and the statistics stage use this rule, so they agree with the notebooks on
+    which regions exist. Matchups use is_global_grid, which also treats grids east of 50E as
+    global.
+
+    Parameters
+    ----------
+    lons, lats : numpy.ndarray
+        The longitudes and latitudes
+
+    Returns
+    -------
+    global_grid : bool
+
+    """
+    lon_range = np.nanmax(lons) - np.nanmin(lons)
+    lat_range = np.nanmax(lats) - np.nanmin(lats)
+    return bool(lon_range > 340 and lat_range > 160)
+
+
+def grid_info_path():
+    """
+    The path of the serialized model grid information
+    """
+    return session_info.get("out_dir", "") + "matched/model_grid.npz"
+
+
+def _spherical_areas(lons, lats):
+    """
+    Approximate cell areas in square metres from the coordinate spacing
+    """
+    radius = 6371000.0
+    if np.ndim(lons) == 1:
+        lons, lats = np.meshgrid(lons, lats)
+    dlon = np.abs(np.gradient(lons, axis=-1)) if lons.shape[-1] > 1 else np.zeros(lons.shape)
+    dlat = np.abs(np.gradient(lats, axis=0)) if lats.shape[0] > 1 else np.zeros(lats.shape)
+    dlon = np.where(dlon > 180, 360 - dlon, dlon)
+    return radius**2 * np.deg2rad(dlon) * np.deg2rad(dlat) * np.cos(np.deg2rad(lats))
+
+
+def _cell_areas(ds, lons, lats, grid_type):
+    """
+    Work out the horizontal cell areas in square metres
+    """
+    # NEMO and FVCOM store the cell areas, so use them if possible
+    if "e1t" in ds.variables and "e2t" in ds.variables:
+        area = np.squeeze(ds["e1t"].values * ds["e2t"].values)
+        return np.asarray(area, dtype="float64")
+    if "art1" in ds.variables and grid_type == "unstructured":
+        return np.asarray(ds["art1"].values, dtype="float64").flatten()
+    if grid_type == "unstructured":
+        return None
+    return _spherical_areas(np.asarray(lons, dtype="float64"), np.asarray(lats, dtype="float64"))
+
+
+class GridInfo(object):
+    """
+    Facts about a model grid, which are computed once per run and shared across modules
+
+    Attributes
+    ----------
+    lon, lat : numpy.ndarray
+        The longitude and latitude coordinates. Regular grids have 1D coordinates
+    grid_type : str
+        "lonlat", "generic", "curvilinear" or "unstructured"
+    extent : list
+        The extent of the wet cells, [lon_min, lon_max, lat_min, lat_max]
+    resolution : list
+        The horizontal resolution, [lon_res, lat_res]
+    known_grid : str
+        The name of a recognized grid, e.g. "amm7", or an empty string
+    wet : numpy.ndarray
+        Boolean mask of cells with data in the surface (or bottom) level
+    bottom_index : numpy.ndarray
+        Index of the deepest level with data in each cell, -1 for land
+    area : numpy.ndarray
+        Cell areas in square metres, or None if they are unknown
+    fingerprint : str
+        The fingerprint of the grid in the model output
+
+    """
+
+    def __init__(
+        self,
+        lon,
+        lat,
+        grid_type,
+        extent,
+        resolution,
+        known_grid="",
+        wet=None,
+        bottom_index=None,
+        area=None,
+        fingerprint="",
+    ):
+        self.lon = np.asarray(lon)
+        self.lat = np.asarray(lat)
+        self.grid_type = str(grid_type)
+        self.extent = [float(x) for x in extent]
+        self.resolution = [float(x) for x in resolution]
+        self.known_grid = str(known_grid)
+        self.wet = wet
+        self.bottom_index = bottom_index
+        self.area = area
+        self.fingerprint = str(fingerprint)
+
+    def __repr__(self):
+        return (
+            f"<GridInfo: {self.grid_type} grid, shape {self.shape}, "
+            f"extent {[round(x, 3) for x in self.extent]}, known grid '{self.known_grid}'>"
+        )
+
+    @property
+    def shape(self):
+        if self.wet is not None:
+            return self.wet.shape
+        if self.grid_type in ["lonlat", "generic"]:
+            return (len(self.lat), len(self.lon))
+        return self.lon.shape
+
+    @property
+    def amm7(self):
+        return self.known_grid == "amm7"
+
+    @property
+    def global_grid(self):
+        return is_global_grid(self.extent)
+
+    @property
+    def domain(self):
+        if self.global_grid:
+            return "global"
+        return "nws"
+
+    @property
+    def bounds(self):
+        """
+        The range of the coordinates, [lon_min, lon_max, lat_min, lat_max]
+        """
+        return [
+            float(np.nanmin(self.lon)),
+            float(np.nanmax(self.lon)),
+            float(np.nanmin(self.lat)),
+            float(np.nanmax(self.lat)),
+        ]
+
+    def coordinates(self):
+        """
+        Longitude and latitude of every cell, as arrays with the shape of the grid
+        """
+        if self.grid_type in ["lonlat", "generic"] and self.lon.ndim == 1:
+            return np.meshgrid(self.lon, self.lat)
+        return self.lon, self.lat
+
+    def to_dataframe(self):
+        """
+        Longitude and latitude of the wet cells, as in the old matched/model_grid.csv
+        """
+        import pandas as pd
+
+        lons, lats = self.coordinates()
+        if self.wet is not None:
+            lons = lons[self.wet]
+            lats = lats[self.wet]
+        return (
+            pd.DataFrame({"lon": lons.flatten(), "lat": lats.flatten()})
+            .drop_duplicates()
+            .reset_index(drop=True)
+        )
+
+    def save(self, path=None):
+        """
+        Save the grid information in numpy's compressed binary format
+        """
+        if path is None:
+            path = grid_info_path()
+        if os.path.dirname(path) != "" and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        arrays = dict(
+            lon=self.lon,
+            lat=self.lat,
+            grid_type=np.array(self.grid_type),
+            extent=np.array(self.extent),
+            resolution=np.array(self.resolution),
+            known_grid=np.array(self.known_grid),
+            fingerprint=np.array(self.fingerprint),
+        )
+        for key in ["wet", "bottom_index", "area"]:
+            if getattr(self, key) is not None:
+                arrays[key] = getattr(self, key)
+        # np.savez adds .npz to the file name, so use a file handle
+        with open(path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+
+    @classmethod
+    def load(cls, path=None):
+        """
+        Load grid information saved by GridInfo.save
+        """
+        if path is None:
+            path = grid_info_path()
+        with np.load(path, allow_pickle=False) as data:
+            optional = dict()
+            for key in ["wet", "bottom_index", "area"]:
+                if key in data.files:
+                    optional[key] = data[key]
+            return cls(
+                lon=data["lon"],
+                lat=data["lat"],
+                grid_type=data["grid_type"].item(),
+                extent=data["extent"],
+                resolution=data["resolution"],
+                known_grid=data["known_grid"].item(),
+                fingerprint=data["fingerprint"].item(),
+                **optional,
+            )
+
+
+def _valid_levels(ds, variable, lon_name, lat_name):
+    """
+    Boolean array (level, y, x) of where the first time step of a variable has data
+    """
+    da = ds[variable]
+    horizontal = list(ds[lat_name].dims) + [x for x in ds[lon_name].dims if x not in ds[lat_name].dims]
+    for dim in da.dims:
+        if "time" in dim.lower():
+            da = da.isel({dim: 0})
+    vertical = [x for x in da.dims if x not in horizontal]
+    # anything beyond a single vertical dimension only needs its first element
+    for dim in vertical[1:]:
+        da = da.isel({dim: 0})
+    vertical = vertical[:1]
+    da = da.transpose(*(vertical + horizontal))
+    values = da.values
+    # zeros are treated as missing, as they are land in NEMO output
+    valid = np.isfinite(values) & (values != 0)
+    if len(vertical) == 0:
+        valid = valid[np.newaxis]
+    return valid
+
+
+def build_grid_info(ff, variable=None, surface_level="top"):
+    """
+    Work out the grid information for a model output file
+
+    Parameters
+    ----------
+    ff : str
+        Path to a model output file
+    variable : str
+        Variable used to work out the wet mask and bottom levels. Defaults to the first variable
+        on the horizontal grid
+    surface_level : str
+        "top" or "bottom". The level used for the wet mask
+
+    Returns
+    -------
+    grid_info : GridInfo
+
+    """
+    descriptor = grid_descriptor(ff)
+    with xr.open_dataset(ff, decode_times=False, drop_variables=fvcom_drop) as ds:
+        lon_name, lat_name = _coordinate_names(ds)
+        lons = ds[lon_name].values
+        lats = ds[lat_name].values
+        horizontal = set(ds[lon_name].dims).union(ds[lat_name].dims)
+        if variable is None:
+            variable = [
+                x
+                for x in ds.data_vars
+                if x not in [lon_name, lat_name] and horizontal.issubset(ds[x].dims)
+            ][0]
+        valid = _valid_levels(ds, variable, lon_name, lat_name)
+        area = _cell_areas(ds, lons, lats, descriptor["grid_type"])
+
+    n_levels = valid.shape[0]
+    any_valid = valid.any(axis=0)
+    # the deepest level with data in each column
+    bottom_index = np.where(
+        any_valid, n_levels - 1 - np.argmax(valid[::-1], axis=0), -1
+    ).astype("int32")
+    if surface_level == "top":
+        wet = valid[0]
+    else:
+        wet = any_valid
+
+    known_grid = registered_name(descriptor["fingerprint"])
+    if known_grid is None:
+        known_grid = ""
+        for name, info in builtin_grids.items():
+            if wet.size == info["npoints"]:
+                known_grid = name
+                break
+    grid_type = descriptor["grid_type"]
+    extent = descriptor["extent"]
+    resolution = descriptor["resolution"]
+    if known_grid in builtin_grids:
+        # AMM7 output does not describe its grid properly, so use the regular grid
+        info = builtin_grids[known_grid]
+        ff_grid = pkg_resources.resource_filename("ecoval", info["subdomains"])
+        with xr.open_dataset(ff_grid) as ds_grid:
+            lons = ds_grid.lon.values.astype("float64")
+            lats = ds_grid.lat.values.astype("float64")
+        grid_type = "lonlat"
+        resolution = [
+            float(np.median(np.diff(lons))),
+            float(np.median(np.diff(lats))),
+        ]
+        wet = wet.reshape(len(lats), len(lons))
+        bottom_index = bottom_index.reshape(len(lats), len(lons))
+        lon_grid, lat_grid = np.meshgrid(lons, lats)
+        extent = [
+            float(lon_grid[wet].min()) - resolution[0],
+            float(lon_grid[wet].max()) + resolution[0],
+            float(lat_grid[wet].min()) - resolution[1],
+            float(lat_grid[wet].max()) + resolution[1],
+        ]
+        if area is not None and area.size == info["npoints"]:
+            area = area.reshape(len(lats), len(lons))
+        else:
+            area = _spherical_areas(lons, lats)
+
+    return GridInfo(
+        lon=lons,
+        lat=lats,
+        grid_type=grid_type,
+        extent=extent,
+        resolution=resolution,
+        known_grid=known_grid,
+        wet=wet,
+        bottom_index=bottom_index,
+        area=area,
+        fingerprint=descriptor["fingerprint"],
+    )
+
+
+def get_grid_info(ff=None, path=None, **kwargs):
+    """
+    Get the model grid information, loading or building it only when first needed
+
+    Parameters
+    ----------
+    ff : str
+        Path to a model output file. Used to build the grid information if it has not been saved
+        yet, or if the saved grid information is for a different grid, e.g. from an earlier run
+        with another model in the same folder
+    path : str
+        Path of the saved grid information. Defaults to matched/model_grid.npz
+    kwargs
+        Passed to build_grid_info
+
+    Returns
+    -------
+    grid_info : GridInfo, or None if there is no grid information and no file to build it from
+
+    """
+    if path is None:
+        path = grid_info_path()
+    if os.path.exists(path):
+        key = _file_key(path)
+        if key not in _grid_info:
+            _grid_info[key] = GridInfo.load(path)
+        if ff is None or _grid_info[key].fingerprint == grid_fingerprint(ff):
+            return _grid_info[key]
+    if ff is None:
+        return None
+    grid_info = build_grid_info(ff, **kwargs)
+    set_grid_info(grid_info, path)
+    return grid_info
+
+
+def set_grid_info(grid_info, path=None):
+    """
+    Save grid information and make it the grid information for this process
+    """
+    if path is None:
+        path = grid_info_path()
+    grid_info.save(path)
+    _grid_info[_file_key(path)] = grid_info
+
+
+def reset_grid_info():
+    """
+    Forget any grid information loaded in this process
+    """
+    _grid_info.clear()
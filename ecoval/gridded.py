@@ -11,8 +11,12 @@ import nctoolkit as nc
 import xarray as xr
 
 from ecoval.fixers import tidy_warnings
-from ecoval.utils import extension_of_directory, get_extent, is_latlon, get_resolution, fvcom_regrid
+from ecoval.utils import extension_of_directory, get_extent, is_latlon, get_resolution
+from ecoval.fvcom import fvcom_regrid_files
 from ecoval.session import session_info
+from ecoval.grid import get_grid_info
+from ecoval.registry import get_bundle, regrid_nn
+from ecoval.moments import write_gridded_moments
 
 
 def write_report(x):
@@ -165,45 +169,13 @@ def gridded_matchup(
                     paths = [x for x in paths if f"{exc}" not in os.path.basename(x)]
 
                 new_paths = []
-                # set up model_grid if it doesn't exist
-
-                # This really should be a function....
-                if fvcom is False:
-                    if not os.path.exists(
-                        session_info["out_dir"] + "matched/model_grid.csv"
-                    ):
-                        ds_grid = nc.open_data(paths[0], checks=False)
-                        var = ds_grid.variables[0]
-                        ds_grid.subset(variables=selection[0], time=0)
-                        if surface_level == "top":
-                            ds_grid.top()
-                        else:
-                            ds_grid.bottom()
-                        ds_grid.as_missing(0)
-                        if max(ds_grid.contents.npoints) == 111375:
-                            amm7_out = session_info["out_dir"] + "matched/amm7.txt"
-                            # create empty file
-                            with open(amm7_out, "w") as f:
-                                f.write("")
-
-                            ff_grid = f"{obs_dir}/amm7_val_subdomains.nc"
-                            ds_grid.cdo_command(f"setgrid,{ff_grid}")
-                        df_grid = ds_grid.to_dataframe().reset_index().dropna()
-                        columns = [x for x in df_grid.columns if "lon" in x or "lat" in x]
-                        df_grid = df_grid.loc[:, columns].drop_duplicates()
-                        if not os.path.exists(session_info["out_dir"] + "matched"):
-                            os.makedirs("matched")
-                        df_grid.to_csv(
-                            session_info["out_dir"] + "matched/model_grid.csv", index=False
-                        )
-                else:
-                    drop_variables = ["siglay", "siglev"]
-                    ds_xr = xr.open_dataset(paths[0], drop_variables=drop_variables, decode_times=False)
-                    lon = ds_xr.lon.values
-                    lat = ds_xr.lat.values
-                    grid = pd.DataFrame({"lon": lon, "lat": lat})
-                    grid = grid.drop_duplicates().reset_index(drop=True)
-                    grid.to_csv(session_info["out_dir"] + "matched/model_grid.csv", index=False)
+                # set up the model grid information if it doesn't exist
+                grid_info = get_grid_info(paths[0], variable=selection[0], surface_level=surface_level)
+                if grid_info.amm7:
+                    amm7_out = session_info["out_dir"] + "matched/amm7.txt"
+                    # create empty file
+                    with open(amm7_out, "w") as f:
+                        f.write("")
 
 
                 all_years = []
@@ -325,15 +297,13 @@ def gridded_matchup(
                                     ds_surface.tmean(["year", "month"])
                     else:
                         files = paths
-                        ds_surface = nc.open_data()
                         # Read in the monthly observational data
                         vv_file = nc.create_ensemble(dir_var)
                         vv_file = [x for x in vv_file if "annual" not in x][0]
-                        # except:
-                        for ff in tqdm(files):
-                            ds_ff = fvcom_regrid(ff, vv_file, selection)
-                            ds_surface.append(ds_ff)
-                        ds_surface.merge("time")
+                        # the mesh weights are computed once and reused for every file
+                        ds_surface = fvcom_regrid_files(
+                            files, vv_file, selection, cores=session_info.get("cores", 1)
+                        )
                         ds_surface.tmean(["year", "month"])
                         ds_surface.tmean("month")
 
@@ -452,13 +422,14 @@ def gridded_matchup(
 
                     amm7 = False
                     if domain == "nws":
-                        if max(ds_surface.contents.npoints) == 111375:
-                            try:
-                                ds_surface.fix_amm7_grid()
-                            except:
-                                pass
-                            amm7 = True
-                            ds_surface.subset(lon=[-19, 9], lat=[41, 64.3])
+                        # known grids have their grid description and clipping region precomputed
+                        bundle = get_bundle()
+                        if bundle is not None:
+                            bundle.fix_grid(ds_surface)
+                            amm7 = bundle.name == "amm7"
+                            if bundle.clip is not None:
+                                clip_lons, clip_lats = bundle.clip_box()
+                                ds_surface.subset(lon=clip_lons, lat=clip_lats)
 
                     if vv in ["poc", "doc"]:
                         ds_obs.run()
@@ -588,9 +559,9 @@ def gridded_matchup(
                     n2 = ds_surface.contents.npoints[0]
 
                     if n1 >= n2:
-                        ds_obs.regrid(ds_surface, method="nn")
+                        regrid_nn(ds_obs, ds_surface)
                     else:
-                        ds_surface.regrid(ds_obs, method="nn")
+                        regrid_nn(ds_surface, ds_obs)
 
                     ds_obs.rename({ds_obs.variables[0]: "observation"})
                     ds_surface.merge("time")
@@ -634,9 +605,9 @@ def gridded_matchup(
                         else:
                             ds1.vertical_interp(levels, fixed=True)
                         if n1 >= n2:
-                            ds_obs_annual.regrid(ds1, method="nn")
+                            regrid_nn(ds_obs_annual, ds1)
                         else:
-                            ds1.regrid(ds_obs_annual, method="nn")
+                            regrid_nn(ds1, ds_obs_annual)
                         ds_obs_annual.vertical_interp(levels, fixed=True)
                         ds_obs_annual.set_date(year=2000, month=1, day=1)
                         ds1.set_date(year=2000, month=1, day=1)
@@ -763,6 +734,8 @@ def gridded_matchup(
                         regrid_later = True
 
                     ds_surface.to_nc(out_file, zip=True, overwrite=True)
+                    # sufficient statistics, so metrics can be aggregated without the matched fields
+                    write_gridded_moments(out_file)
 
                 tidy_warnings(w)
 
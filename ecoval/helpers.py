@@ -2,6 +2,8 @@ import glob
 import os
 import warnings
 import xarray as xr
+from ecoval.utils import grid_descriptor
+from ecoval.grid import is_global_grid
 
 def is_int(s):
     try: 
@@ -66,23 +68,7 @@ def matchup_starting_point(ff, obs_dir = None):
     with warnings.catch_warnings(record=True) as w:
         if data_dir is None:
             data_dir = "/data/proteus1/scratch/rwi/evaldata/data/"
-        ds = xr.open_dataset(ff)
-        lon_name = [x for x in ds.coords if "lon" in x]
-        lat_name = [x for x in ds.coords if "lat" in x]
-        lon = ds[lon_name[0]].values
-        lat = ds[lat_name[0]].values
-        lon_max = lon.max()
-        lon_min = lon.min()
-        lat_max = lat.max()
-        lat_min = lat.min()
-
-    global_grid = False
-    if lon_max - lon_min > 350:
-        global_grid = True
-    if lat_max - lat_min > 170:
-        global_grid = True
-    if lon_max > 50:
-        global_grid = True
+        global_grid = is_global_grid(grid_descriptor(ff)["extent"])
 
     if global_grid:
         model_domain = "global"
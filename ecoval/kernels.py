@@ -0,0 +1,177 @@
+import numpy as np
+
+
+temporal_metric_names = ["cor", "bias", "rmse", "slope"]
+
+# number of values each tile works on at once
+tile_values = 2**22
+
+
+def spatial_tiles(shape, n_times, size=None):
+    """
+    Split the cells of a grid into tiles, so the temporaries of each tile stay small
+
+    Parameters
+    ----------
+    shape : tuple
+        The spatial shape of the fields
+    n_times : int
+        Number of time steps
+    size : int
+        Number of cells in each tile. Default is enough cells for tile_values values
+
+    Returns
+    -------
+    tiles : list
+        Slices of the flattened cells
+
+    """
+    n_cells = int(np.prod(shape))
+    if size is None:
+        size = max(1, tile_values // max(1, n_times))
+    return [slice(i, min(i + size, n_cells)) for i in range(0, n_cells, size)]
+
+
+def _tile_metrics(x, y, min_n):
+    """
+    Temporal metrics of (time, cells) arrays, from one pass over the paired values
+    """
+    valid = np.isfinite(x) & np.isfinite(y)
+    n = valid.sum(axis=0)
+    x = np.where(valid, x, 0)
+    y = np.where(valid, y, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = x.sum(axis=0) / n
+        y_mean = y.sum(axis=0) / n
+        dx = np.where(valid, x - x_mean, 0)
+        dy = np.where(valid, y - y_mean, 0)
+        sxx = (dx * dx).sum(axis=0)
+        syy = (dy * dy).sum(axis=0)
+        sxy = (dx * dy).sum(axis=0)
+        cor = sxy / np.sqrt(sxx * syy)
+        slope = sxy / syy
+        bias = x_mean - y_mean
+        rmse = np.sqrt(((x - y) ** 2).sum(axis=0) / n)
+    short = n < min_n
+    cor[short | ~np.isfinite(cor)] = np.nan
+    slope[short | ~np.isfinite(slope)] = np.nan
+    bias[n == 0] = np.nan
+    rmse[n == 0] = np.nan
+    return {"cor": cor, "bias": bias, "rmse": rmse, "slope": slope}
+
+
+def temporal_metrics(model, observation, min_n=3, tile_size=None):
+    """
+    Per-cell temporal statistics of model and observation fields
+
+    The cells are processed in spatial tiles, so memory use is bounded by the tile size
+    rather than the grid size.
+
+    Parameters
+    ----------
+    model, observation : numpy.ndarray
+        Fields with time as the first dimension
+    min_n : int
+        Minimum number of paired time steps for the correlation and slope
+    tile_size : int
+        Number of cells in each tile. Default is set by tile_values
+
+    Returns
+    -------
+    metrics : dict
+        Fields with the spatial shape of the inputs:
+
+        - cor, the Pearson correlation over time
+        - bias, the mean of model minus observation
+        - rmse, the root mean square difference
+        - slope, the least squares slope of the model against the observation
+
+    """
+    if model.shape != observation.shape:
+        raise ValueError("model and observation must have the same shape")
+    n_times = model.shape[0]
+    shape = model.shape[1:]
+    x = model.reshape(n_times, -1)
+    y = observation.reshape(n_times, -1)
+    metrics = {key: np.full(x.shape[1], np.nan) for key in temporal_metric_names}
+    for tile in spatial_tiles(shape, n_times, tile_size):
+        tile_metrics = _tile_metrics(
+            x[:, tile].astype("float64"), y[:, tile].astype("float64"), min_n
+        )
+        for key in temporal_metric_names:
+            metrics[key][tile] = tile_metrics[key]
+    return {key: values.reshape(shape) for key, values in metrics.items()}
+
+
+trend_names = ["slope", "intercept", "r_squared", "p_value", "n"]
+
+
+def linear_trends(times, values, min_n=3, tile_size=None):
+    """
+    Per-cell least squares linear trends, with their significance
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        The time of each field, e.g. the year
+    values : numpy.ndarray
+        Fields with time as the first dimension. Missing values are ignored
+    min_n : int
+        Minimum number of values for a trend
+    tile_size : int
+        Number of cells in each tile. Default is set by tile_values
+
+    Returns
+    -------
+    trends : dict
+        Fields with the spatial shape of the values:
+
+        - slope, the change per unit of time
+        - intercept, the value at time zero
+        - r_squared, the fraction of the variance explained by the trend
+        - p_value, the two-sided p-value of the slope, from a t-test
+        - n, the number of values
+
+    """
+    from scipy.stats import t as t_distribution
+
+    times = np.asarray(times, dtype="float64")
+    n_times = values.shape[0]
+    if len(times) != n_times:
+        raise ValueError("There must be one time for each field")
+    shape = values.shape[1:]
+    y_all = values.reshape(n_times, -1)
+    trends = {key: np.full(y_all.shape[1], np.nan) for key in trend_names}
+    for tile in spatial_tiles(shape, n_times, tile_size):
+        y = y_all[:, tile].astype("float64")
+        valid = np.isfinite(y)
+        n = valid.sum(axis=0)
+        x = np.where(valid, times[:, None], 0)
+        y = np.where(valid, y, 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            x_mean = x.sum(axis=0) / n
+            y_mean = y.sum(axis=0) / n
+            dx = np.where(valid, x - x_mean, 0)
+            dy = np.where(valid, y - y_mean, 0)
+            sxx = (dx * dx).sum(axis=0)
+            syy = (dy * dy).sum(axis=0)
+            sxy = (dx * dy).sum(axis=0)
+            slope = sxy / sxx
+            residual = np.maximum(syy - slope * sxy, 0)
+            r_squared = np.where(syy > 0, 1 - residual / syy, np.nan)
+            se = np.sqrt(residual / (n - 2) / sxx)
+            t_value = slope / se
+            p_value = 2 * t_distribution.sf(np.abs(t_value), n - 2)
+        p_value = np.where(se == 0, 0.0, p_value)
+        short = (n < min_n) | (sxx == 0)
+        tile_trends = {
+            "slope": slope,
+            "intercept": y_mean - slope * x_mean,
+            "r_squared": r_squared,
+            "p_value": p_value,
+        }
+        for key in tile_trends:
+            tile_trends[key][short] = np.nan
+            trends[key][tile] = tile_trends[key]
+        trends["n"][tile] = n
+    return {key: values.reshape(shape) for key, values in trends.items()}
@@ -0,0 +1,216 @@
+import os
+import re
+import glob
+import json
+import shutil
+import hashlib
+import tempfile
+import pkg_resources
+
+
+def manifest_file(book_dir):
+    return f"{book_dir}/manifest.json"
+
+
+def load_manifest(book_dir):
+    """
+    Load the manifest of the previous build of a book, or None if there is none
+    """
+    ff = manifest_file(book_dir)
+    if not os.path.exists(ff):
+        return None
+    with open(ff, "r") as file:
+        return json.load(file)
+
+
+def save_manifest(book_dir, manifest):
+    with open(manifest_file(book_dir), "w") as file:
+        json.dump(manifest, file, indent=1)
+
+
+def file_hash(ff, previous=None):
+    """
+    Hash the contents of a file
+
+    Parameters
+    ----------
+    ff : str
+        Path to the file
+    previous : dict
+        Previously recorded files, as {path: [size, mtime_ns, hash]}. The hash is reused if the
+        size and modification time have not changed, so unchanged files are not read again
+
+    Returns
+    -------
+    record : list
+        [size, mtime_ns, hash]
+
+    """
+    stat = os.stat(ff)
+    if previous is not None and ff in previous:
+        size, mtime, hashed = previous[ff]
+        if size == stat.st_size and mtime == stat.st_mtime_ns:
+            return previous[ff]
+    sha = hashlib.sha1()
+    with open(ff, "rb") as file:
+        for block in iter(lambda: file.read(2**20), b""):
+            sha.update(block)
+    return [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+
+
+def notebook_name(ff):
+    """
+    Name of a notebook without the chapter number, e.g. ICES_surface_nitrate
+    """
+    name = os.path.basename(ff).replace(".ipynb", "")
+    return re.sub(r"^\d{3}_", "", name)
+
+
+def notebook_template(ff):
+    """
+    The packaged template a notebook was generated from
+    """
+    name = notebook_name(ff)
+    if name == "temperature_mld":
+        return "data/mld_template.ipynb"
+    if name == "surface_pft":
+        return "data/pft_template.ipynb"
+    if "summary" in name:
+        return "data/summary.ipynb"
+    if "info" in name:
+        return "data/000_info.ipynb"
+    if len(name.split("_")) == 3:
+        return "data/point_template.ipynb"
+    return "data/gridded_template.ipynb"
+
+
+def notebook_inputs(ff):
+    """
+    The matched data, template and chunk files a notebook depends on
+
+    Summary and info notebooks depend on the results of the other notebooks, so they are
+    handled by reusable_notebooks instead.
+    """
+    name = notebook_name(ff)
+    parts = name.split("_")
+    inputs = glob.glob("matched/mapping.csv") + glob.glob("matched/model_grid.npz")
+    if name == "temperature_mld":
+        inputs += glob.glob("matched/point/**/all/temperature/*")
+    elif name == "surface_pft":
+        inputs += glob.glob("matched/point/nws/surface/pft/*")
+    elif len(parts) == 3:
+        source, layer, variable = parts
+        inputs += glob.glob(f"matched/point/**/{layer}/{variable}/*")
+    elif len(parts) == 2:
+        source, variable = parts
+        inputs += glob.glob(f"matched/gridded/**/{variable}/*")
+
+    template = pkg_resources.resource_filename("ecoval", notebook_template(ff))
+    inputs.append(template)
+    # chunks are referenced by name in the templates
+    with open(template, "r") as file:
+        chunks = set(re.findall(r"chunk_[a-z]+", file.read()))
+    for chunk in sorted(chunks):
+        chunk_file = pkg_resources.resource_filename("ecoval", f"data/{chunk}.py")
+        if os.path.exists(chunk_file):
+            inputs.append(chunk_file)
+    return sorted(set(inputs))
+
+
+def notebook_source_hash(ff):
+    """
+    Hash the cells of a notebook, ignoring any outputs
+    """
+    with open(ff, "r") as file:
+        nb = json.load(file)
+    sha = hashlib.sha1()
+    for cell in nb["cells"]:
+        source = cell["source"]
+        if isinstance(source, list):
+            source = "".join(source)
+        sha.update(cell["cell_type"].encode())
+        sha.update(source.encode())
+    return sha.hexdigest()
+
+
+def build_manifest(book_dir, previous=None):
+    """
+    Record the source and input hashes of each generated notebook in a book
+
+    Parameters
+    ----------
+    book_dir : str
+        The book directory
+    previous : dict
+        The manifest of the previous build. Hashes of unchanged files are reused
+
+    Returns
+    -------
+    manifest : dict
+        {notebook: {"source": hash, "inputs": {path: [size, mtime_ns, hash]}}}
+
+    """
+    previous_files = dict()
+    if previous is not None:
+        for record in previous.values():
+            previous_files.update(record["inputs"])
+    manifest = dict()
+    for ff in sorted(glob.glob(f"{book_dir}/notebooks/*.ipynb")):
+        inputs = dict()
+        for x in notebook_inputs(ff):
+            inputs[x] = file_hash(x, previous_files)
+        manifest[os.path.basename(ff)] = {
+            "source": notebook_source_hash(ff),
+            "inputs": inputs,
+        }
+    return manifest
+
+
+def reusable_notebooks(manifest, previous, stash):
+    """
+    Notebooks whose sources and inputs are unchanged, so the executed versions can be reused
+
+    Summary and info notebooks are only reused if every other notebook is.
+    """
+    if previous is None or stash is None:
+        return []
+
+    def same(x):
+        if x not in previous or not os.path.exists(os.path.join(stash, x)):
+            return False
+        old = previous[x]
+        new = manifest[x]
+        if old["source"] != new["source"]:
+            return False
+        if set(old["inputs"]) != set(new["inputs"]):
+            return False
+        return all(old["inputs"][y][2] == new["inputs"][y][2] for y in new["inputs"])
+
+    dependent = [x for x in manifest if "summary" in x or "info" in x]
+    reuse = [x for x in manifest if x not in dependent and same(x)]
+    if len(reuse) == len(manifest) - len(dependent):
+        reuse += [x for x in dependent if same(x)]
+    return reuse
+
+
+def stash_notebooks(book_dir):
+    """
+    Move the executed notebooks of a book to a temporary directory, before the book is emptied
+    """
+    if not os.path.exists(f"{book_dir}/notebooks"):
+        return None
+    stash = tempfile.mkdtemp(prefix="ecoval_book_")
+    for ff in glob.glob(f"{book_dir}/notebooks/*.ipynb"):
+        shutil.move(ff, os.path.join(stash, os.path.basename(ff)))
+    return stash
+
+
+def restore_notebooks(book_dir, reuse, stash):
+    """
+    Copy the executed versions of unchanged notebooks into the new book, and remove the stash
+    """
+    if stash is None:
+        return None
+    for x in reuse:
+        shutil.copyfile(os.path.join(stash, x), f"{book_dir}/notebooks/{x}")
+    shutil.rmtree(stash)
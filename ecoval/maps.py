@@ -0,0 +1,221 @@
+import numpy as np
+import xarray as xr
+
+
+# longest side of the base layer of a map, in pixels. Report maps are about 10 inches wide
+map_pixels = 1000
+# the coarsest level of a pyramid has no side longer than this
+min_pixels = 64
+
+
+def block_mean(values, factor):
+    """
+    Mean of the values in each factor x factor block of the last two dimensions
+
+    Missing values are ignored. Blocks at the edges are partial if the shape is not a
+    multiple of the factor. 1D values, e.g. coordinates, are averaged in blocks of factor.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Values with the spatial dimensions last
+    factor : int
+        Size of the blocks
+
+    Returns
+    -------
+    means : numpy.ndarray
+    """
+    values = np.asarray(values, dtype="float64")
+    if factor == 1:
+        return values
+    if values.ndim == 1:
+        padded = np.pad(values, (0, -len(values) % factor), constant_values=np.nan)
+        blocks = padded.reshape(-1, factor)
+        axes = (-1,)
+    else:
+        pad = [(0, 0)] * (values.ndim - 2) + [
+            (0, -values.shape[-2] % factor),
+            (0, -values.shape[-1] % factor),
+        ]
+        padded = np.pad(values, pad, constant_values=np.nan)
+        shape = padded.shape[:-2] + (
+            padded.shape[-2] // factor,
+            factor,
+            padded.shape[-1] // factor,
+            factor,
+        )
+        blocks = padded.reshape(shape)
+        axes = (-3, -1)
+    valid = np.isfinite(blocks)
+    n = valid.sum(axis=axes)
+    total = np.where(valid, blocks, 0).sum(axis=axes)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(n > 0, total / n, np.nan)
+
+
+def _spatial_dims(da):
+    """
+    The (y, x) dimensions of a field, found from the dimensions of its longitudes
+    """
+    lon_name = [x for x in da.coords if "lon" in x.lower()]
+    if len(lon_name) > 0 and da[lon_name[0]].ndim == 2:
+        return da[lon_name[0]].dims
+    dims = [x for x in da.dims if da.sizes[x] > 1]
+    return tuple(dims[-2:])
+
+
+def coarsen(da, factor):
+    """
+    Block mean of a field and its coordinates, see block_mean
+
+    Parameters
+    ----------
+    da : xarray.DataArray
+        A field with the spatial dimensions last
+    factor : int
+        Size of the blocks
+
+    Returns
+    -------
+    da : xarray.DataArray
+    """
+    if factor == 1:
+        return da
+    y_dim, x_dim = _spatial_dims(da)
+    da = da.transpose(..., y_dim, x_dim)
+    coords = dict()
+    for name, coord in da.coords.items():
+        if coord.dims == (y_dim, x_dim):
+            coords[name] = ((y_dim, x_dim), block_mean(coord.values, factor), coord.attrs)
+        elif coord.dims in [(y_dim,), (x_dim,)]:
+            coords[name] = (coord.dims, block_mean(coord.values, factor), coord.attrs)
+        elif y_dim not in coord.dims and x_dim not in coord.dims:
+            coords[name] = coord
+    return xr.DataArray(
+        block_mean(da.values, factor),
+        dims=da.dims,
+        coords=coords,
+        name=da.name,
+        attrs=da.attrs,
+    )
+
+
+def pyramid(da, min_size=None, pixels=None):
+    """
+    Block means of a field at successively halved resolutions
+
+    Parameters
+    ----------
+    da : xarray.DataArray
+        A field with the spatial dimensions last
+    min_size : int
+        Longest side of the coarsest level. Default is min_pixels
+    pixels : int
+        If given, no levels are built after the first one with no side longer than this
+
+    Returns
+    -------
+    levels : list
+        The field at full resolution, then at a half, a quarter and so on
+    """
+    if min_size is None:
+        min_size = min_pixels
+    y_dim, x_dim = _spatial_dims(da)
+    size = max(da.sizes[y_dim], da.sizes[x_dim])
+    levels = [da]
+    factor = 2
+    while size / (factor // 2) > min_size:
+        if pixels is not None and -(-size // (factor // 2)) <= pixels:
+            break
+        levels.append(coarsen(da, factor))
+        factor *= 2
+    return levels
+
+
+def base_layer(levels, pixels=None):
+    """
+    The finest level of a pyramid with no side longer than the output size in pixels
+
+    Parameters
+    ----------
+    levels : list
+        A pyramid, see pyramid
+    pixels : int
+        Longest side of the output, in pixels. Default is map_pixels
+
+    Returns
+    -------
+    da : xarray.DataArray
+    """
+    if pixels is None:
+        pixels = map_pixels
+    for da in levels:
+        y_dim, x_dim = _spatial_dims(da)
+        if max(da.sizes[y_dim], da.sizes[x_dim]) <= pixels:
+            return da
+    return levels[-1]
+
+
+def _read_field(ff, var):
+    """
+    Read a variable from a file, without its length-one dimensions
+    """
+    with xr.open_dataset(ff) as ds:
+        da = ds[var].load()
+    extra = [x for x in da.dims if da.sizes[x] == 1]
+    return da.isel({x: 0 for x in extra})
+
+
+def _fix_limits(limits, values):
+    """
+    Turn percentile limits such as ["0%", "98%"] into values
+    """
+    if limits is None:
+        return None
+    fixed = []
+    for x in limits:
+        if isinstance(x, str) and x.endswith("%"):
+            x = float(np.nanpercentile(values, float(x[:-1])))
+        fixed.append(x)
+    return fixed
+
+
+def map_plot(ds, var=None, pixels=None, limits=None, **kwargs):
+    """
+    Plot a map of a dataset with nctoolkit's pub_plot, at a resolution sized to the output
+
+    Fields with more cells than the output has pixels are replaced by a block-mean base layer
+    from the pyramid of the field, so the time to draw the map and the size of the image stay
+    roughly constant as the grid gets finer. Only the levels down to the base layer are built,
+    and nothing is kept after the map is drawn. Percentile limits are taken from the full
+    field, so the colour scale does not change.
+
+    Parameters
+    ----------
+    ds : nctoolkit.DataSet
+        A dataset with one time step
+    var : str
+        The variable to plot. Only needed if the dataset has more than one variable
+    pixels : int
+        Longest side of the output, in pixels. Default is map_pixels
+    limits : list
+        Limits of the colour scale, e.g. ["0%", "98%"]
+    **kwargs
+        Passed to pub_plot
+
+    """
+    import nctoolkit as nc
+
+    ds.run()
+    if var is None:
+        var = ds.variables[0]
+    if pixels is None:
+        pixels = map_pixels
+    levels = pyramid(_read_field(ds.current[0], var), pixels=pixels)
+    layer = base_layer(levels, pixels)
+    limits = _fix_limits(limits, levels[0].values)
+    if layer is levels[0]:
+        return ds.pub_plot(var, limits=limits, **kwargs)
+    ds_layer = nc.from_xarray(layer.astype("float32").to_dataset(name=var))
+    return ds_layer.pub_plot(var, limits=limits, **kwargs)
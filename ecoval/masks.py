@@ -0,0 +1,198 @@
+import numpy as np
+import xarray as xr
+import pkg_resources
+from ecoval.utils import _file_key
+
+
+subdomain_file = "data/amm7_val_subdomains.nc"
+
+# subdomain masks are read once per process, by file, size and modification time
+_subdomains = dict()
+# masks for target grids, by subdomain file, region names and grid
+_masks = dict()
+
+
+def subdomains(ff=None):
+    """
+    The subdomain masks of a subdomain file, read once per process
+
+    Parameters
+    ----------
+    ff : str
+        The subdomain file. Defaults to the packaged AMM7 subdomains
+
+    Returns
+    -------
+    masks : dict
+        Boolean mask of each subdomain, e.g. "Shelf" or "Ocean"
+    lons, lats : numpy.ndarray
+        The coordinates of the subdomain grid
+
+    """
+    from ecoval.registry import _read_masks
+
+    if ff is None:
+        ff = pkg_resources.resource_filename("ecoval", subdomain_file)
+    key = _file_key(ff)
+    if key not in _subdomains:
+        _subdomains[key] = _read_masks(ff)
+    return _subdomains[key]
+
+
+def _nearest(coords, values):
+    """
+    Index of the nearest coordinate for each value, and whether the value is within the grid
+    """
+    order = np.argsort(coords)
+    coords = coords[order]
+    index = np.clip(np.searchsorted(coords, values), 1, len(coords) - 1)
+    left = coords[index - 1]
+    right = coords[index]
+    index = np.where(values - left <= right - values, index - 1, index)
+    step = np.abs(np.diff(coords)).max() if len(coords) > 1 else 0
+    inside = (values >= coords[0] - step / 2) & (values <= coords[-1] + step / 2)
+    return order[index], inside
+
+
+def region_mask(names, lons=None, lats=None, shape=None, ff=None, regrid=False):
+    """
+    Boolean mask of the union of some subdomains, on a target grid
+
+    Targets with the shape of the subdomain grid use the masks directly. If regrid is True,
+    each cell of other regular grids takes the value of the nearest subdomain cell.
+
+    Parameters
+    ----------
+    names : str or list
+        The subdomains, e.g. "Shelf" or ["Shelf", "Ocean"]
+    lons, lats : numpy.ndarray
+        1D coordinates of the target grid
+    shape : tuple
+        Shape of the target grid, (lat, lon). Used if the coordinates are not given
+    ff : str
+        The subdomain file. Defaults to the packaged AMM7 subdomains
+    regrid : bool
+        Whether to put the mask on grids with a different shape
+
+    Returns
+    -------
+    mask : numpy.ndarray, or None if the mask cannot be put on the target grid
+
+    """
+    if isinstance(names, str):
+        names = [names]
+    if ff is None:
+        ff = pkg_resources.resource_filename("ecoval", subdomain_file)
+    masks, sub_lons, sub_lats = subdomains(ff)
+    if lons is not None and lats is not None:
+        lons = np.asarray(lons, dtype="float64")
+        lats = np.asarray(lats, dtype="float64")
+        shape = (len(lats), len(lons))
+        grid = (lons.tobytes(), lats.tobytes())
+    else:
+        grid = None
+    key = (_file_key(ff), tuple(names), shape, grid, regrid)
+    if key in _masks:
+        return _masks[key]
+
+    mask = np.logical_or.reduce([masks[x] for x in names])
+    if shape != mask.shape:
+        if not regrid or grid is None or sub_lons.ndim != 1 or lons.ndim != 1:
+            mask = None
+        else:
+            i_lat, in_lat = _nearest(np.asarray(sub_lats, dtype="float64"), lats)
+            i_lon, in_lon = _nearest(np.asarray(sub_lons, dtype="float64"), lons)
+            mask = mask[np.ix_(i_lat, i_lon)] & np.outer(in_lat, in_lon)
+    _masks[key] = mask
+    return mask
+
+
+def mask_xarray(ds, names, ff=None, regrid=False):
+    """
+    Set the values of an xarray dataset outside some subdomains to missing. See region_mask
+
+    Returns
+    -------
+    ds : xarray.Dataset, or None if the mask cannot be put on the grid of the dataset
+
+    """
+    lon_name = [x for x in ds.dims if "lon" in x.lower()]
+    lat_name = [x for x in ds.dims if "lat" in x.lower()]
+    if len(lon_name) == 0 or len(lat_name) == 0:
+        return None
+    lon_name = lon_name[0]
+    lat_name = lat_name[0]
+    if lon_name in ds.coords and lat_name in ds.coords:
+        mask = region_mask(
+            names, lons=ds[lon_name].values, lats=ds[lat_name].values, ff=ff, regrid=regrid
+        )
+    else:
+        mask = region_mask(names, shape=(ds.sizes[lat_name], ds.sizes[lon_name]), ff=ff)
+    if mask is None:
+        return None
+    mask = xr.DataArray(mask, dims=[lat_name, lon_name])
+    ds = ds.copy()
+    for vv in ds.data_vars:
+        if lon_name in ds[vv].dims and lat_name in ds[vv].dims:
+            ds[vv] = ds[vv].where(mask)
+    return ds
+
+
+def mask_dataset(ds, names, ff=None, regrid=False):
+    """
+    Set the values of an nctoolkit dataset outside some subdomains to missing, in place.
+    See region_mask
+
+    Returns
+    -------
+    masked : bool
+        False if the mask cannot be put on the grid of the dataset, which is then unchanged
+
+    """
+    import nctoolkit as nc
+
+    ds.run()
+    ds_xr = mask_xarray(ds.to_xarray().load(), names, ff=ff, regrid=regrid)
+    if ds_xr is None:
+        return False
+    ds_masked = nc.from_xarray(ds_xr)
+    ds.current = ds_masked.current
+    return True
+
+
+def label_regions(masks):
+    """
+    Encode possibly overlapping region masks as one integer label array
+
+    Each label is a distinct combination of regions, so cells can be reduced once per label
+    and the totals of each region added up from its labels.
+
+    Parameters
+    ----------
+    masks : dict
+        Boolean mask of each region, all with the same shape
+
+    Returns
+    -------
+    labels : numpy.ndarray
+        Label of each cell. Cells in no region are -1
+    membership : numpy.ndarray
+        Boolean array of shape (labels, regions), saying which regions each label is in
+    names : list
+        The regions, in the order of the membership columns
+
+    """
+    names = list(masks)
+    shape = masks[names[0]].shape
+    stacked = np.stack([np.asarray(masks[x], dtype="bool").ravel() for x in names], axis=1)
+    membership, labels = np.unique(stacked, axis=0, return_inverse=True)
+    labels = labels.ravel()
+    outside = ~membership.any(axis=1)
+    if outside.any():
+        # cells in no region do not get a label
+        keep = np.flatnonzero(~outside)
+        relabel = np.full(len(membership), -1)
+        relabel[keep] = np.arange(len(keep))
+        labels = relabel[labels]
+        membership = membership[keep]
+    return labels.reshape(shape), membership, names
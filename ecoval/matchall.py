@@ -15,9 +15,13 @@ import xarray as xr
 from ecoval.session import session_info
 from multiprocessing import Manager
 from tqdm import tqdm
-from ecoval.utils import extension_of_directory, get_extent
+from ecoval.utils import extension_of_directory
+from ecoval.grid import build_grid_info, get_grid_info, set_grid_info, reset_grid_info
+from ecoval.registry import get_bundle
+from ecoval.depths import depth_dataset, write_bathymetry, is_vvl, timestep_depths
 from ecoval.parsers import generate_mapping
 from ecoval.gridded import gridded_matchup
+from ecoval.moments import write_point_moments, moments_path
 
 # a list of valid variables for validation
 valid_vars = [
@@ -136,7 +140,14 @@ def mm_match(
             if len(df_locs) > 0:
                 if top_layer:
                     df_ff = ds.match_points(df_locs, quiet=True, top=top_layer)
+                elif ds_depths is not None and t_subset and is_vvl(ff):
+                    # depths change through time, so match each time step with its own depths
+                    df_ff = vvl_match(ds, ff, ff_indices, df_locs, df_times)
                 else:
+                    if ds_depths is not None and not bottom_layer and session_info.get("vvl", False):
+                        warnings.warn(
+                            f"{os.path.basename(ff)} has no time-varying e3t, so its matchups use the depths of the first time step"
+                        )
                     df_ff = ds.match_points(
                         df_locs, depths=ds_depths, quiet=True, top=top_layer
                     )
@@ -158,6 +169,45 @@ def mm_match(
         print(e)
 
 
+def vvl_match(ds, ff, ff_indices, df_locs, df_times):
+    """
+    Match up points in a variable volume run, with depths from the thickness at each time step
+
+    Parameters
+    -------------
+    ds: nctoolkit.DataSet
+        Model data, subset to the time steps in ff_indices
+    ff: str
+        Path to file, which must contain e3t
+    ff_indices: list
+        Indices of the time steps in the file
+    df_locs: pd.DataFrame
+        Locations and times to match
+    df_times: pd.DataFrame
+        Time information for the files
+
+    """
+    ff_times = df_times.query("path == @ff").reset_index(drop=True)
+    time_cols = [x for x in ["year", "month", "day"] if x in df_locs.columns and x in ff_times.columns]
+    surface_level = session_info.get("surface_level", "top")
+    df_list = []
+    # cdo selects time steps in the order they are in the file
+    for i, tt in enumerate(sorted(ff_indices)):
+        df_tt = df_locs.merge(ff_times.loc[[tt], time_cols].drop_duplicates())
+        if len(df_tt) == 0:
+            continue
+        ds_tt = ds.copy()
+        ds_tt.subset(time=i)
+        ds_tt.run()
+        ds_depths = timestep_depths(ff, tt, surface_level=surface_level)
+        df_tt = ds_tt.match_points(df_tt, depths=ds_depths, quiet=True, top=False)
+        if df_tt is not None:
+            df_list.append(df_tt)
+    if len(df_list) == 0:
+        return None
+    return pd.concat(df_list).reset_index(drop=True)
+
+
 def get_time_res(x, folder=None):
     """
     Get the time resolution of the netCDF files
@@ -406,6 +456,8 @@ def matchup(
     thickness : str
         Path to a thickness file, i.e. cell vertical thickness. This only needs to be supplied if the variable is missing from the raw data.
         If the e3t variable is in the raw data, it will be used, and thickness does not need to be supplied.
+        Depths from a thickness file are fixed, so variable volume runs need e3t in the raw data for time-varying depths.
+        Model files without e3t use the depths of the first time step, with a warning.
     mapping : str
         Path to mapping file. This is a csv. A starting point can be generated by running `matchup` and saying you are not happy with the matchups.
     levels_down : int
@@ -501,6 +553,7 @@ def matchup(
     if not isinstance(cores, int):
         raise ValueError("Please set cores to int")
     nc.options(cores=cores)
+    session_info["cores"] = cores
 
     if surface_level is None:
         raise ValueError(
@@ -757,26 +810,13 @@ def matchup(
         path = str(path)
         break
 
-    ds = nc.open_data(path, checks=False)
+    # work out the grid information once, so that everything else can reuse it
+    reset_grid_info()
+    grid_info = build_grid_info(path, surface_level=surface_level)
+    set_grid_info(grid_info)
     if fvcom is False:
-        ds_extent = get_extent(ds[0])
-        lon_max = ds_extent[1]
-        lon_min = ds_extent[0]
-        lat_max = ds_extent[3]
-        lat_min = ds_extent[2]
-
-        global_grid = False
-        if lon_max - lon_min > 350:
-            global_grid = True
-        if lat_max - lat_min > 170:
-            global_grid = True
-        if lon_max > 50:
-            global_grid = True
-
-        if global_grid:
-            model_domain = "global"
-        else:
-            model_domain = "nws"
+        global_grid = grid_info.global_grid
+        model_domain = grid_info.domain
     else:
         if erie is False:
             global_grid = False
@@ -930,18 +970,22 @@ def matchup(
         try:
             if True:
                 with warnings.catch_warnings(record=True) as w:
-                    # extract the thickness dataset
+                    # find the thickness file
                     e3t_found = False
+                    e3t_variable = "e3t"
                     if thickness is not None:
                         ds_thickness = nc.open_data(thickness, checks=False)
                         if len(ds_thickness.variables) != 1:
                             raise ValueError(
                                 "The thickness file has more than one variable. Please provide a single variable!"
                             )
-                        ds_thickness.rename(
-                            {ds_thickness.variables[0]: "e3t"}
-                        )
+                        e3t_variable = ds_thickness.variables[0]
+                        e3t_file = thickness
                         e3t_found = True
+                        if is_vvl(thickness, e3t_variable):
+                            warnings.warn(
+                                "The thickness file changes through time, but only its first time step is used for depths. Include e3t in the model output to use time-varying depths"
+                            )
                     else:
                         print(
                             "Vertical thickness is required for your matchups, but they are not supplied"
@@ -952,37 +996,24 @@ def matchup(
                         for ff in random_files:
                             ds_thickness = nc.open_data(ff, checks=False)
                             if "e3t" in ds_thickness.variables:
+                                e3t_file = ff
                                 e3t_found = True
                                 break
                     if not e3t_found:
                         raise ValueError("Unable to find e3t")
+                    # files without e3t of their own use fixed depths, even in variable volume runs
+                    session_info["vvl"] = thickness is None and is_vvl(e3t_file)
 
-                    ds_thickness.subset(time=0, variables="e3t")
-                    ds_thickness.as_missing(0)
-                    #####
-                    # now output the bathymetry if it does not exists
+                    # depths and bathymetry are computed once for the grid
+                    # variable volume runs get depths for each time step during the matchups
                     if not os.path.exists("matched/model_bathymetry.nc"):
-                        ds_bath = ds_thickness.copy()
-                        ds_bath.vertical_sum()
-                        ds_bath.to_nc(
-                            "matched/model_bathymetry.nc", zip=True
+                        write_bathymetry(
+                            e3t_file, "matched/model_bathymetry.nc", variable=e3t_variable
                         )
-
-                    # thickness needs to be inverted if the sea surface is at the bottom
-
-                    if surface_level == "bottom":
-                        ds_thickness.cdo_command("invertlev")
-                    ds_thickness.run()
-                    ds_depths = ds_thickness.copy()
-
-                    ds_depths.vertical_cumsum()
-                    ds_thickness / 2
-                    ds_depths - ds_thickness
-                    ds_depths.run()
-                    ds_depths.rename({ds_depths.variables[0]: "depth"})
-                    if surface_level == "bottom":
-                        ds_depths.cdo_command("invertlev")
-                    ds_depths.run()
+                    ds_depths = depth_dataset(
+                        e3t_file, variable=e3t_variable, surface_level=surface_level
+                    )
+                    session_info["surface_level"] = surface_level
 
                 for ww in w:
                     if str(ww.message) not in session_warnings:
@@ -1258,30 +1289,8 @@ def matchup(
     df_out.to_csv(out, index=False)
 
     if global_grid is None:
-        final_extension = extension_of_directory(sim_dir)
-        path = glob.glob(sim_dir + final_extension + all_df.pattern[0])[0]
-        ds = nc.open_data(path, checks=False).to_xarray()
-        lon_name = [x for x in ds.coords if "lon" in x]
-        lat_name = [x for x in ds.coords if "lat" in x]
-        lon = ds[lon_name[0]].values
-        lat = ds[lat_name[0]].values
-        lon_max = lon.max()
-        lon_min = lon.min()
-        lat_max = lat.max()
-        lat_min = lat.min()
-
-        global_grid = False
-        if lon_max - lon_min > 350:
-            global_grid = True
-        if lat_max - lat_min > 170:
-            global_grid = True
-        if lon_max > 50:
-            global_grid = True
-
-        if global_grid:
-            model_domain = "global"
-        else:
-            model_domain = "nws"
+        global_grid = get_grid_info().global_grid
+        model_domain = get_grid_info().domain
 
     if "ph" in surface and model_domain == "nws":
         surface.remove("ph")
@@ -1410,7 +1419,7 @@ def matchup(
 
     # figure out the lon/lat extent in the model
     if fvcom is False:
-        ds_extent = get_extent(ensemble[0])
+        ds_extent = get_grid_info().extent
         lons = [ds_extent[0], ds_extent[1]]
         lats = [ds_extent[2], ds_extent[3]]
     else:
@@ -1655,29 +1664,9 @@ def matchup(
                             manager = Manager()
                             # time to subset the df to the lon/lat ranges
 
-                            with warnings.catch_warnings(record=True) as w:
-                                ds_grid = nc.open_data(paths[0], checks=False)
-                                ds_grid.subset(variables=ds_grid.variables[0])
-                                ds_grid.top()
-                                ds_grid.subset(time=0)
-                                amm7 = False
-                                if max(ds_grid.contents.npoints) == 111375:
-                                    amm7 = True
-                                    try:
-                                        ds_grid.fix_amm7_grid()
-                                    except:
-                                        pass
-                                ds_xr = ds_grid.to_xarray()
-                            for ww in w:
-                                if str(ww.message) not in session_warnings:
-                                    session_warnings.append(str(ww.message))
                             # extract the minimum latitude and longitude
-                            lon_name = [x for x in list(ds_xr.coords) if "lon" in x][0]
-                            lon_min = ds_xr[lon_name].values.min()
-                            lon_max = ds_xr[lon_name].values.max()
-                            lat_name = [x for x in list(ds_xr.coords) if "lat" in x][0]
-                            lat_min = ds_xr[lat_name].values.min()
-                            lat_max = ds_xr[lat_name].values.max()
+                            grid_info = get_grid_info(paths[0], surface_level=surface_level)
+                            lon_min, lon_max, lat_min, lat_max = grid_info.bounds
                             df = df.query(
                                 "lon >= @lon_min and lon <= @lon_max and lat >= @lat_min and lat <= @lat_max"
                             ).reset_index(drop=True)
@@ -1710,49 +1699,8 @@ def matchup(
                         results = dict()
                         for ff in paths:
                             if grid_setup is False:
-                                if True:
-                                    with warnings.catch_warnings(record=True) as w:
-
-                                        ds_grid = nc.open_data(ff, checks=False)
-                                        var = ds_grid.variables[0]
-                                        ds_grid.subset(variables=var)
-                                        if surface_level == "top":
-                                            ds_grid.top()
-                                        else:
-                                            ds_grid.bottom()
-                                        ds_grid.as_missing(0)
-                                        if max(ds_grid.contents.npoints) == 111375:
-                                            try:
-                                                ds_grid.fix_amm7_grid()
-                                            except:
-                                                pass
-                                        df_grid = (
-                                            ds_grid.to_dataframe()
-                                            .reset_index()
-                                            .dropna()
-                                        )
-                                        columns = [
-                                            x
-                                            for x in df_grid.columns
-                                            if "lon" in x or "lat" in x
-                                        ]
-                                        df_grid = df_grid.loc[
-                                            :, columns
-                                        ].drop_duplicates()
-                                        if not os.path.exists(
-                                            session_info["out_dir"] + "matched"
-                                        ):
-                                            os.makedirs(
-                                                session_info["out_dir"] + "matched"
-                                            )
-                                        df_grid.to_csv(
-                                            session_info["out_dir"]
-                                            + "matched/model_grid.csv",
-                                            index=False,
-                                        )
-                                    for ww in w:
-                                        if str(ww.message) not in session_warnings:
-                                            session_warnings.append(str(ww.message))
+                                # the grid information is saved as matched/model_grid.npz
+                                get_grid_info(ff, surface_level=surface_level)
 
                             grid_setup = True
                             if layer == "surface":
@@ -1801,13 +1749,10 @@ def matchup(
                             return False
 
                         df_all = pd.concat(df_all)
-                        if amm7:
-                            df_all = (
-                                df_all.query("lon > -19")
-                                .query("lon < 9")
-                                .query("lat > 41")
-                                .query("lat < 64.3")
-                            )
+                        # known grids, e.g. AMM7, have a region matchups are clipped to
+                        bundle = get_bundle()
+                        if bundle is not None:
+                            df_all = bundle.clip_dataframe(df_all)
                         change_this = [
                             x
                             for x in df_all.columns
@@ -1935,6 +1880,8 @@ def matchup(
 
                         if len(df_all) > 0:
                             df_all.to_csv(out, index=False)
+                            if "model" in df_all.columns and "observation" in df_all.columns:
+                                write_point_moments(df_all, moments_path(out))
                             if session_info["out_dir"] != "":
                                 out_unit = f"{session_info['out_dir']}/matched/point/{model_domain}/{depths}/{variable}/{source}_{depths}_{variable}_unit.csv"
                             else:
@@ -0,0 +1,454 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+# mergeable sufficient statistics of model-observation pairs
+moment_names = [
+    "n",
+    "sum_model",
+    "sum_observation",
+    "sum_model2",
+    "sum_observation2",
+    "sum_product",
+]
+
+
+class QuantileSketch(object):
+    """
+    A mergeable quantile sketch with a fixed relative accuracy
+
+    Values are counted in logarithmically spaced buckets, so any quantile is returned to within
+    the relative accuracy, and sketches of different data are merged by adding the counts.
+
+    Attributes
+    ----------
+    accuracy : float
+        The relative accuracy of the quantiles
+    positive, negative : dict
+        Counts of the positive values and the magnitudes of the negative values, by bucket
+    zero : int
+        Number of values with a magnitude below min_value
+
+    """
+
+    def __init__(self, accuracy=0.01, min_value=1e-9):
+        if not 0 < accuracy < 1:
+            raise ValueError("accuracy must be between 0 and 1")
+        self.accuracy = float(accuracy)
+        self.min_value = float(min_value)
+        self.gamma = (1 + self.accuracy) / (1 - self.accuracy)
+        self.positive = dict()
+        self.negative = dict()
+        self.zero = 0
+
+    def __repr__(self):
+        return f"<QuantileSketch: {self.count} values, accuracy {self.accuracy}>"
+
+    @property
+    def count(self):
+        return self.zero + sum(self.positive.values()) + sum(self.negative.values())
+
+    def _bucket(self, x):
+        return np.ceil(np.log(x) / np.log(self.gamma)).astype("int64")
+
+    def _value(self, bucket):
+        return 2 * self.gamma ** np.asarray(bucket, dtype="float64") / (self.gamma + 1)
+
+    def _buckets(self):
+        """
+        Representative value and count of each bucket, in increasing order of value
+        """
+        negative = np.array(sorted(self.negative, reverse=True), dtype="int64")
+        positive = np.array(sorted(self.positive), dtype="int64")
+        values = np.concatenate([-self._value(negative), [0.0], self._value(positive)])
+        counts = np.concatenate(
+            [
+                [self.negative[x] for x in negative.tolist()],
+                [self.zero],
+                [self.positive[x] for x in positive.tolist()],
+            ]
+        ).astype("int64")
+        return values, counts
+
+    def add(self, values):
+        """
+        Add values to the sketch. Missing values are ignored
+        """
+        values = np.asarray(values, dtype="float64").ravel()
+        values = values[np.isfinite(values)]
+        self.zero += int(np.sum(np.abs(values) <= self.min_value))
+        for store, x in [
+            (self.positive, values[values > self.min_value]),
+            (self.negative, -values[values < -self.min_value]),
+        ]:
+            buckets, counts = np.unique(self._bucket(x), return_counts=True)
+            for bucket, count in zip(buckets.tolist(), counts.tolist()):
+                store[bucket] = store.get(bucket, 0) + count
+        return self
+
+    def merge(self, other):
+        """
+        Combine two sketches, as if all of their values had been added to one
+        """
+        if other.accuracy != self.accuracy or other.min_value != self.min_value:
+            raise ValueError("Only sketches with the same accuracy can be merged")
+        merged = QuantileSketch(self.accuracy, self.min_value)
+        for store, a, b in [
+            (merged.positive, self.positive, other.positive),
+            (merged.negative, self.negative, other.negative),
+        ]:
+            store.update(a)
+            for bucket, count in b.items():
+                store[bucket] = store.get(bucket, 0) + count
+        merged.zero = self.zero + other.zero
+        return merged
+
+    def quantile(self, q):
+        """
+        Estimate quantiles, with q between 0 and 1. Returns nan if the sketch is empty
+        """
+        q = np.asarray(q, dtype="float64")
+        n = self.count
+        if n == 0:
+            return np.full(q.shape, np.nan)[()]
+        values, counts = self._buckets()
+        rank = np.clip(q, 0, 1) * (n - 1)
+        return values[np.searchsorted(np.cumsum(counts), rank, side="right")]
+
+    def cdf(self):
+        """
+        The cumulative distribution of the sketch, as bucket values and cumulative probabilities
+        """
+        if self.count == 0:
+            return np.array([]), np.array([])
+        values, counts = self._buckets()
+        keep = counts > 0
+        return values[keep], np.cumsum(counts[keep]) / self.count
+
+    @staticmethod
+    def pack(sketches, prefix):
+        """
+        Flatten a list of sketches into arrays, for saving with numpy
+        """
+        buckets, signs, counts, offsets, zeros = [], [], [], [0], []
+        for sketch in sketches:
+            for sign, store in [(1, sketch.positive), (-1, sketch.negative)]:
+                buckets += list(store.keys())
+                counts += list(store.values())
+                signs += [sign] * len(store)
+            offsets.append(len(buckets))
+            zeros.append(sketch.zero)
+        accuracy = sketches[0].accuracy if len(sketches) > 0 else 0.01
+        min_value = sketches[0].min_value if len(sketches) > 0 else 1e-9
+        return {
+            f"{prefix}_bucket": np.array(buckets, dtype="int64"),
+            f"{prefix}_sign": np.array(signs, dtype="int8"),
+            f"{prefix}_count": np.array(counts, dtype="int64"),
+            f"{prefix}_offset": np.array(offsets, dtype="int64"),
+            f"{prefix}_zero": np.array(zeros, dtype="int64"),
+            f"{prefix}_accuracy": np.array([accuracy, min_value]),
+        }
+
+    @staticmethod
+    def unpack(arrays, prefix):
+        """
+        Rebuild the list of sketches flattened by pack
+        """
+        accuracy, min_value = arrays[f"{prefix}_accuracy"]
+        offsets = arrays[f"{prefix}_offset"]
+        buckets = arrays[f"{prefix}_bucket"].tolist()
+        signs = arrays[f"{prefix}_sign"].tolist()
+        counts = arrays[f"{prefix}_count"].tolist()
+        sketches = []
+        for i in range(len(offsets) - 1):
+            sketch = QuantileSketch(accuracy, min_value)
+            sketch.zero = int(arrays[f"{prefix}_zero"][i])
+            for j in range(offsets[i], offsets[i + 1]):
+                store = sketch.positive if signs[j] > 0 else sketch.negative
+                store[buckets[j]] = counts[j]
+            sketches.append(sketch)
+        return sketches
+
+
+def pair_moments(model, observation, axis=0):
+    """
+    Sufficient statistics of the model-observation pairs where both have values
+
+    Parameters
+    ----------
+    model, observation : numpy.ndarray
+        Arrays of the same shape
+    axis : int
+        The axis to sum over
+
+    Returns
+    -------
+    moments : dict
+        Arrays of n, sum_model, sum_observation, sum_model2, sum_observation2 and sum_product
+    """
+    model = np.asarray(model, dtype="float64")
+    observation = np.asarray(observation, dtype="float64")
+    valid = np.isfinite(model) & np.isfinite(observation)
+    m = np.where(valid, model, 0)
+    o = np.where(valid, observation, 0)
+    return {
+        "n": valid.sum(axis=axis).astype("int64"),
+        "sum_model": m.sum(axis=axis),
+        "sum_observation": o.sum(axis=axis),
+        "sum_model2": (m * m).sum(axis=axis),
+        "sum_observation2": (o * o).sum(axis=axis),
+        "sum_product": (m * o).sum(axis=axis),
+    }
+
+
+def metrics_from_moments(moments):
+    """
+    Bias, RMSE, correlation and Taylor diagram inputs from summed sufficient statistics
+
+    Works element-wise, so moments can hold scalars, arrays or DataFrame columns.
+
+    Returns
+    -------
+    metrics : dict
+        n, model_mean, observation_mean, bias, rmse, model_sd, observation_sd, sd_ratio,
+        cor and crmsd (the centred root mean square difference)
+    """
+    n = np.asarray(moments["n"], dtype="float64")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        model_mean = moments["sum_model"] / n
+        observation_mean = moments["sum_observation"] / n
+        model_var = np.maximum(moments["sum_model2"] / n - model_mean**2, 0)
+        observation_var = np.maximum(moments["sum_observation2"] / n - observation_mean**2, 0)
+        covariance = moments["sum_product"] / n - model_mean * observation_mean
+        mse = (moments["sum_model2"] - 2 * moments["sum_product"] + moments["sum_observation2"]) / n
+        return {
+            "n": moments["n"],
+            "model_mean": model_mean,
+            "observation_mean": observation_mean,
+            "bias": model_mean - observation_mean,
+            "rmse": np.sqrt(np.maximum(mse, 0)),
+            "model_sd": np.sqrt(model_var),
+            "observation_sd": np.sqrt(observation_var),
+            "sd_ratio": np.sqrt(model_var / observation_var),
+            "cor": covariance / np.sqrt(model_var * observation_var),
+            "crmsd": np.sqrt(np.maximum(model_var + observation_var - 2 * covariance, 0)),
+        }
+
+
+def moments_path(ff):
+    """
+    The sufficient statistics file written next to a matched file
+    """
+    return os.path.splitext(ff)[0] + "_moments.npz"
+
+
+def _period_sketches(model, observation, period, accuracy):
+    sketches = {"model": [], "observation": []}
+    for i in range(period.max() + 1):
+        select = period == i
+        valid = np.isfinite(model[select]) & np.isfinite(observation[select])
+        sketches["model"].append(QuantileSketch(accuracy).add(model[select][valid]))
+        sketches["observation"].append(QuantileSketch(accuracy).add(observation[select][valid]))
+    return sketches
+
+
+def _save(out, arrays, sketches, periods):
+    # the sketches are stored per (year, month)
+    arrays["sketch_year"] = periods.year.values
+    arrays["sketch_month"] = periods.month.values
+    for vv in sketches:
+        arrays.update(QuantileSketch.pack(sketches[vv], f"sketch_{vv}"))
+    with open(out, "wb") as f:
+        np.savez_compressed(f, **arrays)
+
+
+def write_gridded_moments(ff, out=None, accuracy=0.01):
+    """
+    Save the sufficient statistics of a matched gridded file, per grid cell and (year, month)
+
+    Parameters
+    ----------
+    ff : str
+        A matched gridded file
+    out : str
+        The output file. Defaults to the matched file with the suffix _moments.npz
+    accuracy : float
+        Relative accuracy of the quantile sketches, one per (year, month) for model and observation
+
+    """
+    from ecoval.statistics import _read_matched
+
+    if out is None:
+        out = moments_path(ff)
+    fields = _read_matched(ff)
+    model = fields["model"]
+    observation = fields["observation"]
+    keys = pd.DataFrame({"year": fields["years"], "month": fields["months"]})
+    periods = keys.drop_duplicates().sort_values(["year", "month"]).reset_index(drop=True)
+    period = keys.merge(periods.reset_index(), how="left")["index"].values
+
+    arrays = {x: [] for x in moment_names}
+    for i in range(len(periods)):
+        moments = pair_moments(model[period == i], observation[period == i])
+        for x in moment_names:
+            arrays[x].append(moments[x])
+    arrays = {x: np.stack(arrays[x]) for x in moment_names}
+    arrays["n"] = arrays["n"].astype("int32")
+    arrays["year"] = periods.year.values
+    arrays["month"] = periods.month.values
+    arrays["lon"] = np.asarray(fields["lon"])
+    arrays["lat"] = np.asarray(fields["lat"])
+    _save(out, arrays, _period_sketches(model, observation, period, accuracy), periods)
+    return out
+
+
+def write_point_moments(df, out, accuracy=0.01):
+    """
+    Save the sufficient statistics of matched point data, per location, depth and (year, month)
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Matched point data, with lon, lat, model and observation columns, and optionally
+        year, month and depth
+    out : str
+        The output file
+    accuracy : float
+        Relative accuracy of the quantile sketches
+
+    """
+    df = df.copy()
+    # climatological data has no year or month, which is recorded as 0
+    for x in ["year", "month"]:
+        if x not in df.columns:
+            df[x] = 0
+    by = [x for x in ["year", "month", "lon", "lat", "depth"] if x in df.columns]
+    df = df.loc[:, by + ["model", "observation"]].dropna()
+    if len(df) == 0:
+        return None
+    # sum the pairs within each group
+    moments = pd.DataFrame(
+        {
+            "n": 1,
+            "sum_model": df.model.values,
+            "sum_observation": df.observation.values,
+            "sum_model2": df.model.values**2,
+            "sum_observation2": df.observation.values**2,
+            "sum_product": df.model.values * df.observation.values,
+        },
+        index=df.index,
+    )
+    table = moments.groupby([df[x] for x in by]).sum().reset_index()
+    arrays = {x: table[x].values for x in by + moment_names}
+
+    periods = table.loc[:, ["year", "month"]].drop_duplicates().reset_index(drop=True)
+    period = df.merge(periods.reset_index(), how="left", on=["year", "month"])["index"].values
+    sketches = _period_sketches(df.model.values, df.observation.values, period, accuracy)
+    _save(out, arrays, sketches, periods)
+    return out
+
+
+def load_moments(ff):
+    """
+    Load a sufficient statistics file
+
+    Returns
+    -------
+    store : dict
+        The arrays in the file, with the quantile sketches under "sketches"
+    """
+    with np.load(ff, allow_pickle=False) as data:
+        arrays = {x: data[x] for x in data.files}
+    sketches = {"year": arrays["sketch_year"], "month": arrays["sketch_month"]}
+    for vv in ["model", "observation"]:
+        sketches[vv] = QuantileSketch.unpack(arrays, f"sketch_{vv}")
+    arrays = {x: y for x, y in arrays.items() if not x.startswith("sketch_")}
+    arrays["sketches"] = sketches
+    return arrays
+
+
+def _selection(store, years=None, months=None):
+    keys = np.ones(len(store["year"]), dtype="bool")
+    if years is not None:
+        keys &= np.isin(store["year"], years)
+    if months is not None:
+        keys &= np.isin(store["month"], months)
+    return keys
+
+
+def aggregate(store, mask=None, years=None, months=None, by=None):
+    """
+    Metrics for any region and period, from summed sufficient statistics
+
+    Parameters
+    ----------
+    store : dict or str
+        A store from load_moments, or the path of one
+    mask : numpy.ndarray
+        Boolean mask of the cells (gridded) or rows (point data) to include. Default is all
+    years, months : list
+        The years and months to include. Default is all
+    by : str or list
+        Report the metrics for each "year" and/or "month", rather than the whole period
+
+    Returns
+    -------
+    metrics : pandas.DataFrame
+        The columns of metrics_from_moments, plus the by columns
+    """
+    if isinstance(store, str):
+        store = load_moments(store)
+    if by is None:
+        by = []
+    if isinstance(by, str):
+        by = [by]
+    for x in by:
+        if x not in ["year", "month"]:
+            raise ValueError("by must be year and/or month")
+    keys = _selection(store, years, months)
+    n_keys = len(store["year"])
+    sums = dict()
+    if store["n"].shape[0] == n_keys and store["n"].ndim > 1:
+        # gridded: sum each period over the selected cells
+        for x in moment_names:
+            values = store[x]
+            if mask is not None:
+                values = values[:, mask]
+            sums[x] = values.reshape(n_keys, -1).sum(axis=1)[keys]
+        df = pd.DataFrame(sums).assign(year=store["year"][keys], month=store["month"][keys])
+    else:
+        rows = keys
+        if mask is not None:
+            rows &= np.asarray(mask, dtype="bool")
+        df = pd.DataFrame({x: store[x][rows] for x in moment_names + ["year", "month"]})
+    if len(by) > 0:
+        df = df.groupby(by).sum().reset_index()
+        metrics = pd.DataFrame(metrics_from_moments(df))
+        return pd.concat([df.loc[:, by], metrics], axis=1)
+    return pd.DataFrame(metrics_from_moments(df.loc[:, moment_names].sum()), index=[0])
+
+
+def sketch_quantiles(store, q=[0.1, 0.5, 0.9], years=None, months=None):
+    """
+    Quantiles of the model and observation values over a period, from the merged sketches
+
+    Returns
+    -------
+    quantiles : pandas.DataFrame
+        One row per quantile, with model and observation columns
+    """
+    if isinstance(store, str):
+        store = load_moments(store)
+    keys = _selection(store["sketches"], years, months)
+    quantiles = {"quantile": q}
+    for vv in ["model", "observation"]:
+        selected = [x for x, keep in zip(store["sketches"][vv], keys) if keep]
+        if len(selected) == 0:
+            quantiles[vv] = np.full(len(q), np.nan)
+            continue
+        merged = selected[0]
+        for sketch in selected[1:]:
+            merged = merged.merge(sketch)
+        quantiles[vv] = merged.quantile(q)
+    return pd.DataFrame(quantiles)
@@ -0,0 +1,403 @@
+import os
+import subprocess
+import numpy as np
+import xarray as xr
+import pkg_resources
+from ecoval.session import session_info
+
+
+# grids with packaged assets, recognized by the number of horizontal cells
+# Other grids, e.g. AMM15, ORCA1 or FVCOM meshes, can be added using register_grid
+builtin_grids = {
+    "amm7": {
+        "npoints": 111375,
+        "subdomains": "data/amm7_val_subdomains.nc",
+        "clip": [[-19, 41], [9, 41], [9, 64.3], [-19, 64.3]],
+    },
+}
+
+# bundles are loaded once per process, by registry directory and fingerprint
+_bundles = dict()
+
+
+def registry_dir(matched_dir=None):
+    """
+    The directory the grid asset bundles are stored in
+
+    By default this is the grids folder of the matched data, so each run keeps its own assets.
+    A registry shared by all runs, e.g. ~/.ecoval/grids, is only used if it is set in the
+    ECOVAL_GRID_DIR environment variable or session_info["grid_dir"]
+
+    Parameters
+    ----------
+    matched_dir : str
+        Directory with the matched data. Defaults to the matched folder of the current run
+    """
+    if session_info.get("grid_dir"):
+        return session_info["grid_dir"]
+    if os.environ.get("ECOVAL_GRID_DIR"):
+        return os.environ["ECOVAL_GRID_DIR"]
+    if matched_dir is None:
+        matched_dir = session_info.get("out_dir", "") + "matched"
+    return os.path.join(matched_dir, "grids")
+
+
+def _lonlat_description(lons, lats):
+    """
+    A cdo grid description for a regular lon-lat grid
+    """
+    lines = [
+        "gridtype = lonlat",
+        f"xsize = {len(lons)}",
+        f"ysize = {len(lats)}",
+        f"xfirst = {float(lons[0])}",
+        f"xinc = {(float(lons[-1]) - float(lons[0])) / (len(lons) - 1)}",
+        f"yfirst = {float(lats[0])}",
+        f"yinc = {(float(lats[-1]) - float(lats[0])) / (len(lats) - 1)}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+class GridBundle(object):
+    """
+    Precomputed assets for a known grid
+
+    Attributes
+    ----------
+    name : str
+        Name of the grid, e.g. "amm7"
+    fingerprint : str
+        Fingerprint of the grid in the model output
+    directory : str
+        Directory holding the bundle
+    masks : dict
+        Boolean subdomain masks, e.g. "Shelf" or "Ocean", with the shape of the grid
+    clip : numpy.ndarray
+        Polygon, as (lon, lat) vertices, which matchups are clipped to. None if there is no clipping
+    grid_file : str
+        cdo grid description used to fix the grid in the model output. None if no fix is needed
+
+    """
+
+    def __init__(self, name, fingerprint, directory, masks=None, clip=None, grid_file=None):
+        self.name = name
+        self.fingerprint = fingerprint
+        self.directory = directory
+        if masks is None:
+            masks = dict()
+        self.masks = masks
+        if clip is not None:
+            clip = np.asarray(clip, dtype="float64")
+        self.clip = clip
+        self.grid_file = grid_file
+
+    def __repr__(self):
+        return f"<GridBundle: {self.name}, masks {list(self.masks)}>"
+
+    def mask(self, name):
+        """
+        Get a subdomain mask, or the union of several masks
+        """
+        if isinstance(name, str):
+            name = [name]
+        return np.logical_or.reduce([self.masks[x] for x in name])
+
+    def fix_grid(self, ds):
+        """
+        Give a dataset the correct grid, without working it out from the coordinates
+        """
+        if self.grid_file is not None:
+            ds.cdo_command(f"setgrid,{self.grid_file}")
+
+    def clip_box(self):
+        """
+        The lon/lat ranges of the clipping polygon
+        """
+        return (
+            [float(self.clip[:, 0].min()), float(self.clip[:, 0].max())],
+            [float(self.clip[:, 1].min()), float(self.clip[:, 1].max())],
+        )
+
+    def clip_dataframe(self, df):
+        """
+        Remove the rows of a dataframe with lon/lat outside the clipping polygon
+
+        Points on the bounding box of the polygon are removed, so rectangles clip with strict
+        inequalities as the old lon/lat limits did. Points on other edges of a polygon may fall
+        either way.
+        """
+        if self.clip is None:
+            return df
+        from matplotlib.path import Path
+
+        lons = df.lon.values
+        lats = df.lat.values
+        (lon_min, lon_max), (lat_min, lat_max) = self.clip_box()
+        inside = (lons > lon_min) & (lons < lon_max) & (lats > lat_min) & (lats < lat_max)
+        polygon = Path(self.clip)
+        inside = inside & polygon.contains_points(np.column_stack([lons, lats]))
+        return df.loc[inside, :]
+
+    def weights_file(self, source, target):
+        """
+        Path of the cached nearest-neighbour weights for regridding between two files
+        """
+        from ecoval.utils import grid_fingerprint
+
+        weights_dir = os.path.join(self.directory, "weights")
+        if not os.path.exists(weights_dir):
+            os.makedirs(weights_dir)
+        key = f"{grid_fingerprint(source)[:16]}_{grid_fingerprint(target)[:16]}"
+        return os.path.join(weights_dir, f"nn_{key}.nc")
+
+    def save(self):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        names = list(self.masks)
+        arrays = dict(
+            name=np.array(self.name),
+            fingerprint=np.array(self.fingerprint),
+            mask_names=np.array(names, dtype="U"),
+        )
+        if len(names) > 0:
+            arrays["masks"] = np.stack([self.masks[x] for x in names])
+        if self.clip is not None:
+            arrays["clip"] = self.clip
+        with open(os.path.join(self.directory, "bundle.npz"), "wb") as f:
+            np.savez_compressed(f, **arrays)
+
+    @classmethod
+    def load(cls, directory):
+        with np.load(os.path.join(directory, "bundle.npz"), allow_pickle=False) as data:
+            names = [str(x) for x in data["mask_names"]]
+            masks = dict()
+            if len(names) > 0:
+                masks = {x: data["masks"][i] for i, x in enumerate(names)}
+            clip = data["clip"] if "clip" in data.files else None
+            grid_file = os.path.join(directory, "grid.txt")
+            if not os.path.exists(grid_file):
+                grid_file = None
+            return cls(
+                name=data["name"].item(),
+                fingerprint=data["fingerprint"].item(),
+                directory=directory,
+                masks=masks,
+                clip=clip,
+                grid_file=grid_file,
+            )
+
+
+def _read_masks(ff):
+    """
+    Read each variable of a subdomain file as a boolean mask
+    """
+    masks = dict()
+    with xr.open_dataset(ff) as ds:
+        for vv in ds.data_vars:
+            values = ds[vv].values
+            if values.ndim != 2 or not np.issubdtype(values.dtype, np.number):
+                continue
+            masks[vv] = np.nan_to_num(values) > 0
+        lons = ds[[x for x in ds.coords if "lon" in x][0]].values
+        lats = ds[[x for x in ds.coords if "lat" in x][0]].values
+    return masks, lons, lats
+
+
+def register_grid(name, ff, subdomains=None, clip=None, fix_grid=False, directory=None):
+    """
+    Register a grid, so that its assets are reused whenever model output on it is validated
+
+    Parameters
+    ----------
+    name : str
+        Name of the grid, e.g. "amm15"
+    ff : str
+        A model output file on the grid
+    subdomains : str
+        Optional netCDF file of subdomain masks on the grid. Each variable is one mask
+    clip : list
+        Optional polygon, as a list of [lon, lat] vertices, that point matchups are clipped to
+    fix_grid : bool
+        Set to True if the model output does not describe its grid properly. The regular grid
+        in the subdomain file will then be used
+    directory : str
+        The registry the bundle is stored in. Defaults to registry_dir()
+
+    Returns
+    -------
+    bundle : GridBundle
+
+    """
+    from ecoval.utils import grid_fingerprint
+
+    if fix_grid and subdomains is None:
+        raise ValueError("A subdomain file is needed to fix the grid")
+
+    if directory is None:
+        directory = registry_dir()
+    fingerprint = grid_fingerprint(ff)
+    key = (os.path.abspath(directory), fingerprint)
+    directory = os.path.join(directory, fingerprint)
+    masks = dict()
+    if subdomains is not None:
+        masks, lons, lats = _read_masks(subdomains)
+    bundle = GridBundle(name, fingerprint, directory, masks=masks, clip=clip)
+    bundle.save()
+    if fix_grid:
+        bundle.grid_file = os.path.join(directory, "grid.txt")
+        with open(bundle.grid_file, "w") as f:
+            f.write(_lonlat_description(lons, lats))
+    _bundles[key] = bundle
+    return bundle
+
+
+def registered_name(fingerprint, directory=None):
+    """
+    The name of a registered grid, or None if the grid is not registered
+    """
+    bundle = find_bundle(fingerprint, directory)
+    if bundle is None:
+        return None
+    return bundle.name
+
+
+def find_bundle(fingerprint, directory=None):
+    """
+    Load the bundle for a grid fingerprint, or None if the grid has not been registered
+
+    Parameters
+    ----------
+    fingerprint : str
+        The grid fingerprint, see utils.grid_fingerprint
+    directory : str
+        The registry to look in. Defaults to registry_dir()
+    """
+    if directory is None:
+        directory = registry_dir()
+    key = (os.path.abspath(directory), fingerprint)
+    if key in _bundles:
+        return _bundles[key]
+    directory = os.path.join(directory, fingerprint)
+    if not os.path.exists(os.path.join(directory, "bundle.npz")):
+        return None
+    _bundles[key] = GridBundle.load(directory)
+    return _bundles[key]
+
+
+def get_bundle(grid_info=None, directory=None):
+    """
+    Get the asset bundle for the model grid
+
+    Built-in grids are registered the first time they are seen, so later runs load their assets
+    directly. They are stored in the registry, see registry_dir.
+
+    Parameters
+    ----------
+    grid_info : GridInfo
+        The model grid. Defaults to the grid information of the current run
+    directory : str
+        The registry to use. Defaults to registry_dir()
+
+    Returns
+    -------
+    bundle : GridBundle, or None if the grid is not known
+
+    """
+    if grid_info is None:
+        from ecoval.grid import get_grid_info
+
+        grid_info = get_grid_info()
+    if grid_info is None:
+        return None
+    if directory is None:
+        directory = registry_dir()
+    bundle = find_bundle(grid_info.fingerprint, directory)
+    if bundle is not None:
+        return bundle
+    if grid_info.known_grid not in builtin_grids:
+        return None
+
+    # register the built-in grid using the packaged assets
+    name = grid_info.known_grid
+    info = builtin_grids[name]
+    key = (os.path.abspath(directory), grid_info.fingerprint)
+    directory = os.path.join(directory, grid_info.fingerprint)
+    ff_subdomains = pkg_resources.resource_filename("ecoval", info["subdomains"])
+    masks, lons, lats = _read_masks(ff_subdomains)
+    bundle = GridBundle(name, grid_info.fingerprint, directory, masks=masks, clip=info["clip"])
+    try:
+        bundle.save()
+        bundle.grid_file = os.path.join(directory, "grid.txt")
+        with open(bundle.grid_file, "w") as f:
+            f.write(_lonlat_description(lons, lats))
+        print(f"The {name} grid assets are stored in {directory}")
+    except OSError:
+        # the registry is not writable, so use the packaged file directly
+        bundle.grid_file = ff_subdomains
+    _bundles[key] = bundle
+    return bundle
+
+
+def nn_weights(bundle, source, target):
+    """
+    Cached cdo nearest-neighbour weights for regridding one file to the grid of another
+
+    The weights are generated the first time a pair of grids is seen, and stored in the bundle
+
+    Parameters
+    ----------
+    bundle : GridBundle
+        The bundle of the model grid
+    source : str
+        The file to regrid
+    target : str
+        A file on the target grid
+
+    Returns
+    -------
+    weights : str, or None if cdo could not generate the weights
+    """
+    weights = bundle.weights_file(source, target)
+    if os.path.exists(weights):
+        return weights
+    # write to a temporary file first, so parallel runs never see partial weights
+    weights_tmp = f"{weights}.{os.getpid()}.tmp"
+    cdo_result = subprocess.run(
+        ["cdo", "-s", f"gennn,{target}", source, weights_tmp],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    if cdo_result.returncode != 0 or not os.path.exists(weights_tmp):
+        return None
+    os.replace(weights_tmp, weights)
+    return weights
+
+
+def regrid_nn(ds, target):
+    """
+    Nearest-neighbour regridding of a dataset, reusing cached weights when the model grid is known
+
+    Parameters
+    ----------
+    ds : nctoolkit.DataSet
+        Dataset to regrid. This is modified in place
+    target : nctoolkit.DataSet
+        Dataset with the target grid
+
+    """
+    bundle = get_bundle()
+    if bundle is None:
+        ds.regrid(target, method="nn")
+        return None
+
+    ds.run()
+    target.run()
+    if len(ds) != 1 or len(target) != 1:
+        ds.regrid(target, method="nn")
+        return None
+    weights = nn_weights(bundle, ds[0], target[0])
+    if weights is None:
+        ds.regrid(target, method="nn")
+        return None
+    ds.cdo_command(f"remap,{target[0]},{weights}")
+    ds.run()
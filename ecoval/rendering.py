@@ -0,0 +1,67 @@
+import glob
+import jupytext
+from ecoval.chunkers import build_context, expand_chunks
+
+
+def _fix_lines(text, build="html", test=False, r_options=True):
+    """
+    Turn off R warnings, set the test status and remove latex page breaks from html builds
+    """
+    new_lines = []
+    for line in text.split("\n"):
+        new_lines.append(line)
+        if r_options and "%%R" in line:
+            new_lines.append("options(warn=-1)")
+    for i in range(len(new_lines)):
+        if build == "html" and r_options:
+            new_lines[i] = new_lines[i].replace("latexpagebreak", "")
+        new_lines[i] = new_lines[i].replace("the_test_status", str(test))
+    return "\n".join(new_lines)
+
+
+def render_notebook(path, build="html", test=False, fast_plot=False, r_options=True, context=None):
+    """
+    Insert the chunks into a generated notebook and fill in the build settings
+
+    The notebook is converted to py:percent text in memory, so the chunks can be inserted as
+    cells, and then written back once.
+
+    Parameters
+    ----------
+    path : str
+        Path to the notebook
+    build : str
+        "html" or "pdf"
+    test : bool
+        Whether this is a test build
+    fast_plot : bool
+        Value of fast_plot in the notebook
+    r_options : bool
+        Whether to turn off R warnings, and remove latex page breaks from html builds
+    context : dict
+        The build context, from chunkers.build_context. Default is None, which means it is
+        worked out from the matched data
+
+    """
+    if context is None:
+        context = build_context(build)
+    nb = jupytext.read(path, fmt="ipynb")
+    text = jupytext.writes(nb, fmt="py:percent")
+    text = expand_chunks(text, context)
+    text = _fix_lines(text, build=build, test=test, r_options=r_options)
+    nb = jupytext.reads(text, fmt="py:percent")
+    for cell in nb.cells:
+        cell.source = cell.source.replace("fast_plot_value", str(fast_plot))
+    jupytext.write(nb, path, fmt="ipynb")
+
+
+def render_notebooks(notebook_dir, build="html", test=False, fast_plot=False, r_options=True):
+    """
+    Render every notebook in a directory. See render_notebook
+    """
+    # the matched data is only looked at once per build
+    context = build_context(build)
+    for ff in sorted(glob.glob(f"{notebook_dir}/*.ipynb")):
+        render_notebook(
+            ff, build=build, test=test, fast_plot=fast_plot, r_options=r_options, context=context
+        )
@@ -1,22 +1,22 @@
 from __future__ import print_function
-from numpy import median,empty,logical_or,arange
+import os
+import multiprocessing
+from glob import glob
+from numpy import median,empty,logical_or,arange,asarray,partition,argsort,cumsum,searchsorted,\
+    minimum,maximum,where,repeat,ones,zeros,log2,unique,concatenate,inf,column_stack,\
+    unravel_index,vectorize,count_nonzero
+from numpy.random import default_rng
 from numpy.ma import getmaskarray,getdata,masked_where
-from numpyXtns import nearest
-from scipy.misc import comb
+from scipy.special import comb
 from scipy.stats.mstats import mquantiles
-try:
-    from itertools import izip as zip
-except:
-    pass
-
-binomcoeff=lambda n,k:nearest(comb(n,k))
+from tqdm import tqdm
 
 def IQR(data):
     q25,q75=mquantiles(data,prob=[.25,.75])
     return q75-q25
 
 def flatCompress(data):
-   if any(getmaskarray(data)):
+   if getmaskarray(data).any():
       return data.ravel().compressed()
    else:
       return getdata(data).ravel()
@@ -29,20 +29,54 @@ def flatCompressSamples(s1,s2):
 
 def MIDExplicit(data):
     """Median Interpoint Difference:
-        MID=med|xi-xj|,i<j"""
+        MID=med|xi-xj|,i<j
+    In this version the mathematical definition was directly translated
+    into code. This is highly inefficient (time and memory) and should only
+    be used for checks."""
+    data=flatCompress(data)
+    n=data.shape[0]
+    if n<2:
+        if n==1:
+            return 0.
+        else:
+            return None
     d=[]
-    for n,x in enumerate(data.ravel()):
-        for y in data.ravel()[n:]:
+    for j,x in enumerate(data):
+        for y in data[:j]:
            d.append(abs(x-y))
     d.sort()
-    k=(n+1)*n//2//2
-    print("Moment",k,"of",n+1)
-    return d[k]
+    return d[(len(d)+1)//2-1]
+
+def _cn(n):
+    """Small sample correction factors for Sn"""
+    if n<10:
+        return {2:.743,3:1.851,4:.954,5:1.351,6:.993,7:1.198,8:1.005,9:1.131}[n]
+    elif n%2==1:
+        return n/(n-.9)
+    return 1.
+
+def _dn(n):
+    """Small sample correction factors for Qn"""
+    if n<10:
+        return {2:.399,3:.994,4:.512,5:.844,6:.611,7:.857,8:.669,9:.872}[n]
+    elif n%2==1:
+        return n/(n+1.4)
+    return n/(n+3.8)
+
+def _sortedSample(data):
+    """Flattened, unmasked and sorted copy of the data"""
+    y=asarray(flatCompress(data),dtype=float).copy()
+    y.sort()
+    return y
 
 def Sn(data):
     """ Robust Scale measure:
     Sn = 1.1926 lowmed(i=1,n)( highmed(j=1,n)(|xi - xj|) )
-    Optimised Version
+    Optimised Version, vectorised with numpy.
+    For each xi the highmed is the half-width of the narrowest window
+    of n//2+1 consecutive sorted values that contains xi. The windows of
+    all points are found together with a binary search, so the cost is
+    O(n log n) in time and O(n) in memory.
     See:
     Rousseeuw, P. J. & Croux
     C. Alternatives to the Median Absolute Deviation
@@ -52,104 +86,42 @@ def Sn(data):
     Time-efficient algorithms for two highly robust estimators of scale
     Computational Statistics
     1992, 1 """
-    y=data.flatten()
-    if y.shape[0]<2:
-        if y.shape[0]==1:
+    y=_sortedSample(data)
+    n=y.shape[0]
+    if n<2:
+        if n==1:
             return 0.
         else:
             return None
+    return _snSorted(y)
+
+def _snSorted(y):
+    """Sn of sorted data with at least two values"""
     n=y.shape[0]
-    nlm=(n+1)//2 #low median index
-    y.sort()
-    a2=empty(y.shape)
-    a2[0]=y[n//2]-y[0]
-    for i,yy in zip(arange(1,nlm),y[1:nlm]):
-        nA=i
-        nB=n-i-1
-        diff=nB-nA
-        leftA=1
-        leftB=1
-        rightA=nB
-        rightB=nB
-        Amin=diff//2+1
-        Amax=diff//2+nA
-        while leftA<rightA:
-            length=rightA-leftA+1
-            even=1-length%2
-            half=(length-1)//2
-            tryA=leftA+half
-            tryB=leftB+half
-            if tryA<Amin:
-                rightB=tryB
-                leftA=tryA+even
-            elif tryA>Amax:
-                rightA=tryA
-                leftB=tryB+even
-            else:
-                medA=yy-y[i-1-tryA+Amin]
-                medB=y[tryB+i]-yy
-                if medA>=medB:
-                    rightA=tryA
-                    leftB=tryB+even
-                else:
-                    rightB=tryB
-                    leftA=tryA+even
-        if leftA>Amax:
-            a2[i]=y[leftB+i]-yy
-        else:
-            medA=yy-y[i-1-leftA+Amin]
-            medB=y[leftB+i]-yy
-            a2[i]=min(medA,medB)
-    for i,yy in zip(arange(nlm,n-1),y[nlm:n-1]):
-        nA=n-i-1
-        nB=i
-        diff=nB-nA
-        leftA=1
-        leftB=1
-        rightA=nB
-        rightB=nB
-        Amin=diff//2+1
-        Amax=diff//2+nA
-        while leftA<rightA:
-            length=rightA-leftA+1
-            even=1-length%2
-            half=(length-1)//2
-            tryA=leftA+half
-            tryB=leftB+half
-            if tryA<Amin:
-                rightB=tryB
-                leftA=tryA+even
-            elif tryA>Amax:
-                rightA=tryA
-                leftB=tryB+even
-            else:
-                medA=y[i+tryA-Amin+1]-yy
-                medB=yy-y[i-tryB]
-                if medA>=medB:
-                    rightA=tryA
-                    leftB=tryB+even
-                else:
-                    rightB=tryB
-                    leftA=tryA+even
-        if leftA>Amax:
-            a2[i]=yy-y[i-leftB]
-        else:
-            medA=y[i+1+leftA-Amin]-yy
-            medB=yy-y[i-leftB]
-            a2[i]=min(medA,medB)
-    a2[n-1]=y[n-1]-y[nlm-1]
-    if n<10:
-        if n==2: cn=.743
-        elif n==3: cn=1.851
-        elif n==4: cn=.954
-        elif n==5: cn=1.351
-        elif n==6: cn=.993
-        elif n==7: cn=1.198
-        elif n==8: cn=1.005
-        elif n==9: cn=1.131
-    elif n%2==1:cn=n/(n-.9)
-    else: cn=1.
-    return cn*1.1926*orderStatistic(a2,nlm,n)
+    k=n//2+1 #high median index
+    i=arange(n)
+    # windows y[l:l+k] containing y[i] start between lo and hi
+    lo=maximum(i-k+1,0)
+    hi=minimum(i,n-k)
+    # first window start where the right hand distance is at least the left hand one
+    a=lo.copy()
+    b=hi+1
+    search=a<b
+    while search.any():
+        m=(a[search]+b[search])//2
+        right=y[m+k-1]-y[i[search]]>=y[i[search]]-y[m]
+        a[search]=where(right,a[search],m+1)
+        b[search]=where(right,m,b[search])
+        search=a<b
+    a2=empty(n)
+    a2.fill(float("inf"))
+    inside=a<=hi
+    l=a[inside]
+    a2[inside]=maximum(y[i[inside]]-y[l],y[l+k-1]-y[i[inside]])
+    before=a-1>=lo
+    l=a[before]-1
+    a2[before]=minimum(a2[before],maximum(y[i[before]]-y[l],y[l+k-1]-y[i[before]]))
+    return _cn(n)*1.1926*orderStatistic(a2,(n+1)//2,n)
 
 def SnExplicit(data,c=1.1926):
    """ Robust Scale measure:
@@ -177,22 +149,11 @@ def SnExplicit(data,c=1.1926):
    nsize=data.shape[0]
    for n,d in enumerate(data):
       dists[n]=orderStatistic(abs(d-data),nsize//2+1,nsize)
-   if nsize<10:
-        if nsize==2: cn=.743
-        elif nsize==3: cn=1.851
-        elif nsize==4: cn=.954
-        elif nsize==5: cn=1.351
-        elif nsize==6: cn=.993
-        elif nsize==7: cn=1.198
-        elif nsize==8: cn=1.005
-        elif nsize==9: cn=1.131
-   else:
-        if nsize%2==1:cn=nsize/(nsize-.9)
-        else: cn=1.
-   return cn*c*orderStatistic(dists,(nsize+1)//2,nsize)
+   return _cn(nsize)*c*orderStatistic(dists,(nsize+1)//2,nsize)
 
-def Sdist(s1,s2,distFun):
-   """Computes distance scale between to sets of samples based on Sn scale."""
+def SdistExplicit(s1,s2,distFun):
+   """Computes distance scale between to sets of samples based on Sn scale.
+   This version loops over all pairs and should only be used for checks."""
    dists1=empty(s1.shape)
    for n,d1 in enumerate(s1):
        dists2=empty(s2.shape)
@@ -201,9 +162,65 @@ def Sdist(s1,s2,distFun):
        dists1[n]=median(dists2)
    return median(dists1)
 
+def _pairCounts(y,rows,trial,strict):
+    """For each row i, the number of j>i with y[j]-y[i]<trial (<=trial if not strict).
+    The search on y[i]+trial is corrected against the differences themselves,
+    so the counts are exact in floating point."""
+    n=y.shape[0]
+    s=searchsorted(y,y[rows]+trial,side="left" if strict else "right")
+    s=minimum(maximum(s,rows+1),n)
+    below=(lambda d:d<trial) if strict else (lambda d:d<=trial)
+    while True:
+        down=(s>rows+1)
+        down[down]=~below(y[s[down]-1]-y[rows[down]])
+        s[down]-=1
+        up=(s<n)
+        up[up]=below(y[s[up]]-y[rows[up]])
+        s[up]+=1
+        if not down.any() and not up.any():
+            return s-rows-1
+
+def _pairOrderStatistic(y,k):
+    """The kth order statistic (1 based) of the differences y[j]-y[i], i<j,
+    of sorted data, without forming the n(n-1)/2 differences.
+    Each row of the implicit matrix of differences is sorted, so the
+    candidates are tracked as a column range per row. A trial value,
+    the weighted median of the row medians, removes at least a quarter
+    of the candidates at each step. Once at most n candidates are left
+    they are collected and the order statistic selected directly."""
+    n=y.shape[0]
+    rows=arange(n-1)
+    left=rows+1
+    right=ones(n-1,dtype=left.dtype)*(n-1)
+    while True:
+        width=right-left+1
+        active=width>0
+        if width[active].sum()<=n:
+            break
+        w=width[active]
+        r=rows[active]
+        trial=_whimed(y[left[active]+(w-1)//2]-y[r],w)
+        # rows without candidates have the same counts for any trial in range
+        fixed=(left-rows-1)[~active].sum()
+        P=_pairCounts(y,r,trial,True)
+        Q=_pairCounts(y,r,trial,False)
+        if k<=fixed+P.sum():
+            right[active]=r+P
+        elif k>fixed+Q.sum():
+            left[active]=r+Q+1
+        else:
+            return trial
+    w=width[active]
+    start=cumsum(w)-w
+    offsets=arange(w.sum())-repeat(start,w)
+    r=repeat(rows[active],w)
+    work=y[repeat(left[active],w)+offsets]-y[r]
+    return orderStatistic(work,k-(left-rows-1).sum(),work.shape[0])
+
 def MID(data):
-    """ Median interpoint distance, merory efficient version
-    adopted from:
+    """ Median interpoint distance, memory efficient version
+    MID=lowmed|xi-xj|,i<j
+    O(n log n) selection adopted from:
     Rousseeuw, P. J. & Croux
     C. Alternatives to the Median Absolute Deviation
     Journal of the American Statistical Association
@@ -212,86 +229,20 @@ def MID(data):
     Time-efficient algorithms for two highly robust estimators of scale
     Computational Statistics
     1992, 1"""
-    y=data.flatten()
-    if y.shape[0]<2:
-        if y.shape[0]==1:
+    y=_sortedSample(data)
+    n=y.shape[0]
+    if n<2:
+        if n==1:
             return 0.
         else:
             return None
-    n=y.shape[0]
-    k=n*(n-1)//2//2
-    print("Moment",k,"of",n)
-    y.sort()
-    left=n+1 -arange(n)
-    right=arange(n)+1
-    jhelp=n*(n+1)//2
-    knew=k+jhelp
-    nL=jhelp
-    nR=n*n
-    found=False
-    P=empty(n,dtype=int)
-    Q=empty(n,dtype=int)
-    weight=empty(n,dtype=int)
-    work=empty(n)
-    while (nR-nL>n) and not found:
-        j=0
-        for i,l,r,yy in zip(arange(1,n),left[1:],right[1:],y[1:]):
-            if l<=r:
-                w=r-l+1
-                jhelp=l+w//2
-                weight[j]=w
-                work[j]=yy-y[n-jhelp]
-                j+=1
-        trial=_whimed(work[:j],weight[:j])
-        j=0
-        for i,yy in zip(arange(n-1,-1,-1),y[::-1]):
-            while j<n and yy-y[n-j-1]<trial:
-                j+=1
-            P[i]=j
-        j=n+1
-        for i,yy in zip(arange(n),y):
-            while yy-y[n-j+1]>trial:
-                j-=1
-            Q[i]=j
-        sumP=P.sum()
-        sumQ=(Q-1).sum()
-        if knew<=sumP:
-            right=P.copy()
-            nR=sumP
-        else:
-            if knew>sumQ:
-                left=Q.copy()
-                nL=sumQ
-            else:
-                qn=trial
-                found=True
-    if not found:
-        j=0
-        for i,l,r,yy in zip(arange(1,n),left[1:],right[1:],y[1:]):
-            if l<=r:
-                for jj in arange(l,r+1):
-                    work[j]=yy-y[n-jj]
-                    j+=1
-        qn=orderStatistic(work,knew-nL,j)
-    if n<10:
-        if n==2: dn=.399
-        elif n==3: dn=.994
-        elif n==4: dn=.512
-        elif n==5: dn=.844
-        elif n==6: dn=.611
-        elif n==7: dn=.857
-        elif n==8: dn=.669
-        elif n==9: dn=.872
-    else:
-        if n%2==1: dn=n/(n+1.4)
-        else: dn=n/(n+3.8)
-    return dn*qn
+    return _pairOrderStatistic(y,(n*(n-1)//2+1)//2)
 
 def QnExplicit(data,c=2.2219):
    """ Robust Scale measure:
    Qn = c*dn*{|xi-xj|;i<j}_(k), i.e.
    the kth order statistic of the ( n over 2 ) interpoint distances.
-   k=(n/2+1 over 2)
+   k=(h over 2), h=n//2+1
    In this version the mathematical definition was directly translated
    into code. This is highly inefficient (time and memory) and should only
    be used for checks.
@@ -311,33 +262,23 @@ def QnExplicit(data,c=2.2219):
         else:
             return None
    n=data.shape[0]
-   if n<10:
-        if n==2: dn=.399
-        elif n==3: dn=.994
-        elif n==4: dn=.512
-        elif n==5: dn=.844
-        elif n==6: dn=.611
-        elif n==7: dn=.857
-        elif n==8: dn=.669
-        elif n==9: dn=.872
-   else:
-        if n%2==1: dn=n/(n+1.4)
-        else: dn=n/(n+3.8)
-   dists=empty(nearest(binomcoeff(n,2)))
+   dists=empty(comb(n,2,exact=True))
    k=0
    for j,d1 in enumerate(data):
       for m,d2 in enumerate(data[:j]):
          dists[k]=abs(d1-d2)
          k+=1
-   kord=binomcoeff(n/2+1,2)
-   return c*dn*orderStatistic(dists,kord,k)
+   h=n//2+1
+   kord=comb(h,2,exact=True)
+   return c*_dn(n)*orderStatistic(dists,kord,k)
 
 def Qn(data):
     """ Robust Scale measure:
     Qn = c*dn*{|xi-xj|;i<j}_(k), i.e.
     the kth order statistic of the ( n over 2 ) interpoint distances.
-    k=(n/2+1 over 2)
-    Optimised Version.
+    k=(h over 2), h=n//2+1
+    Optimised Version, vectorised with numpy: O(n log n) in time and
+    O(n) in memory.
     See:
     Rousseeuw, P. J. & Croux
     C. Alternatives to the Median Absolute Deviation
@@ -347,84 +288,25 @@ def Qn(data):
     Time-efficient algorithms for two highly robust estimators of scale
     Computational Statistics
     1992, 1"""
-    y=data.flatten()
-    if y.shape[0]<2:
-        if y.shape[0]==1:
+    y=_sortedSample(data)
+    n=y.shape[0]
+    if n<2:
+        if n==1:
             return 0.
         else:
             return None
+    return _qnSorted(y)
+
+def _qnSorted(y):
+    """Qn of sorted data with at least two values"""
     n=y.shape[0]
     h=n//2+1
-    k=h*(h-1)//2
-    y.sort()
-    left=n+1 -arange(n)
-    right=arange(n)+1
-    jhelp=n*(n+1)//2
-    knew=k+jhelp
-    nL=jhelp
-    nR=n*n
-    found=False
-    P=empty(n,dtype=int)
-    Q=empty(n,dtype=int)
-    weight=empty(n,dtype=int)
-    work=empty(n)
-    while (nR-nL>n) and not found:
-        j=0
-        for i,l,r,yy in zip(arange(1,n),left[1:],right[1:],y[1:]):
-            if l<=r:
-                w=r-l+1
-                jhelp=l+w//2
-                weight[j]=w
-                work[j]=yy-y[n-jhelp]
-                j+=1
-        trial=_whimed(work[:j],weight[:j])
-        j=0
-        for i,yy in zip(arange(n-1,-1,-1),y[::-1]):
-            while j<n and yy-y[n-j-1]<trial:
-                j+=1
-            P[i]=j
-        j=n+1
-        for i,yy in zip(arange(n),y):
-            while yy-y[n-j+1]>trial:
-                j-=1
-            Q[i]=j
-        sumP=P.sum()
-        sumQ=(Q-1).sum()
-        if knew<=sumP:
-            right=P.copy()
-            nR=sumP
-        else:
-            if knew>sumQ:
-                left=Q.copy()
-                nL=sumQ
-            else:
-                qn=trial
-                found=True
-    if not found:
-        j=0
-        for i,l,r,yy in zip(arange(1,n),left[1:],right[1:],y[1:]):
-            if l<=r:
-                for jj in arange(l,r+1):
-                    work[j]=yy-y[n-jj]
-                    j+=1
-        qn=orderStatistic(work,knew-nL,j)
-    if n<10:
-        if n==2: dn=.399
-        elif n==3: dn=.994
-        elif n==4: dn=.512
-        elif n==5: dn=.844
-        elif n==6: dn=.611
-        elif n==7: dn=.857
-        elif n==8: dn=.669
-        elif n==9: dn=.872
-    else:
-        if n%2==1: dn=n/(n+1.4)
-        else: dn=n/(n+3.8)
-    return dn*2.2219*qn
+    return _dn(n)*2.2219*_pairOrderStatistic(y,h*(h-1)//2)
 
-def Qdist(s1,s2,distFun):
-   """Computes distance scale between to sets of samples based on Sn scale."""
-   dists=empty(s1.shape[0]*s2,shape[0])
+def QdistExplicit(s1,s2,distFun):
+   """Computes distance scale between to sets of samples based on Qn scale.
+   This version loops over all pairs and should only be used for checks."""
+   dists=empty(s1.shape[0]*s2.shape[0])
    k=0
    for d1 in s1:
        for d2 in s2:
@@ -432,6 +314,194 @@ def Qdist(s1,s2,distFun):
            k+=1
    return mquantiles(dists,[.25,])[0]
 
+# samples and distance function of the blockwise distance scales, set in each worker
+_pairData=dict()
+
+def absoluteDistance(a,b):
+    return abs(a-b)
+
+def _setPairData(s1,s2,distFun):
+    _pairData["s1"]=s1
+    _pairData["s2"]=s2
+    _pairData["distFun"]=distFun
+
+def _pairDistances(i0,i1):
+    """Distances between rows i0 to i1 of the first sample and all of the second sample"""
+    s1=_pairData["s1"]
+    s2=_pairData["s2"]
+    d=_pairData["distFun"](s1[i0:i1,None],s2[None,:])
+    return asarray(d,dtype=float).reshape(i1-i0,s2.shape[0])
+
+def _vectorised(s1,s2,distFun):
+    """The distance function, wrapped with numpy.vectorize if it does not broadcast"""
+    a=s1[:2,None]
+    b=s2[None,:3]
+    try:
+        if asarray(distFun(a,b)).shape==(a.shape[0],b.shape[1]):
+            return distFun
+    except Exception:
+        pass
+    if s1.ndim>1:
+        raise ValueError("distFun must broadcast over arrays of samples with more than one dimension")
+    return vectorize(distFun,otypes=[float])
+
+def _tilePool(s1,s2,distFun,cores):
+    """Set up the samples for tiles computed in this process, or in a pool of processes"""
+    _setPairData(s1,s2,distFun)
+    if cores<2:
+        return None
+    # the pool is forked, so the samples are not copied for each tile
+    return multiprocessing.Pool(cores,initializer=_setPairData,initargs=(s1,s2,distFun))
+
+def _mapTiles(pool,fun,tiles,*args):
+    if pool is None:
+        return [fun(i0,i1,*args) for i0,i1 in tiles]
+    jobs=[pool.apply_async(fun,(i0,i1)+args) for i0,i1 in tiles]
+    return [job.get() for job in jobs]
+
+def _tiles(n1,n2,memory):
+    """Row blocks of the first sample whose distance tiles fit in memory (bytes).
+    A few temporary arrays of the tile size are needed, so allow 32 bytes per pair."""
+    rows=max(1,int(memory//(32*n2)))
+    return [(i0,min(i0+rows,n1)) for i0 in range(0,n1,rows)]
+
+def _tileMedians(i0,i1):
+    return median(_pairDistances(i0,i1),axis=1)
+
+def _tilePass(i0,i1,pivots,ranges,seed):
+    """Counts of the distances below and up to each pivot, and the distances in each
+    (lower,upper] range, keeping each with the probability given for the range"""
+    d=_pairDistances(i0,i1).ravel()
+    counts=[(count_nonzero(d<p),count_nonzero(d<=p)) for p in pivots]
+    rng=default_rng([seed,i0])
+    values=[]
+    for lower,upper,rate in ranges:
+        if rate<1:
+            # draw the sample positions first, rather than a random number for every distance
+            v=d[rng.integers(0,d.shape[0],rng.binomial(d.shape[0],rate))]
+        else:
+            v=d
+        values.append(v[(v>lower)&(v<=upper)])
+    return counts,values
+
+def _pairSelect(s1,s2,distFun,ranks,tiles,pool,cap,sampleSize=100000,seed=0):
+    """Order statistics (1 based ranks) of all distances between two samples, without
+    forming them all. Each pass over the tiles counts the distances below two pivots,
+    which are quantiles of a sample of the remaining candidates placed either side of
+    the target ranks. Once the candidates fit in cap values they are collected and
+    the order statistics selected directly. Usually two or three passes are needed."""
+    n1,n2=s1.shape[0],s2.shape[0]
+    found=dict()
+    lower,upper=-inf,inf
+    nlower,nupper=0,n1*n2 # number of distances up to lower and upper
+    rng=default_rng(seed)
+    sample=asarray(distFun(s1[rng.integers(0,n1,sampleSize)],s2[rng.integers(0,n2,sampleSize)]),dtype=float).ravel()
+    npass=0
+    while True:
+        todo=[r for r in sorted(set(ranks)) if r not in found]
+        if len(todo)==0:
+            return [found[r] for r in ranks]
+        ncand=nupper-nlower
+        if ncand<=cap or sample.shape[0]<10:
+            pivots=[]
+            if ncand<=cap:
+                ranges=[(lower,upper,1.)]
+            else:
+                ranges=[(lower,upper,min(1.,sampleSize/ncand))]
+        else:
+            sample.sort()
+            q1=(todo[0]-nlower)/ncand
+            q2=(todo[-1]-nlower)/ncand
+            margin=5*(0.25/sample.shape[0])**.5
+            q1=max(q1-margin,0.)
+            q2=min(q2+margin,1.)
+            pivots=[sample[int(q1*(sample.shape[0]-1))],sample[int(q2*(sample.shape[0]-1))]]
+            expected=(q2-q1)*ncand
+            ranges=[(pivots[0],pivots[1],1. if expected<=cap else min(1.,sampleSize/expected)),
+                (lower,upper,min(1.,sampleSize/ncand))]
+        results=_mapTiles(pool,_tilePass,tiles,pivots,ranges,seed+npass)
+        npass+=1
+        values=[concatenate([x[1][i] for x in results]) for i in range(len(ranges))]
+        if len(pivots)==0:
+            if ranges[0][2]==1.:
+                values[0].sort()
+                for r in todo:
+                    found[r]=values[0][r-nlower-1]
+            else:
+                sample=values[0]
+            continue
+        counts=[[sum(x[0][i][j] for x in results) for j in range(2)] for i in range(2)]
+        for p,(nlt,nle) in zip(pivots,counts):
+            for r in todo:
+                if nlt<r<=nle:
+                    found[r]=p
+        todo=[r for r in todo if r not in found]
+        if len(todo)==0:
+            continue
+        for p,(nlt,nle) in zip(pivots,counts):
+            if nle<todo[0] and p>lower:
+                lower,nlower=p,nle
+            if nle>=todo[-1] and p<upper:
+                upper,nupper=p,nle
+        if lower==pivots[0] and upper==pivots[1]:
+            if ranges[0][2]==1.:
+                values[0].sort()
+                for r in todo:
+                    found[r]=values[0][r-nlower-1]
+            sample=values[0]
+        else:
+            sample=values[1][(values[1]>lower)&(values[1]<=upper)]
+
+def _pairSamples(s1,s2,distFun):
+    s1=asarray(flatCompress(s1) if distFun is None else s1)
+    s2=asarray(flatCompress(s2) if distFun is None else s2)
+    if distFun is None:
+        distFun=absoluteDistance
+    return s1,s2,_vectorised(s1,s2,distFun)
+
+def Sdist(s1,s2,distFun=None,memory=2**28,cores=1):
+    """Computes distance scale between to sets of samples based on Sn scale:
+    med(i)( med(j)(distFun(s1i,s2j)) ).
+    The distances are computed in vectorised blocks of rows of s1, each using
+    no more than about memory bytes, and the blocks can be spread across cores.
+    distFun should broadcast over numpy arrays. It defaults to the absolute difference."""
+    s1,s2,distFun=_pairSamples(s1,s2,distFun)
+    pool=_tilePool(s1,s2,distFun,cores)
+    try:
+        dists1=concatenate(_mapTiles(pool,_tileMedians,_tiles(s1.shape[0],s2.shape[0],memory)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return median(dists1)
+
+def Qdist(s1,s2,distFun=None,memory=2**28,cores=1):
+    """Computes distance scale between to sets of samples based on Qn scale:
+    the first quartile of all distFun(s1i,s2j), as given by mquantiles.
+    The two order statistics needed are found by selection over vectorised
+    blocks of the distances, each using no more than about memory bytes, and
+    the blocks can be spread across cores. The n1*n2 distances are never
+    held in memory at once.
+    distFun should broadcast over numpy arrays. It defaults to the absolute difference."""
+    s1,s2,distFun=_pairSamples(s1,s2,distFun)
+    n=s1.shape[0]*s2.shape[0]
+    if n==0:
+        return None
+    # the quantile definition of mquantiles, with alphap=betap=0.4
+    aleph=n*.25+.4+.25*(1.-.4-.4)
+    k=int(min(max(aleph,1),max(n-1,1)))
+    gamma=min(max(aleph-k,0.),1.)
+    pool=_tilePool(s1,s2,distFun,cores)
+    try:
+        ranks=[k,min(k+1,n)]
+        x=_pairSelect(s1,s2,distFun,ranks,_tiles(s1.shape[0],s2.shape[0],memory),pool,cap=max(memory//16,1000))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if n==1:
+        return x[0]
+    return (1.-gamma)*x[0]+gamma*x[1]
 
 def MAD(data,c=1.4826):
    """Computes Median Absolute Deviation:
@@ -458,47 +528,175 @@ def unbiasedMAE(x,y):
    return median(abs(x-y-median(x)+median(y)))
 
 def orderStatistic(data,nq,n):
+    """The nq-th smallest (1 based) of the first n values. The data is not modified."""
     x=data.ravel()[:n]
-    x.sort()
-    return x[nq-1]
+    return partition(x,nq-1)[nq-1]
 
 def _whimed(a,iw):
-    nn=a.shape[0]
-    acand=empty(nn)
-    iwcand=empty(nn)
-    wtotal=iw.sum()
-    wrest=0
-    while True:
-      trial=orderStatistic(a,nn//2+1,nn)
-      wleft=0
-      wmid=0
-      wright=0
-      for i,aa,w in zip(arange(nn),a[:nn],iw[:nn]):
-        if aa<trial:
-            wleft+=w
-        elif aa>trial:
-            wright+=w
-        else:
-            wmid+=w
-      if 2*wrest+2*wleft>wtotal:
-        kcand=0
-        for i,aa,w in zip(arange(nn),a[:nn],iw[:nn]):
-            if aa<trial:
-                acand[kcand]=aa
-                iwcand[kcand]=w
-                kcand+=1
-        nn=kcand
-      elif 2*wrest+2*wleft+2*wmid>wtotal:
-        return trial
-      else:
-        kcand=0
-        for i,aa,w in zip(arange(nn),a[:nn],iw[:nn]):
-            if (aa>trial):
-                acand[kcand]=aa
-                iwcand[kcand]=w
-                kcand+=1
-        nn=kcand
-        wrest+=wleft+wmid
-      for i,aa,w in zip(arange(nn),acand[:nn],iwcand[:nn]):
-        a[i]=aa
-        iw[i]=w
+    """Weighted high median: the smallest a[i] for which the total weight of
+    the values up to and including it is more than half the total weight."""
+    order=argsort(a,kind="stable")
+    cw=cumsum(iw[order])
+    return a[order][searchsorted(2*cw,cw[-1],side="right")]
+
+robustMetrics=["MAD","Sn","Qn","MedianBias","unbiasedMAE"]
+groupKeys=["variable","layer","region","month"]
+
+def _segmentMedians(values,starts,counts):
+    """Medians of consecutive segments of values sorted within each segment"""
+    return (values[starts+(counts-1)//2]+values[starts+counts//2])/2
+
+def _segmentSort(values,codes):
+    """Sort values within each group, with the groups in order of their codes"""
+    # sorting the values and then stable sorting the integer codes is much faster than lexsort
+    order=argsort(values)
+    order=order[argsort(codes[order],kind="stable")]
+    return values[order]
+
+def _scaleChunk(values,starts,counts,name):
+    """Sn or Qn of each sorted segment"""
+    fun={"Sn":_snSorted,"Qn":_qnSorted}[name]
+    out=zeros(starts.shape[0])
+    for i,(s,c) in enumerate(zip(starts,counts)):
+        if c>1:
+            out[i]=fun(values[s:s+c])
+    return out
+
+def _scaleSegments(values,starts,counts,name,cores=1):
+    """Sn or Qn of each sorted segment, with the segments split evenly across cores"""
+    if cores<2 or starts.shape[0]<2:
+        return _scaleChunk(values,starts,counts,name)
+    # the work grows faster than linearly, so balance on n log n
+    work=cumsum(counts*log2(counts+1))
+    bounds=searchsorted(work,work[-1]*arange(1,cores)/cores)
+    bounds=unique(concatenate([[0],bounds,[starts.shape[0]]]))
+    pool=multiprocessing.Pool(cores)
+    jobs=[]
+    for i0,i1 in zip(bounds[:-1],bounds[1:]):
+        s0=starts[i0]
+        s1=starts[i1-1]+counts[i1-1]
+        jobs.append(pool.apply_async(_scaleChunk,[values[s0:s1],starts[i0:i1]-s0,counts[i0:i1],name]))
+    pool.close()
+    results=[job.get() for job in tqdm(jobs)]
+    pool.join()
+    return concatenate(results)
+
+def groupedStatistics(df,by=None,metrics=None,model="model",observation="observation",sample="error",cores=1):
+    """Robust statistics for every group of a table of model-observation matchups.
+    The data is sorted once by group and by value, so the median based metrics
+    are read off segment boundaries for all groups at once. Sn and Qn use the
+    O(n log n) kernels on each sorted segment, split across cores.
+    MedianBias and unbiasedMAE compare the model with the observations.
+    MAD, Sn and Qn are computed for one sample: the error (model - observation),
+    the model or the observation.
+    Parameters:
+        df: pandas.DataFrame of matchups
+        by: columns to group by. Defaults to those of variable, layer, region and month in df
+        metrics: list of metrics. Defaults to MAD, Sn, Qn, MedianBias and unbiasedMAE. MAE can also be given
+        sample: "error", "model" or "observation"
+        cores: number of processes used for Sn and Qn
+    Returns a tidy pandas.DataFrame with the group columns, n, metric and value."""
+    import pandas as pd
+    if by is None:
+        by=[x for x in groupKeys if x in df.columns]
+    if isinstance(by,str):
+        by=[by]
+    if metrics is None:
+        metrics=robustMetrics
+    if isinstance(metrics,str):
+        metrics=[metrics]
+    for x in by+[model,observation]:
+        if x not in df.columns:
+            raise ValueError(f"{x} is not a column of the data")
+    for x in metrics:
+        if x not in robustMetrics+["MAE"]:
+            raise ValueError(f"{x} is not a valid metric. Use one of {robustMetrics+['MAE']}")
+    if sample not in ["error","model","observation"]:
+        raise ValueError("sample must be error, model or observation")
+    df=df.loc[:,by+[model,observation]].dropna()
+    df=df.loc[(df[model]!=inf)&(df[model]!=-inf)&(df[observation]!=inf)&(df[observation]!=-inf),:]
+    m=df[model].values.astype(float)
+    o=df[observation].values.astype(float)
+    if len(by)>0:
+        grouped=df.groupby(by,sort=True)
+        codes=grouped.ngroup().values
+        keys=grouped.size().reset_index(name="n")
+    else:
+        codes=zeros(m.shape[0],dtype=int)
+        keys=pd.DataFrame({"n":[m.shape[0]]})
+    counts=keys.n.values
+    if counts.sum()==0:
+        return pd.DataFrame(columns=by+["n","metric","value"])
+    starts=cumsum(counts)-counts
+    x={"error":m-o,"model":m,"observation":o}[sample]
+    medians=dict()
+    def median_of(name,values):
+        if name not in medians:
+            medians[name]=_segmentMedians(_segmentSort(values,codes),starts,counts)
+        return medians[name]
+    results=[]
+    for metric in metrics:
+        if metric=="MAD":
+            value=1.4826*median_of("mad",abs(x-median_of("x",x)[codes]))
+        elif metric in ["Sn","Qn"]:
+            value=_scaleSegments(_segmentSort(x,codes),starts,counts,metric,cores)
+        elif metric=="MedianBias":
+            value=median_of("m",m)-median_of("o",o)
+        elif metric=="unbiasedMAE":
+            value=median_of("umae",abs(m-o-median_of("m",m)[codes]+median_of("o",o)[codes]))
+        elif metric=="MAE":
+            value=median_of("mae",abs(m-o))
+        results.append(keys.assign(metric=metric,value=value))
+    return pd.concat(results).reset_index(drop=True)
+
+def _pointRegions(df,matched_dir="matched"):
+    """Name of the subdomain of the model grid each matchup is in, or "all" if the
+    grid has no subdomains. Matchups outside every subdomain are "other"."""
+    from ecoval.grid import get_grid_info
+    from ecoval.registry import get_bundle, registry_dir
+    grid_info=get_grid_info(path=os.path.join(matched_dir,"model_grid.npz"))
+    bundle=None
+    if grid_info is not None:
+        bundle=get_bundle(grid_info,registry_dir(matched_dir))
+    if bundle is None or len(bundle.masks)==0:
+        return ["all"]*len(df)
+    if grid_info.lon.ndim==1:
+        def nearest_index(coords,values):
+            flip=coords[-1]<coords[0]
+            if flip:
+                coords=coords[::-1]
+            index=searchsorted((coords[1:]+coords[:-1])/2,values)
+            return coords.shape[0]-1-index if flip else index
+        index=(nearest_index(grid_info.lat,df.lat.values),nearest_index(grid_info.lon,df.lon.values))
+    else:
+        from scipy.spatial import cKDTree
+        tree=cKDTree(column_stack([grid_info.lon.ravel(),grid_info.lat.ravel()]))
+        index=unravel_index(tree.query(column_stack([df.lon.values,df.lat.values]))[1],grid_info.lon.shape)
+    regions=empty(len(df),dtype=object)
+    regions.fill("other")
+    for name in list(bundle.masks)[::-1]:
+        mask=bundle.masks[name]
+        if mask.shape==grid_info.shape:
+            regions[mask[index]]=name
+    return regions
+
+def pointStatistics(matched_dir="matched",by=None,metrics=None,sample="error",cores=1):
+    """Robust statistics for every (variable, layer, region, month) group of the matched point data.
+    Parameters:
+        matched_dir: the matched directory created by ecoval.matchup
+        by, metrics, sample, cores: see groupedStatistics
+    Returns a tidy pandas.DataFrame"""
+    import pandas as pd
+    paths=[x for x in glob(os.path.join(matched_dir,"point","**","*.csv"),recursive=True)
+        if os.path.basename(x)!="paths.csv" and not x.endswith("_unit.csv")]
+    if len(paths)==0:
+        raise ValueError(f"There is no matched point data in {matched_dir}")
+    dfs=[]
+    for ff in sorted(paths):
+        # files are matched/point/{domain}/{layer}/{variable}/{source}_{layer}_{variable}.csv
+        parts=os.path.normpath(ff).split(os.sep)
+        dfs.append(pd.read_csv(ff).assign(variable=parts[-2],layer=parts[-3]))
+    df=pd.concat(dfs).reset_index(drop=True)
+    if "region" not in df.columns:
+        df["region"]=_pointRegions(df,matched_dir)
+    return groupedStatistics(df,by=by,metrics=metrics,sample=sample,cores=cores)
@@ -0,0 +1,886 @@
+import os
+import glob
+import json
+import calendar
+import multiprocessing
+import numpy as np
+import pandas as pd
+import xarray as xr
+from tqdm import tqdm
+from ecoval.utils import _coordinate_names, bin_value
+from ecoval.grid import _spherical_areas, covers_globe
+from ecoval.kernels import temporal_metrics, temporal_metric_names
+from ecoval.moments import QuantileSketch
+
+
+summary_columns = [
+    "variable",
+    "source",
+    "region",
+    "n",
+    "unit",
+    "model_mean",
+    "observation_mean",
+    "bias",
+    "positive_bias",
+    "spatial_cor",
+    "temporal_cor",
+]
+
+monthly_columns = ["n", "model", "observation", "bias", "rmse", "cor"]
+
+
+def _time_name(ds):
+    return [x for x in ds.dims if "time" in x.lower()][0]
+
+
+def _read_matched(ff):
+    """
+    Read a matched gridded file as (time, y, x) arrays of model and observation values
+
+    Zeros in the model are missing, as in the notebooks. Years and months come from xarray, so
+    noleap and 360_day calendars, which decode to cftime dates, work too.
+    """
+    with xr.open_dataset(ff) as ds:
+        time_name = _time_name(ds)
+        lon_name, lat_name = _coordinate_names(ds)
+        fields = dict()
+        for vv in ["model", "observation"]:
+            da = ds[vv]
+            # drop singleton levels, e.g. the top level of WOA
+            extra = [x for x in da.dims if x != time_name and da.sizes[x] == 1]
+            da = da.isel({x: 0 for x in extra}, drop=True)
+            da = da.transpose(time_name, ...)
+            fields[vv] = da.values.astype("float64")
+            attrs = {x: da.attrs[x] for x in ["units", "long_name"] if x in da.attrs}
+            fields[vv + "_attrs"] = attrs
+        # template for writing fields on the same grid
+        template = da.isel({time_name: 0}, drop=True)
+        times = ds[time_name].values
+        years = ds[time_name].dt.year.values.astype("int64")
+        months = ds[time_name].dt.month.values.astype("int64")
+        lons = ds[lon_name].values
+        lats = ds[lat_name].values
+    fields["model"][fields["model"] == 0] = np.nan
+    fields["template"] = template
+    fields["time_name"] = time_name
+    fields["times"] = times
+    fields["years"] = years
+    fields["months"] = months
+    fields["lon"] = lons
+    fields["lat"] = lats
+    return fields
+
+
+def monthly_climatology(values, months):
+    """
+    Mean of each calendar month, ignoring missing values
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Values with time as the first dimension
+    months : numpy.ndarray
+        The month of each time step
+
+    Returns
+    -------
+    climatology : numpy.ndarray
+        One field for each month present, in calendar order
+    """
+    months = np.asarray(months)
+    present = np.unique(months)
+    climatology = np.full((len(present),) + values.shape[1:], np.nan)
+    for i, mm in enumerate(present):
+        x = values[months == mm]
+        valid = np.isfinite(x)
+        n = valid.sum(axis=0)
+        total = np.where(valid, x, 0).sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            climatology[i] = np.where(n > 0, total / n, np.nan)
+    return climatology
+
+
+def _nanmean(values):
+    valid = np.isfinite(values)
+    n = valid.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(n > 0, np.where(valid, values, 0).sum(axis=0) / n, np.nan)
+
+
+def temporal_correlation(model, observation, min_n=3):
+    """
+    Pearson correlation over time in each cell, using the time steps where both have values
+
+    Cells with fewer than min_n pairs, or no variability, are missing. See kernels.temporal_metrics
+    """
+    return temporal_metrics(model, observation, min_n=min_n)["cor"]
+
+
+def _weighted_mean(values, weights):
+    valid = np.isfinite(values)
+    if not valid.any():
+        return np.nan
+    return float(np.sum(values[valid] * weights[valid]) / np.sum(weights[valid]))
+
+
+def _weighted_cor(x, y, weights):
+    valid = np.isfinite(x) & np.isfinite(y)
+    if valid.sum() < 3:
+        return np.nan
+    x = x[valid]
+    y = y[valid]
+    w = weights[valid] / weights[valid].sum()
+    dx = x - np.sum(w * x)
+    dy = y - np.sum(w * y)
+    denominator = np.sqrt(np.sum(w * dx**2) * np.sum(w * dy**2))
+    if denominator == 0:
+        return np.nan
+    return float(np.sum(w * dx * dy) / denominator)
+
+
+# region labels of each grid, worked out once per process
+_labels = dict()
+
+
+def _subdomain_file(lons, lats):
+    """
+    The packaged subdomain file for a grid, or None for global grids
+
+    Grids are global by the same rule as the report chunks, see grid.covers_globe. Only the
+    AMM7 subdomains are packaged, so global grids get no subdomains until a global subdomain
+    file ships with ecoval.
+    """
+    import pkg_resources
+
+    if covers_globe(lons, lats):
+        return None
+    return pkg_resources.resource_filename("ecoval", "data/amm7_val_subdomains.nc")
+
+
+def _region_masks(shape, matched_dir, lons=None, lats=None):
+    """
+    The whole domain, plus the subdomains of the model grid if they match the matched fields
+
+    If the model grid has no subdomains that fit, the packaged subdomains are put on the
+    grid of the matched fields, as the notebooks do.
+    """
+    regions = {"all": np.ones(shape, dtype="bool")}
+    grid_file = os.path.join(matched_dir, "model_grid.npz")
+    if os.path.exists(grid_file):
+        from ecoval.grid import get_grid_info
+        from ecoval.registry import get_bundle, registry_dir
+
+        bundle = get_bundle(get_grid_info(path=grid_file), registry_dir(matched_dir))
+        if bundle is not None:
+            for name, mask in bundle.masks.items():
+                if mask.shape == shape:
+                    regions[name] = mask
+    if len(regions) > 1 or lons is None or lats is None:
+        return regions
+    if np.ndim(lons) != 1 or np.ndim(lats) != 1:
+        return regions
+    from ecoval.masks import region_mask, subdomains
+
+    ff = _subdomain_file(lons, lats)
+    if ff is None:
+        return regions
+    for name in subdomains(ff)[0]:
+        mask = region_mask(name, lons=lons, lats=lats, ff=ff, regrid=True)
+        if mask is not None and mask.shape == shape and mask.any():
+            regions[name] = mask
+    return regions
+
+
+def _region_labels(shape, matched_dir, lons=None, lats=None):
+    """
+    Region masks and their labels for a grid, see masks.label_regions
+    """
+    from ecoval.masks import label_regions
+
+    grid = None
+    if lons is not None and lats is not None:
+        grid = (np.asarray(lons).tobytes(), np.asarray(lats).tobytes())
+    key = (shape, os.path.abspath(matched_dir), grid)
+    if key not in _labels:
+        masks = _region_masks(shape, matched_dir, lons, lats)
+        _labels[key] = (masks,) + label_regions(masks)
+    return _labels[key]
+
+
+def regional_statistics(model, observation, labels, membership, weights=None):
+    """
+    Weighted regional statistics of each field, from one labelled reduction
+
+    The weighted sums of each label are found with a single bincount per moment, over all
+    fields at once. The sums of each region are then added up from the labels it contains.
+
+    Parameters
+    ----------
+    model, observation : numpy.ndarray
+        Fields with shape (fields, y, x), e.g. the monthly climatologies
+    labels : numpy.ndarray
+        Label of each cell, with shape (y, x). Cells outside all regions are -1
+    membership : numpy.ndarray
+        Boolean array of shape (labels, regions), see masks.label_regions
+    weights : numpy.ndarray
+        Weight of each cell, e.g. its area. Default is equal weights
+
+    Returns
+    -------
+    statistics : dict
+        n, model, observation, bias, rmse and cor, each with shape (fields, regions).
+        The correlation is the spatial correlation within each region
+
+    """
+    n_fields = model.shape[0]
+    n_labels = membership.shape[0]
+    if weights is None:
+        weights = np.ones(labels.shape)
+    valid = np.isfinite(model) & np.isfinite(observation) & (labels >= 0)
+    index = labels[None] + n_labels * np.arange(n_fields).reshape((-1,) + (1,) * labels.ndim)
+    index = index[valid]
+    x = model[valid]
+    y = observation[valid]
+    w = np.broadcast_to(weights, model.shape)[valid]
+    size = n_labels * n_fields
+
+    def reduce(values=None):
+        sums = np.bincount(index, weights=values, minlength=size).reshape(n_fields, n_labels)
+        return sums @ membership.astype("float64")
+
+    n = reduce()
+    sw = reduce(w)
+    sx = reduce(w * x)
+    sy = reduce(w * y)
+    sxx = reduce(w * x * x)
+    syy = reduce(w * y * y)
+    sxy = reduce(w * x * y)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = sx / sw
+        y_mean = sy / sw
+        x_var = sxx / sw - x_mean**2
+        y_var = syy / sw - y_mean**2
+        covariance = sxy / sw - x_mean * y_mean
+        mse = (sxx - 2 * sxy + syy) / sw
+        cor = covariance / np.sqrt(x_var * y_var)
+    cor[(n < 3) | ~np.isfinite(cor)] = np.nan
+    return {
+        "n": n.astype("int64"),
+        "model": x_mean,
+        "observation": y_mean,
+        "bias": x_mean - y_mean,
+        "rmse": np.sqrt(np.maximum(mse, 0)),
+        "cor": np.clip(cor, -1, 1),
+    }
+
+
+def _write(ds, out):
+    if not os.path.exists(os.path.dirname(out)):
+        os.makedirs(os.path.dirname(out))
+    encoding = {x: {"zlib": True, "complevel": 5} for x in ds.data_vars}
+    ds.to_netcdf(out, encoding=encoding)
+
+
+def write_sketches(model, observation, months, masks, out, accuracy=0.01):
+    """
+    Save quantile sketches of the paired model and observation values of each region and month
+
+    Parameters
+    ----------
+    model, observation : numpy.ndarray
+        Fields with shape (months, y, x), e.g. the monthly climatologies
+    months : numpy.ndarray
+        The month of each field
+    masks : dict
+        Boolean mask of each region
+    out : str
+        The .npz file the sketches are saved to
+    accuracy : float
+        Relative accuracy of the sketches
+
+    """
+    regions = []
+    sketch_months = []
+    sketches = {"model": [], "observation": []}
+    for region, mask in masks.items():
+        for i, mm in enumerate(months):
+            valid = mask & np.isfinite(model[i]) & np.isfinite(observation[i])
+            regions.append(region)
+            sketch_months.append(int(mm))
+            sketches["model"].append(QuantileSketch(accuracy).add(model[i][valid]))
+            sketches["observation"].append(QuantileSketch(accuracy).add(observation[i][valid]))
+    arrays = {"region": np.array(regions, dtype="str"), "month": np.array(sketch_months)}
+    for key in sketches:
+        arrays.update(QuantileSketch.pack(sketches[key], key))
+    if not os.path.exists(os.path.dirname(out)):
+        os.makedirs(os.path.dirname(out))
+    np.savez_compressed(out, **arrays)
+
+
+def load_sketches(variable, results_dir="results"):
+    """
+    Load the quantile sketches of a variable saved by the statistics stage
+
+    Returns
+    -------
+    sketches : dict
+        {"model": sketch, "observation": sketch} for each (region, month), or None if the
+        variable has no sketches
+    """
+    ff = f"{results_dir}/statistics/sketches_{variable}.npz"
+    if not os.path.exists(ff):
+        return None
+    with np.load(ff) as arrays:
+        arrays = dict(arrays)
+    model = QuantileSketch.unpack(arrays, "model")
+    observation = QuantileSketch.unpack(arrays, "observation")
+    keys = zip(arrays["region"].tolist(), arrays["month"].tolist())
+    return {
+        key: {"model": x, "observation": y} for key, x, y in zip(keys, model, observation)
+    }
+
+
+def sketch_cdf(variable, region="all", results_dir="results", cap=0.98):
+    """
+    Cumulative distributions of a variable in each month, from the quantile sketches
+
+    Values at or above the cap quantile are dropped and the distribution is rescaled, as the
+    CDF figures do with the raw values.
+
+    Parameters
+    ----------
+    variable : str
+        The variable
+    region : str
+        The region. Default is the whole domain
+    results_dir : str
+        Directory with the results
+    cap : float
+        Quantile the values are capped at, in each month. Default is 0.98
+
+    Returns
+    -------
+    cdf : pandas.DataFrame
+        Columns month, variable ("model" or "observation"), value and probability. None if
+        there are no sketches for the region
+
+    """
+    sketches = load_sketches(variable, results_dir)
+    if sketches is None:
+        return None
+    df = []
+    for (rr, month), pair in sketches.items():
+        if rr != region:
+            continue
+        for key, sketch in pair.items():
+            if sketch.count == 0:
+                continue
+            values, probability = sketch.cdf()
+            keep = values < sketch.quantile(cap)
+            if keep.sum() == 0:
+                continue
+            probability = probability[keep] / probability[keep][-1]
+            df.append(
+                pd.DataFrame(
+                    {"month": month, "variable": key, "value": values[keep], "probability": probability}
+                )
+            )
+    if len(df) == 0:
+        return None
+    return pd.concat(df).reset_index(drop=True)
+
+
+def variable_statistics(ff, results_dir="results", matched_dir="matched"):
+    """
+    Compute the fields and tables the report needs for one matched gridded file
+
+    The monthly climatologies are computed once and everything else is derived from them:
+    the annual and monthly means, the time-mean bias, the temporal correlation, bias, RMSE
+    and slope of the climatologies, the regional summaries, and quantile sketches of each
+    region and month.
+
+    Parameters
+    ----------
+    ff : str
+        A matched surface file, e.g. matched/gridded/nws/nitrate/nsbc_nitrate_surface.nc
+    results_dir : str
+        Directory the results are written to
+    matched_dir : str
+        Directory with the matched data
+
+    Returns
+    -------
+    summary : pandas.DataFrame
+        One row per region, with the columns in summary_columns
+    monthly : pandas.DataFrame
+        Regional means, bias, RMSE and spatial correlation of the monthly climatologies
+    """
+    variable = os.path.basename(ff).split("_")[1]
+    source = os.path.basename(ff).split("_")[0]
+    fields = _read_matched(ff)
+    months = fields["months"]
+    present = np.unique(months)
+
+    model = monthly_climatology(fields["model"], months)
+    observation = monthly_climatology(fields["observation"], months)
+    model_annual = _nanmean(model)
+    observation_annual = _nanmean(observation)
+    bias = _nanmean(model - observation)
+    temporals = temporal_metrics(model, observation)
+    cor = temporals["cor"]
+
+    template = fields["template"]
+    time_name = fields["time_name"]
+    model_attrs = fields["model_attrs"]
+    observation_attrs = fields["observation_attrs"]
+
+    def as_field(values, name, attrs):
+        da = template.copy(data=values.astype("float32"))
+        da.name = name
+        da.attrs = attrs
+        return da
+
+    ds_annual = xr.Dataset(
+        {
+            "model": as_field(model_annual, "model", model_attrs),
+            "observation": as_field(observation_annual, "observation", observation_attrs),
+        }
+    )
+    _write(ds_annual, f"{results_dir}/annual_mean/annualmean_{variable}.nc")
+
+    # the first time step of each month keeps the months decodable
+    times = [fields["times"][months == mm][0] for mm in present]
+    month_template = xr.concat([template] * len(present), dim=time_name)
+    month_template = month_template.assign_coords({time_name: times})
+
+    def as_months(values, name, attrs):
+        da = month_template.copy(data=values.astype("float32"))
+        da.name = name
+        da.attrs = attrs
+        return da
+
+    ds_monthly = xr.Dataset(
+        {
+            "model": as_months(model, "model", model_attrs),
+            "observation": as_months(observation, "observation", observation_attrs),
+        }
+    )
+    _write(ds_monthly, f"{results_dir}/monthly_mean/monthlymean_{variable}.nc")
+
+    bias_attrs = dict(model_attrs)
+    bias_attrs["long_name"] = "model bias"
+    _write(as_field(bias, "bias", bias_attrs).to_dataset(), f"{results_dir}/bias/bias_{variable}.nc")
+
+    long_names = {
+        "cor": "temporal correlation",
+        "bias": "temporal mean bias",
+        "rmse": "temporal root mean square error",
+        "slope": "slope of model against observation",
+    }
+    ds_cor = xr.Dataset(
+        {x: as_field(temporals[x], x, {"long_name": long_names[x]}) for x in temporal_metric_names}
+    )
+    _write(ds_cor, f"{results_dir}/temporals/{variable}_cor.nc")
+    df_cor = ds_cor.to_dataframe().reset_index().dropna(subset=["cor"])
+    df_cor.to_csv(f"{results_dir}/temporals/{variable}_cor.csv", index=False)
+
+    lons = np.asarray(fields["lon"], dtype="float64")
+    lats = np.asarray(fields["lat"], dtype="float64")
+    areas = _spherical_areas(lons, lats)
+    if areas.shape != bias.shape:
+        areas = np.ones(bias.shape)
+    areas = np.where(np.isfinite(areas) & (areas > 0), areas, 1)
+
+    unit = model_attrs.get("units", "")
+    masks, labels, membership, names = _region_labels(bias.shape, matched_dir, lons, lats)
+    summary = []
+    for region, mask in masks.items():
+        both = mask & np.isfinite(model_annual) & np.isfinite(observation_annual)
+        positive = np.where(np.isfinite(bias), bias > 0, np.nan)
+        summary.append(
+            {
+                "variable": variable,
+                "source": source,
+                "region": region,
+                "n": int(both.sum()),
+                "unit": unit,
+                "model_mean": _weighted_mean(model_annual[both], areas[both]),
+                "observation_mean": _weighted_mean(observation_annual[both], areas[both]),
+                "bias": _weighted_mean(bias[mask], areas[mask]),
+                "positive_bias": 100 * _weighted_mean(positive[mask], areas[mask]),
+                "spatial_cor": _weighted_cor(model_annual[both], observation_annual[both], areas[both]),
+                "temporal_cor": _weighted_mean(cor[mask], areas[mask]),
+            }
+        )
+
+    write_sketches(
+        model, observation, present, masks, f"{results_dir}/statistics/sketches_{variable}.npz"
+    )
+
+    # every region and month in one pass
+    regional = regional_statistics(model, observation, labels, membership, areas)
+    monthly = pd.DataFrame(
+        {
+            "variable": variable,
+            "source": source,
+            "region": np.tile(names, len(present)),
+            "month": np.repeat(present.astype("int64"), len(names)),
+        }
+    )
+    for key in monthly_columns:
+        monthly[key] = regional[key].ravel()
+    return pd.DataFrame(summary, columns=summary_columns), monthly
+
+
+def point_frames(ff, variable):
+    """
+    Read a matched point file and prepare it as the point notebooks do
+
+    Observations of pH below 4 and east of 9°E are dropped, positions are binned to 0.5°,
+    and the values are averaged in each bin and month (or only in each bin for carbon and
+    benthic biomass). The lowest 0.1% of the averaged observations are then dropped.
+
+    Parameters
+    ----------
+    ff : str
+        A matched point file, e.g. matched/point/nws/surface/nitrate/ices_surface_nitrate.csv
+    variable : str
+        The variable
+
+    Returns
+    -------
+    df_locs : pandas.DataFrame
+        The positions of the matched values, before binning
+    df_raw : pandas.DataFrame
+        The matched values, with binned positions
+    df : pandas.DataFrame
+        The binned averages
+
+    """
+    df = pd.read_csv(ff)
+    if variable == "ph":
+        df = df.query("observation > 4").reset_index(drop=True)
+    # Danish part is always dubious
+    df = df.query("lon < 9").copy()
+    df_locs = df.loc[:, ["lon", "lat"]].drop_duplicates()
+    df["lon"] = bin_value(df["lon"], 0.5)
+    df["lat"] = bin_value(df["lat"], 0.5)
+    df_raw = df
+    if variable == "benbio":
+        df = df.assign(observation=lambda x: 1000 * 0.45 * x.observation)
+    if variable not in ["carbon", "benbio"]:
+        df = df.groupby(["lon", "lat", "year", "month"]).mean().reset_index()
+    else:
+        df = df.groupby(["lon", "lat"]).mean().reset_index()
+    # bottom 0.1% of observations
+    bot_low = df.observation.quantile(0.001)
+    df = df.query(f"observation >= {bot_low}")
+    return df_locs, df_raw, df
+
+
+def point_histograms(df, bins=60):
+    """
+    2D histograms of model against observation, for all months and for each month
+
+    All histograms use the same bins, which span the values of both.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Matched values, with columns model, observation and optionally month
+    bins : int
+        Number of bins on each axis
+
+    Returns
+    -------
+    histograms : pandas.DataFrame
+        Columns month ("All months" or the month abbreviation), model and observation
+        (the bin centres) and n, for the bins with values
+
+    """
+    df = df.dropna(subset=["model", "observation"])
+    if len(df) == 0:
+        return None
+    values = np.concatenate([df.model.values, df.observation.values])
+    edges = np.linspace(values.min(), values.max(), bins + 1)
+    if edges[0] == edges[-1]:
+        edges = np.linspace(edges[0] - 0.5, edges[0] + 0.5, bins + 1)
+    centres = (edges[:-1] + edges[1:]) / 2
+    periods = [("All months", df)]
+    if "month" in df.columns:
+        for mm, df_mm in df.groupby("month"):
+            periods.append((calendar.month_abbr[int(mm)], df_mm))
+    histograms = []
+    for period, df_period in periods:
+        counts, _, _ = np.histogram2d(df_period.model, df_period.observation, bins=[edges, edges])
+        i_model, i_obs = np.nonzero(counts)
+        histograms.append(
+            pd.DataFrame(
+                {
+                    "month": period,
+                    "model": centres[i_model],
+                    "observation": centres[i_obs],
+                    "n": counts[i_model, i_obs].astype("int64"),
+                }
+            )
+        )
+    return pd.concat(histograms).reset_index(drop=True)
+
+
+def histograms_path(layer, variable, results_dir="results"):
+    return f"{results_dir}/statistics/histograms_{layer}_{variable}.csv"
+
+
+def _point_paths(matched_dir="matched", variables="all"):
+    """
+    The matched point files, with their layers and variables
+    """
+    paths = []
+    for ff in sorted(glob.glob(f"{matched_dir}/point/**/**/**/*.csv")):
+        layer, variable = os.path.normpath(ff).split(os.sep)[-3:-1]
+        source = os.path.basename(ff).split("_")[0]
+        # skip paths.csv, unit files and other tables
+        if os.path.basename(ff) != f"{source}_{layer}_{variable}.csv":
+            continue
+        if variables != "all" and variable not in variables:
+            continue
+        paths.append((ff, layer, variable))
+    return paths
+
+
+def write_point_histograms(
+    matched_dir="matched", results_dir="results", variables="all", bins=60, skip=None
+):
+    """
+    Save the model-observation histograms of each matched point variable
+
+    The histograms are saved to {results_dir}/statistics/histograms_{layer}_{variable}.csv,
+    from the binned averages the point notebooks plot. See point_frames and point_histograms.
+    Matched files in skip are left alone.
+    """
+    if skip is None:
+        skip = []
+    for ff, layer, variable in _point_paths(matched_dir, variables):
+        if ff in skip:
+            continue
+        try:
+            df = point_frames(ff, variable)[2]
+        except KeyError:
+            continue
+        histograms = point_histograms(df, bins=bins)
+        if histograms is None:
+            continue
+        out = histograms_path(layer, variable, results_dir)
+        if not os.path.exists(os.path.dirname(out)):
+            os.makedirs(os.path.dirname(out))
+        histograms.to_csv(out, index=False)
+
+
+def statistics_manifest(results_dir="results"):
+    return f"{results_dir}/statistics/manifest.json"
+
+
+def _unchanged_inputs(paths, shared, previous):
+    """
+    Hash the inputs of the statistics, and find the ones that match the previous run
+
+    Everything is stale if a shared input, e.g. the model grid or this module, has changed.
+    """
+    from ecoval.manifest import file_hash
+
+    previous_inputs = dict()
+    if previous is not None:
+        previous_inputs = previous["inputs"]
+    inputs = dict()
+    for ff in shared + paths:
+        inputs[ff] = file_hash(ff, previous_inputs)
+
+    def same(ff):
+        return ff in previous_inputs and previous_inputs[ff][2] == inputs[ff][2]
+
+    if previous is None or set(previous["shared"]) != set(shared):
+        return inputs, []
+    if not all(same(ff) for ff in shared):
+        return inputs, []
+    return inputs, [ff for ff in paths if same(ff)]
+
+
+def compute_statistics(
+    matched_dir="matched", results_dir="results", variables="all", cores=1, incremental=False
+):
+    """
+    Precompute the report statistics for all matched gridded surface data and point data
+
+    This reads each matched file once, so the notebooks only need to load and plot the results.
+    The outputs are:
+
+    - {results_dir}/annual_mean/annualmean_{variable}.nc
+    - {results_dir}/monthly_mean/monthlymean_{variable}.nc
+    - {results_dir}/bias/bias_{variable}.nc
+    - {results_dir}/temporals/{variable}_cor.nc and .csv, with the temporal correlation, bias,
+      RMSE and slope of the monthly climatologies in each cell
+    - {results_dir}/statistics/summary.csv, with regional means, bias and correlations
+    - {results_dir}/statistics/monthly.csv, with regional means, bias, RMSE and correlation of
+      the monthly climatologies
+    - {results_dir}/statistics/sketches_{variable}.npz, with quantile sketches of the monthly
+      climatologies in each region and month
+    - {results_dir}/statistics/histograms_{layer}_{variable}.csv, with 2D histograms of the
+      matched point data
+
+    Parameters
+    ----------
+    matched_dir : str
+        Directory with the matched data
+    results_dir : str
+        Directory the results are written to
+    variables : str or list
+        Variables to process. Default is "all"
+    cores : int
+        Number of variables to process at once
+    incremental : bool
+        Only recompute the results of matched files that have changed since the last run, as
+        recorded in {results_dir}/statistics/manifest.json. Default is False
+
+    Returns
+    -------
+    summary : pandas.DataFrame
+        The regional summary, which is also saved to {results_dir}/statistics/summary.csv
+
+    """
+    if variables != "all":
+        if isinstance(variables, str):
+            variables = [variables]
+
+    paths = sorted(glob.glob(f"{matched_dir}/gridded/**/**/*_surface.nc"))
+    if variables != "all":
+        paths = [x for x in paths if os.path.basename(x).split("_")[1] in variables]
+    point_paths = [x[0] for x in _point_paths(matched_dir, variables)]
+
+    # the results of unchanged matched files are kept in incremental runs
+    previous = None
+    if incremental and os.path.exists(statistics_manifest(results_dir)):
+        with open(statistics_manifest(results_dir), "r") as file:
+            previous = json.load(file)
+    shared = [__file__] + glob.glob(f"{matched_dir}/model_grid.npz")
+    inputs, unchanged = _unchanged_inputs(paths + point_paths, shared, previous)
+    kept = dict()
+    for ff in unchanged:
+        # outputs that are missing, or were rewritten by an interrupted run, are rebuilt
+        if not _unchanged_outputs(ff, results_dir, previous):
+            continue
+        if ff in point_paths:
+            kept[ff] = None
+        else:
+            kept_ff = _previous_statistics(ff, results_dir)
+            if kept_ff is not None:
+                kept[ff] = kept_ff
+
+    write_point_histograms(matched_dir, results_dir, variables, skip=list(kept))
+    stale = [x for x in paths if x not in kept]
+    if len(kept) > 0:
+        print(f"Reusing the statistics of {len(kept)} unchanged matched files")
+
+    if len(paths) == 0:
+        _save_statistics_manifest(results_dir, inputs, shared, point_paths)
+        return None
+    if cores is None:
+        cores = os.cpu_count()
+    cores = max(1, min(cores, len(stale)))
+
+    results = [kept[ff] for ff in paths if ff in kept]
+    if cores > 1:
+        pool = multiprocessing.Pool(cores)
+        jobs = [
+            pool.apply_async(variable_statistics, [ff, results_dir, matched_dir])
+            for ff in stale
+        ]
+        pool.close()
+        for job in tqdm(jobs):
+            results.append(job.get())
+        pool.join()
+    else:
+        for ff in tqdm(stale):
+            results.append(variable_statistics(ff, results_dir, matched_dir))
+
+    summary = pd.concat([x[0] for x in results]).reset_index(drop=True)
+    monthly = pd.concat([x[1] for x in results]).reset_index(drop=True)
+    out_dir = f"{results_dir}/statistics"
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    summary.to_csv(f"{out_dir}/summary.csv", index=False)
+    monthly.to_csv(f"{out_dir}/monthly.csv", index=False)
+    _save_statistics_manifest(results_dir, inputs, shared, paths + point_paths)
+    return summary
+
+
+def statistics_outputs(ff, results_dir="results"):
+    """
+    The results written from a matched gridded surface file or matched point file
+    """
+    if os.path.basename(ff).endswith(".csv"):
+        layer, variable = os.path.normpath(ff).split(os.sep)[-3:-1]
+        return [histograms_path(layer, variable, results_dir)]
+    variable = os.path.basename(ff).split("_")[1]
+    return [
+        f"{results_dir}/annual_mean/annualmean_{variable}.nc",
+        f"{results_dir}/monthly_mean/monthlymean_{variable}.nc",
+        f"{results_dir}/bias/bias_{variable}.nc",
+        f"{results_dir}/temporals/{variable}_cor.nc",
+        f"{results_dir}/temporals/{variable}_cor.csv",
+        f"{results_dir}/statistics/sketches_{variable}.npz",
+        f"{results_dir}/statistics/summary.csv",
+        f"{results_dir}/statistics/monthly.csv",
+    ]
+
+
+def _output_stamp(out):
+    info = os.stat(out)
+    return [info.st_size, info.st_mtime_ns]
+
+
+def _unchanged_outputs(ff, results_dir, previous):
+    """
+    Whether every result of a matched file is as the last complete run left it
+    """
+    stamps = previous.get("outputs", dict()).get(ff)
+    if stamps is None:
+        return False
+    for out in statistics_outputs(ff, results_dir):
+        if not os.path.exists(out) or stamps.get(out) != _output_stamp(out):
+            return False
+    return True
+
+
+def _previous_statistics(ff, results_dir="results"):
+    """
+    The summary and monthly rows of a matched file from the last run, or None if it has none
+    """
+    variable = os.path.basename(ff).split("_")[1]
+    source = os.path.basename(ff).split("_")[0]
+    tables = []
+    for out in statistics_outputs(ff, results_dir)[-2:]:
+        df = pd.read_csv(out).query("variable == @variable and source == @source")
+        if len(df) == 0:
+            return None
+        tables.append(df)
+    return tuple(tables)
+
+
+def _save_statistics_manifest(results_dir, inputs, shared, paths=None):
+    """
+    Record the inputs of this run, and the size and modification time of the results of each
+    matched file
+    """
+    if paths is None:
+        paths = []
+    outputs = dict()
+    for ff in paths:
+        outputs[ff] = {
+            x: _output_stamp(x) for x in statistics_outputs(ff, results_dir) if os.path.exists(x)
+        }
+    out = statistics_manifest(results_dir)
+    if not os.path.exists(os.path.dirname(out)):
+        os.makedirs(os.path.dirname(out))
+    with open(out, "w") as file:
+        json.dump({"shared": shared, "inputs": inputs, "outputs": outputs}, file, indent=1)
@@ -51,13 +51,33 @@ def extract_start(paths):
     return None
 
 
+def path_years(paths, fixed_format=True):
+    """
+    The years in each file, from the file names if they have a fixed format
+    """
+    yy_start = None
+    if fixed_format and len(paths) >= 5:
+        yy_start = extract_start(paths)
+    if yy_start is not None:
+        return {ff: [int(ff[yy_start : yy_start + 4])] for ff in paths}
+    ds_years = dict()
+    for ff in paths:
+        try:
+            ds_years[ff] = file_years(ff)
+        except:
+            print(f"Unable to find relevant years in  {ff}")
+    return ds_years
+
+
 from multiprocessing import Manager
 session_warnings = Manager().list() 
 from tqdm import tqdm
 from ecoval.utils import session
 from ecoval.utils import extension_of_directory
+from ecoval.grid import get_grid_info
 from ecoval.gridded import gridded_matchup
 from ecoval.fixers import tidy_warnings
+from ecoval.annual import annual_trends, drift_regions, drift_table, file_years
 
 nc.options(parallel=True)
 nc.options(progress=False)
@@ -352,6 +372,7 @@ def trends(
     lon_lim = None,
     lat_lim = None, 
     fixed_format = True,
+    drift = False,
     **kwargs,
 ):
     """
@@ -405,10 +426,20 @@ def trends(
     obs_dir: str
         Path to data directory. Default is 'default'. If 'default', the data directory is taken from the session_info dictionary.
     
+    drift: bool
+        Calculate drift diagnostics instead of trends. Default is False. If True, the annual
+        area-weighted means of each variable in the whole domain and each subdomain are saved
+        in trends/drift.csv.
     kwargs: dict
         Additional arguments
 
-
+    Returns
+    -------
+    outputs : list or pandas.DataFrame
+        The files written to trends/. These are the annual means and per-cell linear trends of
+        each variable, e.g. temperature.nc and temperature_trend.nc, with _bottom added for
+        bottom values. See annual.annual_trends. If drift is True, the drift diagnostics are
+        returned instead, see annual.drift_table
 
     """
 
@@ -655,141 +686,73 @@ def trends(
     df_out.to_csv(out, index=False)
 
 
-    vv = "temperature"
-
-    model_variable = all_df.query(f"variable == '{vv}'").model_variable[0]
-    model_pattern = all_df.query(f"variable == '{vv}'").pattern[0]
-    print(model_variable)
-    print(model_pattern)
-
-    df = all_df.query("variable == @vv").reset_index(drop=True)
-    mapping = dict()
-    if len(df) > 0:
-        mapping[vv] = list(df.query("variable == @vv").model_variable)[0]
+    # every mapped variable is read from each file in one pass
+    layers = dict()
+    for vv in set(surface + point_surface):
+        layers.setdefault(vv, []).append("surface")
+    for vv in set(bottom):
+        layers.setdefault(vv, []).append("bottom")
+    df = all_df.dropna().reset_index(drop=True)
+    df = df.loc[[x in layers for x in df.variable]].reset_index(drop=True)
+    if len(df) == 0:
+        raise ValueError("None of the variables chosen are in the mapping")
 
-        selection = []
-        try:
-            selection += mapping[vv].split("+")
-        except:
-            selection = selection
-
-        patterns = set(df.pattern)
-        if len(patterns) > 1:
-            raise ValueError(
-                "Something strange going on in the string patterns. Unable to handle this. Bug fix time!"
-            )
-        pattern = list(patterns)[0]
-
-        final_extension = extension_of_directory(folder)
+    final_extension = extension_of_directory(folder)
+    files = dict()
+    for pattern in set(df.pattern):
         paths = glob.glob(folder + final_extension + pattern)
-
         for exc in exclude:
             paths = [x for x in paths if f"{exc}" not in os.path.basename(x)]
+        if len(paths) == 0:
+            continue
+        df_pattern = df.query("pattern == @pattern")
+        selections = dict(zip(df_pattern.variable, df_pattern.model_variable))
+        for ff, ds_years in path_years(paths, fixed_format=fixed_format).items():
+            files[ff] = {"selections": selections, "years": ds_years}
+    if len(files) == 0:
+        raise ValueError(f"No model output found in {folder}")
+
+    # set up the model grid information if it doesn't exist
+    grid_info = get_grid_info(sorted(files)[0], surface_level=surface_level)
+    amm7 = grid_info.amm7
+    if amm7:
+        amm7_out = "matched/amm7.txt"
+        # create empty file
+        with open(amm7_out, "w") as f:
+            f.write("")
+
+    all_years = sorted(set([x for ff in files for x in files[ff]["years"]]))
+    if spinup is not None:
+        years = [x for x in all_years if x >= min(all_years) + spinup]
+    else:
+        years = [x for x in all_years if sim_start <= x]
+    years = [x for x in years if x <= sim_end]
+    if len(years) == 0:
+        raise ValueError("There are no years to calculate trends for")
+
+    files = {
+        ff: files[ff]["selections"]
+        for ff in sorted(files)
+        if len([x for x in files[ff]["years"] if x in years]) > 0
+    }
+
+    if drift:
+        regions = drift_regions(list(files)[0], matched_dir="matched")
+        return drift_table(
+            files,
+            regions,
+            layers=layers,
+            surface_level=surface_level,
+            years=years,
+            cores=cores,
+            out="trends/drift.csv",
+        )
 
-        new_paths = []
-        ds = nc.open_data(paths, checks=False)
-        # set up model_grid if it doesn't exist
-
-        # This really should be a function....
-        if not os.path.exists("matched/model_grid.csv"):
-            ds_grid = nc.open_data(paths[0], checks=False)
-            var = ds_grid.variables[0]
-            ds_grid.subset(variables=var)
-            if surface_level == "top":
-                ds_grid.top()
-            else:
-                ds_grid.bottom()
-            ds_grid.as_missing(0)
-            # ds = nc.open_data(paths[0], checks=False)
-            amm7 = False
-            if max(ds_grid.contents.npoints) == 111375:
-                amm7_out = "matched/amm7.txt"
-                # create empty file
-                with open(amm7_out, "w") as f:
-                    f.write("")
-
-                obs_dir = "/data/proteus1/scratch/rwi/evaldata/data"
-
-                ff_grid = f"{obs_dir}/amm7_val_subdomains.nc"
-                ds_grid.cdo_command(f"setgrid,{ff_grid}")
-                # ds_grid.fix_amm7_grid()
-                amm7 = True
-            df_grid = ds_grid.to_dataframe().reset_index().dropna()
-            columns = [x for x in df_grid.columns if "lon" in x or "lat" in x]
-            df_grid = df_grid.loc[:, columns].drop_duplicates()
-            if not os.path.exists("matched"):
-                os.makedirs("matched")
-            df_grid.to_csv("matched/model_grid.csv", index=False)
-
-        yy_start = None
-        all_years = []
-        if fixed_format:
-            yy_start = extract_start(paths)
-
-        if yy_start is not None:
-            for ff in tqdm(paths):
-                ds_years = [int(ff[yy_start : yy_start + 4])]
-                all_years += ds_years
-        else:
-            for ff in paths:
-                try:
-                    ds = nc.open_data(ff, checks=False)
-                    ds_years = ds.years
-                    all_years += ds_years
-                except:
-                    print(f"Unable to find relevant years in  {ff}")
-        all_years = list(set(all_years)) 
-
-        if spinup is not None:
-            years = [x for x in all_years if x >= min(all_years) + spinup]
-
-        sim_years = range(sim_start, sim_end + 1)
-        if start is not None:
-            years = [x for x in all_years if x in sim_years]
-
-        yy_start = None
-        if fixed_format:
-            yy_start = extract_start(paths)
-
-        if yy_start is not None:
-            for ff in tqdm(paths):
-                print(ff)
-                ds_years = [int(ff[yy_start : yy_start + 4])]
-                if len([x for x in ds_years if x in years]) > 0:
-                    new_paths.append(ff)
-        else:
-            for ff in paths:
-                print(ff)
-                try:
-                    ds = nc.open_data(ff, checks=False)
-                    ds_years = ds.years
-                    if len([x for x in ds_years if x in years]) > 0:
-                        new_paths.append(ff)
-                except:
-                    print(f"Unable to find relevant years in  {ff}")
-
-        paths = list(set(new_paths))
-        paths.sort()
-
-        ds = nc.open_data(new_paths, checks = False)
-        ds.subset(variable = model_variable)
-        if surface_level == "top":
-            ds.top()
-        else:
-            ds.bottom()
-        ds.as_missing(0)
-        
-        ds.tmean(["year", "month"])
-        ds.merge("time")
-        ds.tmean("year")
-        #ds.rolling_mean(20)
-        out = f"trends/{vv}.nc"
-        # check if directory exists for out
-        if os.path.exists(out):
-            os.remove(out)
-        if not os.path.exists("trends"):
-            os.makedirs("trends")
-        ds.to_nc(out, zip = True)
-
-
-    print(paths)
+    return annual_trends(
+        files,
+        layers=layers,
+        surface_level=surface_level,
+        years=years,
+        cores=cores,
+        out_dir="trends",
+    )
@@ -1,9 +1,9 @@
 import os
+import hashlib
 import nctoolkit as nc
 import warnings
 import xarray as xr
 import numpy as np
-import subprocess
 import pandas as pd
 from tqdm import tqdm
 from ecoval.session import session_info
@@ -25,23 +25,116 @@ def extension_of_directory(starting_directory, exclude=[]):
 
 
 
-def is_latlon(ff):
-    ds = nc.open_data(ff, checks = False)
+# FVCOM vertical coordinates cannot be read by xarray
+fvcom_drop = ["siglay", "siglev"]
+# extents are cached per grid fingerprint, so each grid is only processed once
+_extent_cache = dict()
+# grid descriptors are cached per grid fingerprint
+_descriptor_cache = dict()
+# fingerprints are cached per file, keyed by path, size and modification time
+_fingerprint_cache = dict()
+
+
+def _coordinate_names(ds):
+    """
+    Find the names of the longitude and latitude coordinates in an xarray dataset
+    """
+    names = list(ds.coords) + [x for x in ds.variables if x not in ds.coords]
+    lon_name = [x for x in names if "lon" in x.lower()][0]
+    lat_name = [x for x in names if "lat" in x.lower()][0]
+    return lon_name, lat_name
+
+
+def _file_key(ff):
+    ff = os.path.abspath(ff)
+    ff_stat = os.stat(ff)
+    return (ff, ff_stat.st_size, ff_stat.st_mtime_ns)
+
+
+def grid_fingerprint(ff):
+    """
+    Get a fingerprint identifying the horizontal grid of a netcdf file
 
-    cdo_result = subprocess.run(
-            f"cdo griddes {ff}",
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-    return "lonlat" in cdo_result.stdout.decode("utf-8")
+    Parameters
+    ----------
+    ff : str
+        The path to the netcdf file
+
+    Returns
+    -------
+    fingerprint : str
+        A hash of the longitude and latitude coordinates and their metadata
+
+    """
+    key = _file_key(ff)
+    if key in _fingerprint_cache:
+        return _fingerprint_cache[key]
+
+    with xr.open_dataset(ff, decode_times=False, drop_variables=fvcom_drop) as ds:
+        lon_name, lat_name = _coordinate_names(ds)
+        coords = [ds[lon_name], ds[lat_name]]
+        hasher = hashlib.sha1()
+        for da in coords:
+            values = np.asarray(da.values, dtype="float64")
+            # the dimensions and CF metadata determine how the grid is classified
+            hasher.update(str(da.dims).encode("utf-8"))
+            hasher.update(str(da.attrs.get("units", "")).encode("utf-8"))
+            hasher.update(str(da.attrs.get("standard_name", "")).encode("utf-8"))
+            hasher.update(np.ascontiguousarray(values).tobytes())
+    fingerprint = hasher.hexdigest()
+    _fingerprint_cache[key] = fingerprint
+    return fingerprint
+
+
+def _coordinate_resolution(coords, axis=None):
+    """
+    Get the typical spacing of a coordinate array
+    """
+    if axis is not None and coords.ndim == 2 and coords.shape[axis] > 1:
+        diffs = np.abs(np.diff(coords, axis=axis)).flatten()
+    else:
+        diffs = np.diff(np.unique(coords.flatten()))
+    diffs = diffs[np.isfinite(diffs) & (diffs > 0)]
+    if len(diffs) == 0:
+        return 0.0
+    return float(np.median(diffs))
+
+
+def _wet_mask(ds, lon_name, lat_name):
+    """
+    Find the cells of the top level of the first variable that ever have data
+    """
+    horizontal = set(ds[lon_name].dims).union(ds[lat_name].dims)
+    variables = [
+        x
+        for x in ds.data_vars
+        if x not in [lon_name, lat_name] and horizontal.issubset(ds[x].dims)
+    ]
+    if len(variables) == 0:
+        return None
+    da = ds[variables[0]]
+    # only the top level is needed
+    for dim in da.dims:
+        if dim not in horizontal and "time" not in dim.lower():
+            da = da.isel({dim: 0})
+    wet = da.notnull()
+    time_dims = [x for x in wet.dims if x not in horizontal]
+    if len(time_dims) > 0:
+        wet = wet.any(dim=time_dims)
+    # order the mask as (lat, lon)
+    order = list(ds[lat_name].dims)
+    order += [x for x in ds[lon_name].dims if x not in order]
+    wet = wet.transpose(*order)
+    return wet.values
 
 
 def get_extent(ff):
-    # add docstring
-    """ "
+    """
     Get the extent of a netcdf file
 
+    Only the coordinate arrays and the top level of the first variable are read.
+    The result is cached for each grid.
+
     Parameters
     ----------
     ff : str
@@ -54,164 +147,181 @@ def get_extent(ff):
 
     """
 
-    ds = nc.open_data(ff)
-    ds.subset(variables=ds.variables[0])
-    ds.top()
-    ds.subset(time=0)
-    ds_xr = ds.to_xarray()
-    lon_name = [x for x in ds_xr.coords if "lon" in x][0]
-    lat_name = [x for x in ds_xr.coords if "lat" in x][0]
-    lons = ds_xr[lon_name].values
-    lons = lons.flatten()
-    # as a unique, sorted list
-    lons = list(set(lons))
-    lats = ds_xr[lat_name].values
-    lats = lats.flatten()
-    # as a unique, sorted list
-    lats = list(set(lats))
-    lon_res = np.abs(lons[2] - lons[1])
-    lat_res = np.abs(lats[2] - lats[1])
-    ds = nc.open_data(ff)
-    ds.subset(variables=ds.variables[0])
-    ds.top()
-    ds.tmax()
-    ds.to_latlon(lon=[-180, 180], lat=[-90, 90], res=[lon_res, lat_res])
-    df = ds.to_dataframe().dropna().reset_index()
-    lon_min = df.lon.min()
-    lon_max = df.lon.max()
-    lat_min = df.lat.min()
-    lat_max = df.lat.max()
-    lons = [lon_min, lon_max]
-    lats = [lat_min, lat_max]
+    fingerprint = grid_fingerprint(ff)
+    if fingerprint in _extent_cache:
+        return list(_extent_cache[fingerprint])
+
+    with xr.open_dataset(ff, decode_times=False, drop_variables=fvcom_drop) as ds:
+        lon_name, lat_name = _coordinate_names(ds)
+        lon_dims = ds[lon_name].dims
+        lat_dims = ds[lat_name].dims
+        wet = _wet_mask(ds, lon_name, lat_name)
+        lons = ds[lon_name].values
+        lats = ds[lat_name].values
+
+    # regular lon-lat grids are expanded so that each cell has a lon and lat
+    if len(lon_dims) == 1 and len(lat_dims) == 1 and lon_dims != lat_dims:
+        lon_res = _coordinate_resolution(lons)
+        lat_res = _coordinate_resolution(lats)
+        lons, lats = np.meshgrid(lons, lats)
+    else:
+        lon_res = _coordinate_resolution(lons, axis=-1)
+        lat_res = _coordinate_resolution(lats, axis=0)
+
+    lons = np.asarray(lons, dtype="float64")
+    lats = np.asarray(lats, dtype="float64")
+    # longitudes are reported in the range -180 to 180
+    lons = np.where(lons > 180, lons - 360, lons)
+
+    if wet is not None and wet.shape == lons.shape:
+        lons = lons[wet]
+        lats = lats[wet]
+
+    lons = lons[np.isfinite(lons)]
+    lats = lats[np.isfinite(lats)]
+
     extent = [
-        lons[0] - lon_res,
-        lons[1] + lon_res,
-        lats[0] - lat_res,
-        lats[1] + lat_res,
+        float(lons.min()) - lon_res,
+        float(lons.max()) + lon_res,
+        float(lats.min()) - lat_res,
+        float(lats.max()) + lat_res,
     ]
-    #
-    return extent
+    _extent_cache[fingerprint] = extent
+    return list(extent)
 
 
-def get_resolution(ff):
-    ds = nc.open_data(ff, checks = False)
-    var = ds.variables[0]
-    ds = xr.open_dataset(ff)
-    lon_name = [x for x in list(ds.coords) if 'lon' in x][0]
-    lat_name = [x for x in list(ds.coords) if 'lat' in x][0]
-    var_dims =  ds[var].dims
+def _is_cf_coordinate(da, axis):
+    """
+    Check if a coordinate carries CF longitude or latitude metadata
+    """
+    units = {
+        "lon": ["degrees_east", "degree_east", "degrees_e", "degree_e"],
+        "lat": ["degrees_north", "degree_north", "degrees_n", "degree_n"],
+    }
+    standard_names = {"lon": "longitude", "lat": "latitude"}
+    axes = {"lon": "X", "lat": "Y"}
+    if str(da.attrs.get("units", "")).lower() in units[axis]:
+        return True
+    if str(da.attrs.get("standard_name", "")).lower() == standard_names[axis]:
+        return True
+    return str(da.attrs.get("axis", "")).upper() == axes[axis]
+
+
+def grid_descriptor(ff):
+    """
+    Describe the horizontal grid of a netcdf file
+
+    The grid is classified from the CF attributes and the dimensionality of the coordinates,
+    so no external commands are run. Results are cached for each grid.
+
+    Parameters
+    ----------
+    ff : str
+        The path to the netcdf file
+
+    Returns
+    -------
+    descriptor : dict
+        A dictionary with the grid type ("lonlat", "generic", "curvilinear" or "unstructured"),
+        the resolution ([lon_res, lat_res]), the extent ([lon_min, lon_max, lat_min, lat_max])
+        and the grid fingerprint
+
+    """
+    fingerprint = grid_fingerprint(ff)
+    if fingerprint in _descriptor_cache:
+        return dict(_descriptor_cache[fingerprint])
+
+    with xr.open_dataset(ff, decode_times=False, drop_variables=fvcom_drop) as ds:
+        lon_name, lat_name = _coordinate_names(ds)
+        lon = ds[lon_name]
+        lat = ds[lat_name]
+        lon_dims = lon.dims
+        lat_dims = lat.dims
+        ugrid = "nele" in ds.dims or "node" in ds.dims
+        ugrid = ugrid or len([x for x in ds.variables if ds[x].attrs.get("cf_role", "") == "mesh_topology"]) > 0
+        cf_coords = _is_cf_coordinate(lon, "lon") and _is_cf_coordinate(lat, "lat")
+        lons = lon.values
+        lats = lat.values
+
     extent = get_extent(ff)
-    if lon_name in var_dims:
-        if lat_name in var_dims:
-            n_lon = len(ds[lon_name])
-            n_lat = len(ds[lat_name])
-            lon_max = float(ds[lon_name].max())
-            lon_min = float(ds[lon_name].min())
-            lat_max = float(ds[lat_name].max())
-            lat_min = float(ds[lat_name].min())
-            lon_res = (lon_max - lon_min) / (n_lon - 1)
-            lat_res = (lat_max - lat_min) / (n_lat - 1)
-            return [lon_res, lat_res]
+
+    if len(lon_dims) == 1 and lon_dims == lat_dims:
+        grid_type = "unstructured"
+    elif ugrid and len(lon_dims) == 1:
+        grid_type = "unstructured"
+    elif len(lon_dims) == 1 and len(lat_dims) == 1:
+        # cdo only recognizes regular grids as lonlat if they have CF metadata
+        grid_type = "lonlat" if cf_coords else "generic"
     else:
-        # get the final two var_dims
-        var_dims = var_dims[-2:]
-        # lat should be the second
-        n_lat = len(ds[var_dims[1]])
-        n_lon = len(ds[var_dims[0]])
+        grid_type = "curvilinear"
+
+    if grid_type in ["lonlat", "generic"]:
+        lon_res = (float(np.max(lons)) - float(np.min(lons))) / max(len(lons) - 1, 1)
+        lat_res = (float(np.max(lats)) - float(np.min(lats))) / max(len(lats) - 1, 1)
+    elif grid_type == "curvilinear":
+        n_lat, n_lon = np.shape(lons)[-2:]
         lon_res = (extent[1] - extent[0]) / n_lon
         lat_res = (extent[3] - extent[2]) / n_lat
-        return [lon_res, lat_res]
+    else:
+        # use the spacing of an equivalent regular grid
+        n_points = np.size(lons)
+        spacing = float(np.sqrt((extent[1] - extent[0]) * (extent[3] - extent[2]) / n_points))
+        lon_res = spacing
+        lat_res = spacing
+
+    descriptor = {
+        "grid_type": grid_type,
+        "resolution": [lon_res, lat_res],
+        "extent": extent,
+        "fingerprint": fingerprint,
+    }
+    _descriptor_cache[fingerprint] = descriptor
+    return dict(descriptor)
 
 
+def is_latlon(ff):
+    """
+    Check if a netcdf file is on a regular lon-lat grid
+    """
+    return grid_descriptor(ff)["grid_type"] == "lonlat"
 
 
-def fvcom_regrid(ff, new_grid, vv):
-    # multiple = False
-    # if len(vv) > 1:
-    #     ds_all = nc.open_data()
-    #     multiple = True
-    # vars = vv
-    # del vv
-    # for vv in vars:
-    if True:
-        # print(vv)
-        drop_variables = ["siglay", "siglev"]
-        ds_xr = xr.open_dataset( ff, drop_variables=drop_variables, decode_times=False)
-        ds1 = nc.from_xarray(ds_xr[vv])
-        lon = ds1.to_xarray().lon.values
-        lat = ds1.to_xarray().lat.values
-
-        lon_min = float(lon.min())
-        lon_max = float(lon.max())
-        lat_min = float(lat.min())
-        lat_max = float(lat.max())
-        # handle longitudes over 180 appropriately
-        if lon_min > 180:
-            lon_min = lon_min - 360
-        if lon_max > 180:
-            lon_max = lon_max - 360
-        extent = [lon_min, lon_max, lat_min, lat_max]
-        session_info["extent"] = extent
-
-        ds1.run()
-        ds1.nco_command( "ncks -d siglay,0,0")
-        ds_xr = ds1.to_xarray()
-        try:
-            ds_xr = ds_xr.squeeze("siglay")
-        except:
-            pass
-        ds1 = nc.from_xarray(ds_xr)
-        ds1.subset(variable = vv)
-        #ds1.tmean(align = "left")
-        grid = pd.DataFrame({"lon": lon, "lat": lat})
-        ds1.run()
-        out_grid = nc.generate_grid.generate_grid(grid)
-        nc.session.append_safe(out_grid)
-
-        ds2 = ds1.copy()
-        ds2.run()
-        ds2.cdo_command(f"setgrid,{out_grid}")
-        ds2.regrid(new_grid, method = "nn")
-        ds2.as_missing(0)
-        ds2.run()
-        df_mask = grid.assign(value=1)
-        bin_res = list(get_resolution(ds2[0]))
-        df_mask["lon"] = bin_value(df_mask["lon"], 0.25)
-        df_mask["lat"] = bin_value(df_mask["lat"], 0.25)
-        df_mask = df_mask.groupby(["lon", "lat"]).sum().reset_index()
-        df_mask = df_mask.set_index(["lat", "lon"])
-        ds_mask = nc.from_xarray(df_mask.to_xarray())
-        os.system(f"cdo griddes {ds_mask[0]} > /tmp/mygrid")
-        # open the text file text.txt and replace the string "generic" with "lonlat"
-        with open("/tmp/mygrid", "r") as f:
-            lines = f.readlines()
-
-        # write line by line to /tmp/newgrid
-        with open("/tmp/newgrid", "w") as f:
-            for ll in lines:
-                f.write(ll.replace("generic", "lonlat"))
-
-        ds_mask.cdo_command(f"setgrid,/tmp/newgrid")
-        # ds_mask.to_nc("/tmp/mask.nc")
-        ds_mask.regrid(ds2)
-        # ds_mask.to_nc("/tmp/mask1.nc")
-        ds_mask > 0
-        # ds_mask.to_nc("/tmp/mask2.nc")
-        os.remove("/tmp/mygrid")
-        os.remove("/tmp/newgrid")
-        ds_mask.as_missing(0)
-        ds_mask.set_fill(-9999)
-        ds2 * ds_mask
-
-        # if multiple is False:
-        return ds2
-    #     else:
-    #         ds_all.append(ds2)
-    # ds_all.merge("variables")
-    # ds_all.run()
-    # return ds_all
+def get_resolution(ff):
+    """
+    Get the horizontal resolution of a netcdf file
 
+    Parameters
+    ----------
+    ff : str
+        The path to the netcdf file
+
+    Returns
+    -------
+    resolution : list
+        A list of the form [lon_res, lat_res]
 
+    """
+    return list(grid_descriptor(ff)["resolution"])
 
 
+def fvcom_regrid(ff, new_grid, vv):
+    """
+    Regrid the surface layer of an FVCOM file to the grid of another file
+
+    Parameters
+    ----------
+    ff : str
+        An FVCOM output file
+    new_grid : str
+        A netCDF file on the target grid
+    vv : list or str
+        Variables to regrid
+
+    Returns
+    -------
+    ds : nctoolkit.DataSet
+
+    """
+    from ecoval.fvcom import fvcom_regrid_files
 
+    return fvcom_regrid_files([ff], new_grid, vv)
@@ -0,0 +1,33 @@
+"""
+Timings of the robust scale estimators for increasing sample sizes
+
+Run with python tests/benchmark_robust_statistics.py. The explicit versions are
+O(n^2) and are only timed for small samples.
+"""
+
+import time
+import numpy as np
+from ecoval.robust_statistics import Sn, SnExplicit, Qn, QnExplicit, MID
+
+
+def timing(fun, x, repeats=3):
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        fun(x)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    print(f"{'n':>9} {'Sn':>9} {'Qn':>9} {'MID':>9} {'SnExplicit':>11} {'QnExplicit':>11}")
+    for n in [1000, 3000, 10000, 100000, 1000000, 3000000]:
+        x = rng.normal(size=n)
+        repeats = 3 if n <= 100000 else 1
+        row = [timing(fun, x, repeats) for fun in [Sn, Qn, MID]]
+        if n <= 3000:
+            row += [timing(fun, x, 1) for fun in [SnExplicit, QnExplicit]]
+        print(f"{n:>9}" + "".join(f" {x:>9.4f}" for x in row[:3]) + "".join(f" {x:>11.4f}" for x in row[3:]))
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+from ecoval.annual import annual_trends, drift_regions, drift_table, file_annual_sums
+
+
+def write_output(ff, year, rng):
+    times = pd.date_range(f"{year}-01-01", periods=12, freq="MS") + pd.Timedelta("14D")
+    depth = np.array([0.5, 10, 50])
+    temperature = 10 + 0.1 * (year - 2000) + rng.normal(0, 0.01, (12, 3, 4, 5))
+    # land, and a column that is only two levels deep
+    temperature[:, :, 0, 0] = 0
+    temperature[:, 2, 1, 1] = 0
+    ds = xr.Dataset(
+        {
+            "votemper": (["time_counter", "deptht", "lat", "lon"], temperature),
+            "P1_c": (["time_counter", "deptht", "lat", "lon"], np.ones((12, 3, 4, 5))),
+            "P2_c": (["time_counter", "deptht", "lat", "lon"], np.ones((12, 3, 4, 5))),
+        },
+        coords={
+            "time_counter": times,
+            "deptht": depth,
+            "lat": np.arange(50, 54.0),
+            "lon": np.arange(-5, 0.0),
+        },
+    )
+    ds.votemper.attrs["units"] = "degC"
+    ds.to_netcdf(ff)
+
+
+class TestFinal:
+    def test_annual_trends(self, tmp_path):
+        rng = np.random.default_rng(0)
+        files = dict()
+        selections = {"temperature": "votemper", "phyto": "P1_c+P2_c"}
+        for year in range(2000, 2010):
+            ff = str(tmp_path / f"amm7_1m_{year}0101_{year}1231_grid_T.nc")
+            write_output(ff, year, rng)
+            files[ff] = selections
+
+        layers = {"temperature": ["surface", "bottom"]}
+        sums = file_annual_sums(list(files)[0], selections, layers)
+        surface_sum, surface_n = sums[("temperature", "surface")][2000]
+        assert surface_n[0, 0] == 0 and surface_n[1, 1] == 12
+        bottom_sum, bottom_n = sums[("temperature", "bottom")][2000]
+        assert bottom_n[1, 1] == 12 and bottom_n[0, 0] == 0
+        assert np.isclose(sums[("phyto", "surface")][2000][0][2, 2], 24)
+
+        out = str(tmp_path / "trends")
+        outputs = annual_trends(
+            files, layers=layers, years=list(range(2002, 2010)), cores=2, out_dir=out
+        )
+        assert f"{out}/temperature_bottom_trend.nc" in outputs
+        ds = xr.open_dataset(f"{out}/temperature.nc")
+        assert list(ds.year.values) == list(range(2002, 2010))
+        assert np.isclose(float(ds.temperature[0, 2, 2]), 10.2, atol=0.01)
+        ds_trend = xr.open_dataset(f"{out}/temperature_trend.nc")
+        assert np.isclose(float(ds_trend.slope[2, 2]), 0.1, atol=0.01)
+        assert float(ds_trend.p_value[2, 2]) < 0.001
+        assert np.isnan(float(ds_trend.slope[0, 0]))
+
+    def test_drift_table(self, tmp_path):
+        rng = np.random.default_rng(0)
+        files = dict()
+        selections = {"temperature": "votemper"}
+        for year in range(2000, 2004):
+            ff = str(tmp_path / f"amm7_1m_{year}0101_{year}1231_grid_T.nc")
+            write_output(ff, year, rng)
+            files[ff] = selections
+
+        regions = drift_regions(list(files)[0], matched_dir=str(tmp_path))
+        labels, membership, names, weights = regions
+        assert "all" in names and labels.size == 20
+        layers = {"temperature": ["surface", "bottom"]}
+        out = str(tmp_path / "trends/drift.csv")
+        drift = drift_table(files, regions, layers=layers, cores=2, out=out)
+        assert len(pd.read_csv(out)) == len(drift) == 2 * 4 * len(names)
+
+        domain = drift.query("region == 'all' and layer == 'surface'")
+        assert list(domain.year) == [2000, 2001, 2002, 2003]
+        assert np.allclose(domain["mean"], 10 + 0.1 * np.arange(4), atol=0.01)
+        assert np.allclose(domain["anomaly"], 0.1 * np.arange(4), atol=0.01)
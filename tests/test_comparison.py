@@ -0,0 +1,53 @@
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+from ecoval.comparison import compare_results, nn_index
+
+
+def results_file(path, lons, lats, offset, variable="cor"):
+    rng = np.random.default_rng(0)
+    lon_grid, lat_grid = np.meshgrid(lons, lats)
+    observation = np.sin(lon_grid) + np.cos(lat_grid)
+    model = observation + offset + 0.1 * rng.random(observation.shape)
+    model[0, 0] = np.nan
+    ds = xr.Dataset(
+        {
+            "model": (("lat", "lon"), model, {"units": "degC"}),
+            "observation": (("lat", "lon"), observation),
+            variable: (("lat", "lon"), np.full(model.shape, 0.5 + offset / 4)),
+        },
+        coords={"lat": lats, "lon": lons},
+    )
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    ds.to_netcdf(path)
+
+
+class TestFinal:
+    def test_compare_results(self, tmp_path):
+        lons = np.arange(-10, 0, 0.5)
+        lats = np.arange(50, 55, 0.5)
+        fine_lons = np.arange(-10, 0, 0.25)
+        fine_lats = np.arange(50, 55, 0.25)
+        model_dict = {"a": str(tmp_path / "a"), "b": str(tmp_path / "b")}
+        results_file(f"{model_dict['a']}/results/annual_mean/annualmean_temperature.nc", lons, lats, 0)
+        results_file(f"{model_dict['b']}/results/annual_mean/annualmean_temperature.nc", fine_lons, fine_lats, 1)
+        results_file(f"{model_dict['a']}/results/temporals/temperature_cor.nc", lons, lats, 0)
+        results_file(f"{model_dict['b']}/results/temporals/temperature_cor.nc", fine_lons, fine_lats, 1)
+
+        index = nn_index(fine_lons, fine_lats, lons, lats)
+        assert index.shape == (10, 20)
+        assert index[2, 3] == 4 * 40 + 6
+        assert nn_index(fine_lons, fine_lats, np.array([30.0]), np.array([0.0]))[0, 0] == -1
+
+        out = str(tmp_path / "compare/comparison.csv")
+        df = compare_results(model_dict, out=out, cores=1)
+        assert os.path.exists(out)
+        assert list(df.model) == ["a", "b"]
+        assert df.n.values[0] == 10 * 20 - 1
+        assert np.isclose(df.bias.values[1] - df.bias.values[0], 1, atol=0.02)
+        assert df.spatial_cor.values[0] > 0.9
+        assert np.allclose(df.temporal_cor.values, [0.5, 0.75])
+        assert df.unit.values[0] == "degC"
+        assert list(pd.read_csv(out).columns) == list(df.columns)
@@ -0,0 +1,93 @@
+import shutil
+import pytest
+import numpy as np
+import xarray as xr
+import nctoolkit as nc
+from ecoval.depths import layer_depths, water_depth, depth_fields, is_vvl, timestep_depths
+
+
+def thickness(n_times=3):
+    rng = np.random.default_rng(0)
+    e3t = rng.uniform(1, 10, (n_times, 4, 3, 5))
+    # the free surface moves the thickness of each layer through time
+    e3t = e3t[:1] * (1 + 0.05 * np.arange(n_times)).reshape((-1, 1, 1, 1))
+    e3t[:, 3, 0, :] = 0
+    e3t[:, :, 2, 4] = 0
+    return e3t
+
+
+def vvl_file(path, variables):
+    e3t = thickness()
+    coords = {
+        "time_counter": np.arange(3.0),
+        "deptht": np.arange(4.0),
+        "lat": np.arange(50, 53.0),
+        "lon": np.arange(-5, 0.0),
+    }
+    dims = ("time_counter", "deptht", "lat", "lon")
+    data = {x: (dims, e3t if x == "e3t" else e3t + 10) for x in variables}
+    xr.Dataset(data, coords=coords).to_netcdf(path)
+    return e3t
+
+
+def cdo_depths(ff, time, surface_level="top"):
+    # the cdo chain matchup used before the depths were computed in numpy
+    ds_thickness = nc.open_data(ff, checks=False)
+    ds_thickness.subset(time=time, variables="e3t")
+    ds_thickness.as_missing(0)
+    if surface_level == "bottom":
+        ds_thickness.cdo_command("invertlev")
+    ds_thickness.run()
+    ds_depths = ds_thickness.copy()
+    ds_depths.vertical_cumsum()
+    ds_thickness / 2
+    ds_depths - ds_thickness
+    if surface_level == "bottom":
+        ds_depths.cdo_command("invertlev")
+    ds_depths.run()
+    return ds_depths.to_xarray()["e3t"].values[0]
+
+
+class TestFinal:
+    def test_layer_depths(self):
+        e3t = np.array([1.0, 2, 4, 0]).reshape((4, 1, 1))
+        assert np.allclose(layer_depths(e3t)[:3, 0, 0], [0.5, 2, 5])
+        assert np.isnan(layer_depths(e3t)[3, 0, 0])
+        e3t = np.array([0, 4, 2, 1.0]).reshape((4, 1, 1))
+        depths = layer_depths(e3t, surface_level="bottom")[:, 0, 0]
+        assert np.allclose(depths[1:], [5, 2, 0.5]) and np.isnan(depths[0])
+        assert water_depth(e3t)[0, 0] == 7
+
+    @pytest.mark.skipif(shutil.which("cdo") is None, reason="cdo is not installed")
+    def test_cdo(self, tmp_path):
+        ff = str(tmp_path / "vvl.nc")
+        vvl_file(ff, ["e3t", "votemper"])
+        for surface_level in ["top", "bottom"]:
+            for tt in range(3):
+                depths = timestep_depths(ff, tt, surface_level=surface_level).to_xarray()
+                assert np.allclose(
+                    depths.depth.values, cdo_depths(ff, tt, surface_level), equal_nan=True
+                )
+
+    def test_vvl(self, tmp_path):
+        ff = str(tmp_path / "vvl.nc")
+        e3t = vvl_file(ff, ["e3t", "votemper"])
+        assert is_vvl(ff)
+        for tt in range(3):
+            depths = timestep_depths(ff, tt).to_xarray().depth.values
+            assert np.allclose(depths, layer_depths(e3t[tt]), equal_nan=True, rtol=1e-6)
+        assert not np.allclose(layer_depths(e3t[0]), layer_depths(e3t[2]), equal_nan=True)
+        depths, bathymetry = depth_fields(ff)
+        assert np.allclose(depths.values, layer_depths(e3t[0]), equal_nan=True, rtol=1e-6)
+        assert np.allclose(bathymetry.values, water_depth(e3t[0]), equal_nan=True, rtol=1e-6)
+
+        # e3t in a separate file only gives fixed depths, from its first time step
+        ff_model = str(tmp_path / "model.nc")
+        ff_thickness = str(tmp_path / "thickness.nc")
+        vvl_file(ff_model, ["votemper"])
+        vvl_file(ff_thickness, ["e3t"])
+        assert not is_vvl(ff_model)
+        assert is_vvl(ff_thickness, "e3t")
+        depths, bathymetry = depth_fields(ff_thickness, variable="e3t")
+        assert depths.dims == ("deptht", "lat", "lon")
+        assert np.allclose(depths.values, layer_depths(e3t[0]), equal_nan=True, rtol=1e-6)
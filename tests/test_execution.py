@@ -0,0 +1,69 @@
+import os
+import sys
+import threading
+import nbformat
+import ecoval
+from ecoval.execution import execute_notebooks, execute_notebook, _cache_notebooks
+
+
+def write_notebook(path, source):
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [nbformat.v4.new_code_cell(source)]
+    nbformat.write(nb, path)
+
+
+def book(tmp_path):
+    book_dir = tmp_path / "book"
+    os.makedirs(book_dir / "notebooks")
+    with open(book_dir / "_config.yml", "w") as file:
+        file.write("execute:\n  execute_notebooks: force\n")
+    return str(book_dir)
+
+
+class TestFinal:
+    def test_warm_caches(self, tmp_path, monkeypatch):
+        # the kernel imports this copy of ecoval
+        monkeypatch.setenv("PYTHONPATH", os.path.dirname(os.path.dirname(ecoval.__file__)))
+        book_dir = book(tmp_path)
+        write_notebook(
+            f"{book_dir}/notebooks/a.ipynb",
+            "import ecoval.masks\nimport ecoval.statistics\n"
+            "ecoval.masks.subdomains()\n"
+            "ecoval.statistics._labels['run'] = None",
+        )
+        # the second notebook reuses the masks on the same kernel, but not the run state
+        write_notebook(
+            f"{book_dir}/notebooks/b.ipynb",
+            "import ecoval.masks\nimport ecoval.statistics\n"
+            "assert len(ecoval.masks._subdomains) == 1\n"
+            "ecoval.registry._read_masks = None\n"
+            "ecoval.masks.subdomains()\n"
+            "assert len(ecoval.statistics._labels) == 0",
+        )
+        timings = execute_notebooks(book_dir, cores=1, cell_timeout=120)
+        assert list(timings.status) == ["ok", "ok"]
+
+    def test_timeout(self, tmp_path):
+        book_dir = book(tmp_path)
+        ff = f"{book_dir}/notebooks/slow.ipynb"
+        write_notebook(ff, "import time\ntime.sleep(60)")
+        timings = []
+        # the time limit does not rely on signals, so notebooks can run outside the main thread
+        thread = threading.Thread(target=lambda: timings.append(execute_notebook(ff, timeout=3)))
+        thread.start()
+        thread.join(50)
+        assert timings[0]["status"] == "timeout"
+        assert timings[0]["seconds"] < 40
+
+    def test_cache_fallback(self, tmp_path, monkeypatch):
+        book_dir = book(tmp_path)
+        with open(f"{book_dir}/_config.yml", "a") as file:
+            file.write("  cache: old_cache\n")
+        write_notebook(f"{book_dir}/notebooks/a.ipynb", "1 + 1")
+        # without jupyter-cache, the book is built from the outputs stored in the notebooks
+        monkeypatch.setitem(sys.modules, "jupyter_cache", None)
+        assert _cache_notebooks(book_dir, [f"{book_dir}/notebooks/a.ipynb"]) == "off"
+        with open(f"{book_dir}/_config.yml") as file:
+            config = file.read()
+        assert 'execute_notebooks: "off"' in config
+        assert "cache:" not in config
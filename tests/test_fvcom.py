@@ -0,0 +1,54 @@
+import numpy as np
+import xarray as xr
+from ecoval.fvcom import fvcom_remap, fvcom_weights
+
+
+def fvcom_file(path):
+    # a mesh with nodes in the south west corner of the target grid only
+    node_lon, node_lat = np.meshgrid(np.linspace(-4, -3, 11), np.linspace(50, 51, 11))
+    node_lon = node_lon.ravel()
+    node_lat = node_lat.ravel()
+    temp = np.stack([node_lon + 10 * node_lat, node_lon + 10 * node_lat + 1])
+    temp = np.repeat(temp[:, np.newaxis], 3, axis=1)
+    ds = xr.Dataset(
+        {
+            "temp": (["time", "siglay", "node"], temp),
+            "lon": (["node"], node_lon),
+            "lat": (["node"], node_lat),
+            "siglay": (["siglay", "node"], np.tile([[-0.1], [-0.5], [-0.9]], len(node_lon))),
+        },
+        coords={"time": [0.0, 1.0]},
+    )
+    ds.to_netcdf(path)
+    return node_lon, node_lat
+
+
+def target_file(path):
+    ds = xr.Dataset(
+        {"mask": (["lat", "lon"], np.ones((11, 11)))},
+        coords={"lon": np.arange(-4, 1.5, 0.5), "lat": np.arange(50, 55.5, 0.5)},
+    )
+    ds.to_netcdf(path)
+
+
+class TestFinal:
+    def test_fvcom_remap(self, tmp_path):
+        ff = str(tmp_path / "fvcom.nc")
+        target = str(tmp_path / "target.nc")
+        node_lon, node_lat = fvcom_file(ff)
+        target_file(target)
+
+        weights = fvcom_weights(ff, target)
+        assert weights["index"].shape == (11, 11)
+        assert np.allclose(weights["extent"], [-4, -3, 50, 51])
+        # the nearest node of each covered cell is at the cell centre
+        assert node_lon[weights["index"][2, 1]] == -3.5
+        assert np.isclose(node_lat[weights["index"][2, 1]], 51)
+        assert weights["coverage"][:3, :3].all()
+        assert not weights["coverage"][5:, :].any() and not weights["coverage"][:, 5:].any()
+
+        ds = fvcom_remap(ff, target, "temp")
+        assert ds.temp.dims == ("time", "lat", "lon")
+        assert np.isclose(float(ds.temp[0, 2, 1]), -3.5 + 510)
+        assert np.isclose(float(ds.temp[1, 2, 1]), -3.5 + 511)
+        assert np.isnan(float(ds.temp[0, 10, 10]))
@@ -0,0 +1,65 @@
+import numpy as np
+import xarray as xr
+from ecoval.grid import GridInfo, get_grid_info, is_global_grid, covers_globe
+
+
+def model_file(path, shift=0):
+    rng = np.random.default_rng(0)
+    temperature = rng.random((2, 3, 4, 5)) + 1
+    temperature[:, 2, 0, 0] = np.nan
+    temperature[:, :, 3, 4] = 0
+    ds = xr.Dataset(
+        {"temperature": (("time", "depth", "lat", "lon"), temperature)},
+        coords={
+            "time": np.arange(2.0),
+            "depth": [5.0, 10.0, 20.0],
+            "lat": np.arange(50, 54.0),
+            "lon": np.arange(-5, 0.0) + shift,
+        },
+    )
+    ds.to_netcdf(path)
+    return ds
+
+
+class TestFinal:
+    def test_save_load(self, tmp_path):
+        ff = str(tmp_path / "model.nc")
+        model_file(ff)
+        path = str(tmp_path / "matched" / "model_grid.npz")
+        grid_info = get_grid_info(ff, path=path)
+        assert grid_info.shape == (4, 5)
+        assert grid_info.wet.sum() == 19
+        assert grid_info.bottom_index[0, 0] == 1 and grid_info.bottom_index[1, 1] == 2
+        assert grid_info.bottom_index[3, 4] == -1
+        assert grid_info.domain == "nws"
+
+        loaded = GridInfo.load(path)
+        assert loaded is not grid_info
+        for key in ["lon", "lat", "wet", "bottom_index", "area"]:
+            assert np.array_equal(getattr(loaded, key), getattr(grid_info, key))
+        for key in ["grid_type", "extent", "resolution", "known_grid", "fingerprint"]:
+            assert getattr(loaded, key) == getattr(grid_info, key)
+        assert get_grid_info(path=path).fingerprint == grid_info.fingerprint
+
+        # a different model in the same folder replaces the saved grid
+        other = str(tmp_path / "other.nc")
+        model_file(other, shift=100)
+        rebuilt = get_grid_info(other, path=path)
+        assert rebuilt.fingerprint != grid_info.fingerprint
+        assert rebuilt.lon[0] == 95
+        assert GridInfo.load(path).fingerprint == rebuilt.fingerprint
+        assert rebuilt.domain == "global"
+
+    def test_global(self):
+        assert not is_global_grid([-19, 9, 41, 64.3])
+        assert is_global_grid([-180, 180, -80, 90])
+        assert is_global_grid([-10, 10, -88, 88])
+        # grids east of 50E are not on the shelf
+        assert is_global_grid([40, 60, 0, 10])
+
+        lons = np.linspace(-179.5, 179.5, 360)
+        lats = np.linspace(-89.5, 89.5, 180)
+        assert covers_globe(lons, lats)
+        assert not covers_globe(lons, lats[lats > 0])
+        assert not covers_globe(lons[lons > 0], lats)
+        assert not covers_globe(np.arange(-19, 9.0), np.arange(41, 64.0))
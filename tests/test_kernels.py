@@ -0,0 +1,49 @@
+import numpy as np
+from ecoval.kernels import linear_trends, spatial_tiles, temporal_metrics
+
+
+class TestFinal:
+    def test_temporal_metrics(self):
+        rng = np.random.default_rng(0)
+        observation = rng.random((12, 5, 7))
+        model = 2 * observation + 1 + rng.normal(0, 0.1, observation.shape)
+        model[:10, 0, 0] = np.nan
+        observation[3, 1, 1] = np.nan
+
+        metrics = temporal_metrics(model, observation)
+        tiled = temporal_metrics(model, observation, tile_size=4)
+        assert len(spatial_tiles((5, 7), 12, 4)) == 9
+        for key in metrics:
+            assert np.allclose(metrics[key], tiled[key], equal_nan=True)
+
+        assert np.isnan(metrics["cor"][0, 0]) and np.isnan(metrics["slope"][0, 0])
+        assert np.isfinite(metrics["bias"][0, 0])
+        valid = np.isfinite(observation[:, 1, 1])
+        x = model[valid, 1, 1]
+        y = observation[valid, 1, 1]
+        assert np.isclose(metrics["cor"][1, 1], np.corrcoef(x, y)[0, 1])
+        assert np.isclose(metrics["slope"][1, 1], np.polyfit(y, x, 1)[0])
+        assert np.isclose(metrics["bias"][1, 1], np.mean(x - y))
+        assert np.isclose(metrics["rmse"][1, 1], np.sqrt(np.mean((x - y) ** 2)))
+
+    def test_linear_trends(self):
+        from scipy.stats import linregress
+
+        rng = np.random.default_rng(1)
+        years = np.arange(1990, 2010)
+        values = 0.05 * (years - 1990)[:, None, None] + rng.normal(0, 0.2, (20, 3, 4))
+        values[:18, 0, 0] = np.nan
+        values[5, 1, 1] = np.nan
+
+        trends = linear_trends(years, values)
+        tiled = linear_trends(years, values, tile_size=5)
+        for key in trends:
+            assert np.allclose(trends[key], tiled[key], equal_nan=True)
+
+        assert np.isnan(trends["slope"][0, 0]) and trends["n"][0, 0] == 2
+        valid = np.isfinite(values[:, 1, 1])
+        fit = linregress(years[valid], values[valid, 1, 1])
+        assert np.isclose(trends["slope"][1, 1], fit.slope)
+        assert np.isclose(trends["intercept"][1, 1], fit.intercept)
+        assert np.isclose(trends["p_value"][1, 1], fit.pvalue)
+        assert np.isclose(trends["r_squared"][1, 1], fit.rvalue**2)
@@ -0,0 +1,93 @@
+import os
+import json
+from ecoval.manifest import file_hash, build_manifest, reusable_notebooks
+from ecoval.manifest import stash_notebooks, restore_notebooks
+
+
+def write(path, contents):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as file:
+        file.write(contents)
+
+
+def write_notebook(path, source):
+    nb = {"cells": [{"cell_type": "code", "source": [source], "outputs": []}]}
+    write(path, json.dumps(nb))
+
+
+notebooks = [
+    "000_info.ipynb",
+    "001_nsbc_nitrate.ipynb",
+    "002_nsbc_temperature.ipynb",
+    "003_ices_surface_nitrate.ipynb",
+    "004_summary.ipynb",
+]
+
+
+def book(tmp_path):
+    write("matched/mapping.csv", "variable,model_variable\n")
+    write("matched/gridded/nws/nitrate/nsbc_nitrate_surface.nc", "nitrate")
+    write("matched/gridded/nws/temperature/nsbc_temperature_surface.nc", "temperature")
+    write("matched/point/nws/surface/nitrate/ices_surface_nitrate.csv", "lon,lat\n")
+    for x in notebooks:
+        write_notebook(f"book/notebooks/{x}", x)
+    return "book"
+
+
+class TestFinal:
+    def test_file_hash(self, tmp_path):
+        ff = str(tmp_path / "x.csv")
+        write(ff, "a,b\n")
+        record = file_hash(ff)
+        assert file_hash(ff, {ff: record}) == record
+        # hashes are only reused while the size and modification time are unchanged
+        assert file_hash(ff, {ff: record[:2] + ["old"]}) == record[:2] + ["old"]
+        os.utime(ff, ns=(record[1] + 10**9, record[1] + 10**9))
+        touched = file_hash(ff, {ff: record[:2] + ["old"]})
+        assert touched[1] != record[1] and touched[2] == record[2]
+        write(ff, "a,c\n")
+        assert file_hash(ff, {ff: record})[2] != record[2]
+
+    def test_reusable(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        book_dir = book(tmp_path)
+        previous = build_manifest(book_dir)
+        assert "matched/gridded/nws/nitrate/nsbc_nitrate_surface.nc" in previous[notebooks[1]]["inputs"]
+        assert "matched/mapping.csv" in previous[notebooks[3]]["inputs"]
+        assert reusable_notebooks(previous, None, None) == []
+
+        def rebuild():
+            stash = stash_notebooks(book_dir)
+            for x in notebooks:
+                write_notebook(f"{book_dir}/notebooks/{x}", x)
+            manifest = build_manifest(book_dir, previous)
+            return manifest, stash
+
+        manifest, stash = rebuild()
+        assert sorted(reusable_notebooks(manifest, previous, stash)) == notebooks
+        restore_notebooks(book_dir, [], stash)
+
+        # changing the matched data of one notebook invalidates it, and the summary and info
+        write("matched/gridded/nws/nitrate/nsbc_nitrate_surface.nc", "new nitrate")
+        manifest, stash = rebuild()
+        reuse = reusable_notebooks(manifest, previous, stash)
+        assert sorted(reuse) == ["002_nsbc_temperature.ipynb", "003_ices_surface_nitrate.ipynb"]
+        restore_notebooks(book_dir, reuse, stash)
+        assert not os.path.exists(stash)
+
+        # inputs shared by every notebook invalidate all of them
+        write("matched/gridded/nws/nitrate/nsbc_nitrate_surface.nc", "nitrate")
+        write("matched/mapping.csv", "variable,model_variable\nnitrate,N3_n\n")
+        manifest, stash = rebuild()
+        assert reusable_notebooks(manifest, previous, stash) == []
+        restore_notebooks(book_dir, [], stash)
+
+        # so do changes to a notebook's own cells, and missing executed versions
+        write("matched/mapping.csv", "variable,model_variable\n")
+        manifest, stash = rebuild()
+        manifest[notebooks[2]]["source"] = "changed"
+        os.remove(os.path.join(stash, notebooks[3]))
+        reuse = reusable_notebooks(manifest, previous, stash)
+        assert reuse == ["001_nsbc_nitrate.ipynb"]
+        restore_notebooks(book_dir, reuse, stash)
@@ -0,0 +1,31 @@
+import numpy as np
+import xarray as xr
+from ecoval.maps import base_layer, block_mean, coarsen, pyramid
+
+
+class TestFinal:
+    def test_pyramid(self):
+        values = np.arange(30.0).reshape(5, 6)
+        values[0, 0] = np.nan
+        means = block_mean(values, 2)
+        assert means.shape == (3, 3)
+        assert means[0, 0] == np.mean([1, 6, 7])
+        assert means[2, 2] == np.mean([28, 29])
+        assert np.allclose(block_mean(np.arange(5.0), 2), [0.5, 2.5, 4])
+
+        da = xr.DataArray(
+            np.random.default_rng(0).random((300, 500)),
+            dims=["lat", "lon"],
+            coords={"lat": np.linspace(40, 65, 300), "lon": np.linspace(-20, 13, 500)},
+        )
+        levels = pyramid(da)
+        assert [x.shape for x in levels] == [(300, 500), (150, 250), (75, 125), (38, 63)]
+        assert base_layer(levels, 200).shape == (75, 125)
+        assert base_layer(levels, 1000) is da
+        assert base_layer(levels, 10).shape == (38, 63)
+        assert len(pyramid(da, pixels=1000)) == 1
+        assert base_layer(pyramid(da, pixels=200), 200).shape == (75, 125)
+        assert len(pyramid(da, pixels=200)) == 3
+        small = coarsen(da, 4)
+        assert np.isclose(small.lon.values[0], da.lon.values[:4].mean())
+        assert np.isclose(float(small.mean()), float(da.mean()), rtol=0.01)
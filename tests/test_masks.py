@@ -0,0 +1,28 @@
+import numpy as np
+import xarray as xr
+from ecoval.masks import subdomains, region_mask, mask_xarray
+
+
+class TestFinal:
+    def test_masks(self):
+        masks, lons, lats = subdomains()
+        shelf = region_mask("Shelf", lons=lons, lats=lats)
+        assert shelf is region_mask(["Shelf"], lons=lons, lats=lats)
+        assert np.array_equal(shelf, masks["Shelf"])
+        both = region_mask(["Shelf", "Ocean"], shape=shelf.shape)
+        assert np.array_equal(both, masks["Shelf"] | masks["Ocean"])
+
+        ds = xr.Dataset(
+            {"model": (("time", "lat", "lon"), np.ones((2,) + shelf.shape))},
+            coords={"lat": lats, "lon": lons},
+        )
+        masked = mask_xarray(ds, "Shelf")
+        assert np.array_equal(np.isfinite(masked.model.values[1]), shelf)
+        assert np.isfinite(ds.model.values).all()
+
+        # other grids are only masked if asked to
+        assert region_mask("Shelf", lons=lons[::2], lats=lats[::2]) is None
+        coarse = region_mask("Shelf", lons=lons[::2], lats=lats[::2], regrid=True)
+        assert np.array_equal(coarse, shelf[::2, ::2])
+        outside = region_mask("Shelf", lons=lons[::2] - 100, lats=lats[::2], regrid=True)
+        assert not outside.any()
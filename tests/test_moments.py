@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+from ecoval.moments import QuantileSketch, write_point_moments, load_moments, aggregate, sketch_quantiles
+from ecoval.moments import write_gridded_moments
+
+
+def calendar_file(path, calendar):
+    rng = np.random.default_rng(2)
+    times = xr.date_range("2000-01-01", periods=24, freq="MS", calendar=calendar, use_cftime=True)
+    model = rng.random((24, 3, 4)) + 1
+    ds = xr.Dataset(
+        {
+            "model": (("time", "lat", "lon"), model),
+            "observation": (("time", "lat", "lon"), model + 0.5),
+        },
+        coords={"time": times, "lat": np.arange(50, 53.0), "lon": np.arange(-4, 0.0)},
+    )
+    ds.to_netcdf(path)
+    return ds
+
+
+class TestFinal:
+    def test_sketch(self):
+        rng = np.random.default_rng(0)
+        x = rng.normal(0, 5, 10000)
+        y = rng.lognormal(1, 1, 5000)
+        sketch = QuantileSketch(0.01).add(x[:4000]).merge(QuantileSketch(0.01).add(x[4000:]))
+        assert sketch.count == len(x)
+        merged = sketch.merge(QuantileSketch(0.01).add(y))
+        both = np.concatenate([x, y])
+        for q in [0.05, 0.25, 0.5, 0.75, 0.95]:
+            exact = np.quantile(both, q, method="lower")
+            assert abs(merged.quantile(q) - exact) <= 0.011 * abs(exact) + 0.01
+        packed = QuantileSketch.pack([sketch, merged], "x")
+        sketches = QuantileSketch.unpack(packed, "x")
+        assert sketches[1].quantile(0.5) == merged.quantile(0.5)
+        assert np.isnan(QuantileSketch().quantile(0.5))
+
+    def test_points(self, tmp_path):
+        rng = np.random.default_rng(1)
+        n = 2000
+        df = pd.DataFrame(
+            {
+                "lon": rng.integers(0, 5, n) * 1.0,
+                "lat": rng.integers(50, 55, n) * 1.0,
+                "year": 2000 + rng.integers(0, 3, n),
+                "month": rng.integers(1, 13, n),
+            }
+        )
+        df["observation"] = rng.normal(10, 3, n)
+        df["model"] = df.observation + rng.normal(1, 1, n)
+        out = write_point_moments(df, str(tmp_path / "moments.npz"))
+        store = load_moments(out)
+
+        metrics = aggregate(store)
+        assert metrics.n.values[0] == n
+        assert np.isclose(metrics.bias.values[0], (df.model - df.observation).mean())
+        assert np.isclose(metrics.rmse.values[0], np.sqrt(((df.model - df.observation) ** 2).mean()))
+        assert np.isclose(metrics.cor.values[0], np.corrcoef(df.model, df.observation)[0, 1])
+        assert np.isclose(metrics.model_sd.values[0], df.model.std(ddof=0))
+
+        summer = df.query("month in [6, 7, 8] and lon < 2")
+        metrics = aggregate(store, mask=store["lon"] < 2, months=[6, 7, 8], by="year")
+        assert list(metrics.year) == [2000, 2001, 2002]
+        expected = summer.groupby("year").apply(lambda x: (x.model - x.observation).mean())
+        assert np.allclose(metrics.bias.values, expected.values)
+
+        quantiles = sketch_quantiles(store, q=[0.5])
+        assert abs(quantiles.model.values[0] - df.model.median()) < 0.02 * df.model.median()
+
+    def test_calendars(self, tmp_path):
+        # model calendars that xarray decodes to cftime dates
+        for calendar in ["noleap", "360_day"]:
+            ff = str(tmp_path / f"nsbc_nitrate_{calendar}.nc")
+            calendar_file(ff, calendar)
+            store = load_moments(write_gridded_moments(ff))
+            assert list(store["year"]) == [2000] * 12 + [2001] * 12
+            assert list(store["month"]) == list(range(1, 13)) * 2
+            metrics = aggregate(store, by="year")
+            assert np.allclose(metrics.bias.values, -0.5)
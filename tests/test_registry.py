@@ -0,0 +1,92 @@
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+import ecoval.registry
+from ecoval.registry import register_grid, registered_name, registry_dir, find_bundle
+from ecoval.registry import GridBundle, nn_weights
+from ecoval.utils import grid_fingerprint
+
+
+def grid_file(path, shift=0):
+    lons = np.arange(-5, 0.0) + shift
+    lats = np.arange(50, 54.0)
+    ds = xr.Dataset(
+        {"temperature": (("lat", "lon"), np.ones((4, 5)))},
+        coords={"lon": lons, "lat": lats},
+    )
+    ds.to_netcdf(path)
+    return ds
+
+
+class TestFinal:
+    def test_registry(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("ECOVAL_GRID_DIR", raising=False)
+        assert registry_dir("run/matched") == os.path.join("run/matched", "grids")
+        monkeypatch.setenv("ECOVAL_GRID_DIR", str(tmp_path / "shared"))
+        assert registry_dir("run/matched") == str(tmp_path / "shared")
+
+        ff = str(tmp_path / "model.nc")
+        ds = grid_file(ff)
+        subdomains = str(tmp_path / "subdomains.nc")
+        xr.Dataset(
+            {"Shelf": (("lat", "lon"), (ds.temperature.values > 0) & (ds.lon.values < -2))},
+            coords={"lon": ds.lon, "lat": ds.lat},
+        ).astype("int32").to_netcdf(subdomains)
+        directory = str(tmp_path / "grids")
+        clip = [[-19, 41], [9, 41], [9, 64.3], [-19, 64.3]]
+        bundle = register_grid(
+            "test", ff, subdomains=subdomains, clip=clip, fix_grid=True, directory=directory
+        )
+
+        # grids are found by fingerprint
+        fingerprint = grid_fingerprint(ff)
+        assert bundle.directory == os.path.join(directory, fingerprint)
+        assert registered_name(fingerprint, directory) == "test"
+        assert registered_name(fingerprint, str(tmp_path / "empty")) is None
+        other = str(tmp_path / "other.nc")
+        grid_file(other, shift=0.5)
+        assert registered_name(grid_fingerprint(other), directory) is None
+
+        # the bundle is the same after saving and loading
+        ecoval.registry._bundles.clear()
+        loaded = find_bundle(fingerprint, directory)
+        assert loaded is not bundle
+        assert loaded.name == "test" and loaded.fingerprint == fingerprint
+        assert list(loaded.masks) == ["Shelf"]
+        assert np.array_equal(loaded.masks["Shelf"], bundle.masks["Shelf"])
+        assert np.array_equal(loaded.clip, np.array(clip))
+        assert loaded.grid_file == os.path.join(bundle.directory, "grid.txt")
+        assert loaded.clip_box() == ([-19.0, 9.0], [41.0, 64.3])
+
+        # points on the clipping box are removed, as with the old strict limits
+        df = pd.DataFrame({"lon": [-19, -18.9, 0, 9, 8.9], "lat": [50, 50, 64.3, 50, 64.2]})
+        assert list(loaded.clip_dataframe(df).lon) == [-18.9, 8.9]
+
+    def test_weights(self, tmp_path, monkeypatch):
+        source = str(tmp_path / "source.nc")
+        target = str(tmp_path / "target.nc")
+        grid_file(source)
+        grid_file(target, shift=0.5)
+        bundle = GridBundle("test", grid_fingerprint(source), str(tmp_path / "bundle"))
+        calls = []
+
+        class Result:
+            returncode = 0
+
+        def gennn(args, **kwargs):
+            calls.append(args)
+            with open(args[-1], "w") as f:
+                f.write("weights")
+            return Result()
+
+        monkeypatch.setattr(ecoval.registry.subprocess, "run", gennn)
+        weights = nn_weights(bundle, source, target)
+        assert os.path.exists(weights)
+        assert calls[0][2] == f"gennn,{target}"
+        # the weights of the same pair of grids are reused
+        assert nn_weights(bundle, source, target) == weights
+        assert len(calls) == 1
+        assert nn_weights(bundle, target, source) != weights
+        assert len(calls) == 2
+        assert [x for x in os.listdir(os.path.dirname(weights)) if x.endswith(".tmp")] == []
@@ -0,0 +1,35 @@
+import shutil
+import nbformat
+import pkg_resources
+from ecoval.chunkers import is_chunk, chunk_file, chunk_source
+from ecoval.rendering import render_notebook
+
+
+class TestFinal:
+    def test_render(self, tmp_path):
+        template = pkg_resources.resource_filename("ecoval", "data/gridded_template.ipynb")
+        ff = str(tmp_path / "nsbc_nitrate.ipynb")
+        shutil.copyfile(template, ff)
+        n_cells = len(nbformat.read(ff, as_version=4).cells)
+        context = {"build": "html", "nws": False, "global_grid": False, "gridded": [], "point": []}
+        render_notebook(ff, test=True, fast_plot=False, context=context)
+        nb = nbformat.read(ff, as_version=4)
+        assert len(nb.cells) > n_cells
+        for cell in nb.cells:
+            assert not any(is_chunk(x) for x in cell.source.split("\n"))
+            assert "the_test_status" not in cell.source
+            assert "fast_plot_value" not in cell.source
+            assert "latexpagebreak" not in cell.source
+        assert any("%%R" in x.source and "options(warn=-1)" in x.source for x in nb.cells)
+        # the cdf chunk is only used for the northwest European shelf
+        assert not any("Cumulative distribution function" in x.source for x in nb.cells)
+        assert any("remove-input" in x.metadata.get("tags", []) for x in nb.cells)
+
+    def test_chunk_files(self):
+        context = {"build": "pdf", "nws": False, "global_grid": True, "gridded": ["x.nc"], "point": []}
+        assert chunk_file("chunk_globals", context) == "chunk_globals.py"
+        assert chunk_file("chunk_cdf", context) is None
+        assert "book_build" not in chunk_source("chunk_start", context)
+        context = dict(context, global_grid=False, nws=True)
+        assert chunk_file("chunk_globals", context) == "chunk_empty.py"
+        assert chunk_file("chunk_cdf", context) == "chunk_cdf.py"
@@ -0,0 +1,105 @@
+import numpy as np
+import numpy.ma as ma
+import pandas as pd
+from ecoval.robust_statistics import Sn, SnExplicit, Qn, QnExplicit, MID, MIDExplicit
+from ecoval.robust_statistics import MAD, MedianBias, unbiasedMAE, groupedStatistics
+from ecoval.robust_statistics import Sdist, SdistExplicit, Qdist, QdistExplicit
+
+
+def samples(n, seed):
+    rng = np.random.default_rng(seed)
+    # normal, heavily tied and heavy-tailed data
+    return [
+        rng.normal(size=n),
+        rng.integers(0, 5, size=n).astype(float),
+        rng.standard_cauchy(n) * 100,
+    ]
+
+
+class TestFinal:
+    def test_equivalence(self):
+        for n in list(range(2, 41)) + [64, 101, 250]:
+            for x in samples(n, n):
+                assert np.isclose(Sn(x), SnExplicit(x), rtol=1e-12, atol=0)
+                assert np.isclose(Qn(x), QnExplicit(x), rtol=1e-12, atol=0)
+                assert np.isclose(MID(x), MIDExplicit(x), rtol=1e-12, atol=0)
+
+    def test_small(self):
+        x = np.array([1.0])
+        assert Sn(x) == 0.0
+        assert Qn(x) == 0.0
+        assert MID(x) == 0.0
+        x = np.array([])
+        assert Sn(x) is None
+        assert Qn(x) is None
+        assert MID(x) is None
+
+    def test_inputs(self):
+        x = np.random.default_rng(0).normal(size=(20, 30))
+        y = x.copy()
+        # the data is not modified, and masked values are ignored
+        assert Sn(x) == Sn(x.flatten())
+        assert Qn(x) == Qn(x.flatten())
+        assert (x == y).all()
+        mask = x > 1.5
+        xm = ma.masked_where(mask, x)
+        assert np.isclose(Qn(xm), Qn(x[~mask]))
+        assert np.isclose(Sn(xm), SnExplicit(xm))
+
+    def test_consistency(self):
+        # both estimators are consistent for the standard deviation of normal data
+        x = np.random.default_rng(1).normal(scale=2, size=200000)
+        assert abs(Sn(x) - 2) < 0.05
+        assert abs(Qn(x) - 2) < 0.05
+
+    def test_grouped(self):
+        rng = np.random.default_rng(2)
+        n = 5000
+        df = pd.DataFrame(
+            {
+                "variable": rng.choice(["nitrate", "temperature"], n),
+                "region": rng.choice(["Shelf", "Ocean"], n),
+                "month": rng.integers(1, 13, n),
+                "observation": rng.normal(size=n),
+            }
+        )
+        df["model"] = df.observation + rng.standard_cauchy(n)
+        df.loc[::50, "observation"] = np.nan
+        for cores in [1, 2]:
+            df_stats = groupedStatistics(df, cores=cores)
+            assert list(df_stats.columns) == ["variable", "region", "month", "n", "metric", "value"]
+            assert len(df_stats) == 2 * 2 * 12 * 5
+            df_stats = df_stats.set_index(["variable", "region", "month", "metric"])
+            for key, df_group in df.dropna().groupby(["variable", "region", "month"]):
+                error = (df_group.model - df_group.observation).values
+                model = df_group.model.values
+                obs = df_group.observation.values
+                expected = {
+                    "MAD": MAD(error),
+                    "Sn": Sn(error),
+                    "Qn": Qn(error),
+                    "MedianBias": MedianBias(model, obs),
+                    "unbiasedMAE": unbiasedMAE(model, obs),
+                }
+                for metric, value in expected.items():
+                    assert np.isclose(df_stats.loc[key + (metric,), "value"], value)
+
+    def test_distance_scales(self):
+        rng = np.random.default_rng(3)
+
+        def distance(a, b):
+            return abs(a - b)
+
+        for n1, n2 in [(1, 1), (3, 8), (40, 25), (200, 150)]:
+            for s1, s2 in [
+                (rng.normal(size=n1), rng.normal(size=n2)),
+                (rng.integers(0, 3, n1).astype(float), rng.integers(0, 3, n2).astype(float)),
+            ]:
+                # a small memory cap forces many tiles and several selection passes
+                for memory in [2**28, 4000]:
+                    assert np.isclose(Sdist(s1, s2, memory=memory), SdistExplicit(s1, s2, distance))
+                    assert np.isclose(Qdist(s1, s2, memory=memory), QdistExplicit(s1, s2, distance))
+        s1 = rng.normal(size=300)
+        s2 = rng.normal(size=200)
+        assert Qdist(s1, s2, memory=2**16, cores=2) == QdistExplicit(s1, s2, distance)
+        assert Sdist(s1, s2, memory=2**16, cores=2) == SdistExplicit(s1, s2, distance)
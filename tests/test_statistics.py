@@ -0,0 +1,158 @@
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+from ecoval.masks import label_regions
+from ecoval.statistics import compute_statistics, monthly_climatology, temporal_correlation
+from ecoval.statistics import regional_statistics, sketch_cdf, point_frames, histograms_path
+
+
+def matched_file(path, calendar="standard"):
+    rng = np.random.default_rng(0)
+    times = pd.date_range("2000-01-15", periods=36, freq="MS") + pd.Timedelta(days=14)
+    if calendar != "standard":
+        times = xr.date_range(
+            "2000-01-15", periods=36, freq="MS", calendar=calendar, use_cftime=True
+        ) + pd.Timedelta(days=14)
+    model = rng.random((36, 4, 5)) + 1
+    observation = model + rng.normal(0, 0.1, model.shape)
+    observation[:, 0, 0] = np.nan
+    model[:, 3, 4] = 0
+    ds = xr.Dataset(
+        {
+            "model": (("time", "lat", "lon"), model, {"units": "mmol m-3"}),
+            "observation": (("time", "lat", "lon"), observation),
+        },
+        coords={"time": times, "lat": np.arange(50, 54.0), "lon": np.arange(-5, 0.0)},
+    )
+    os.makedirs(os.path.dirname(path))
+    ds.to_netcdf(path)
+    return ds
+
+
+class TestFinal:
+    def test_statistics(self, tmp_path):
+        matched = str(tmp_path / "matched")
+        results = str(tmp_path / "results")
+        ds = matched_file(f"{matched}/gridded/nws/nitrate/nsbc_nitrate_surface.nc")
+        summary = compute_statistics(matched_dir=matched, results_dir=results)
+        assert summary.region[0] == "all"
+
+        months = ds.time.dt.month.values
+        model = ds.model.where(ds.model != 0).values
+        observation = ds.observation.values
+        clim_model = monthly_climatology(model, months)
+        clim_obs = monthly_climatology(observation, months)
+        assert np.allclose(clim_model[0], np.nanmean(model[months == 1], axis=0), equal_nan=True)
+
+        cor = temporal_correlation(clim_model, clim_obs)
+        assert np.isnan(cor[0, 0]) and np.isnan(cor[3, 4])
+        assert np.isclose(cor[1, 1], np.corrcoef(clim_model[:, 1, 1], clim_obs[:, 1, 1])[0, 1])
+
+        ds_cor = xr.open_dataset(f"{results}/temporals/nitrate_cor.nc")
+        assert np.allclose(ds_cor.cor.values, cor, equal_nan=True, atol=1e-6)
+        ds_monthly = xr.open_dataset(f"{results}/monthly_mean/monthlymean_nitrate.nc")
+        assert list(ds_monthly.time.dt.month.values) == list(range(1, 13))
+        assert os.path.exists(f"{results}/annual_mean/annualmean_nitrate.nc")
+        assert summary.n.values[0] == 18
+        assert 0 <= summary.positive_bias.values[0] <= 100
+        assert summary.unit.values[0] == "mmol m-3"
+
+        df_cdf = sketch_cdf("nitrate", results_dir=results)
+        january = df_cdf.query("month == 1 and variable == 'observation'")
+        values = clim_obs[0][np.isfinite(clim_obs[0]) & np.isfinite(clim_model[0])]
+        assert january.probability.values[-1] == 1
+        assert np.all(np.diff(january.probability.values) > 0)
+        assert np.quantile(values, 0.8) < january.value.max() < 1.02 * np.quantile(values, 0.98)
+        assert sketch_cdf("nitrate", region="missing", results_dir=results) is None
+
+        # unchanged matched files keep their results in incremental runs
+        ds_cor.close()
+        ds_monthly.close()
+        out = f"{results}/temporals/nitrate_cor.nc"
+        written = os.stat(out).st_mtime_ns
+        incremental = compute_statistics(matched_dir=matched, results_dir=results, incremental=True)
+        assert os.stat(out).st_mtime_ns == written
+        assert np.allclose(incremental.bias, summary.bias, equal_nan=True)
+        ds.assign(model=2 * ds.model).to_netcdf(
+            f"{matched}/gridded/nws/nitrate/nsbc_nitrate_surface.nc", mode="w"
+        )
+        compute_statistics(matched_dir=matched, results_dir=results, incremental=True)
+        assert os.stat(out).st_mtime_ns != written
+
+        # results lost or rewritten by an interrupted run are rebuilt
+        written = os.stat(out).st_mtime_ns
+        os.remove(f"{results}/bias/bias_nitrate.nc")
+        compute_statistics(matched_dir=matched, results_dir=results, incremental=True)
+        assert os.path.exists(f"{results}/bias/bias_nitrate.nc")
+        assert os.stat(out).st_mtime_ns != written
+        written = os.stat(out).st_mtime_ns
+        pd.read_csv(f"{results}/statistics/monthly.csv").head(1).to_csv(
+            f"{results}/statistics/monthly.csv", index=False
+        )
+        compute_statistics(matched_dir=matched, results_dir=results, incremental=True)
+        assert os.stat(out).st_mtime_ns != written
+        assert len(pd.read_csv(f"{results}/statistics/monthly.csv")) == 60
+
+    def test_calendars(self, tmp_path):
+        # noleap and 360_day model calendars decode to cftime dates
+        for calendar in ["noleap", "360_day"]:
+            matched = str(tmp_path / calendar / "matched")
+            results = str(tmp_path / calendar / "results")
+            matched_file(f"{matched}/gridded/nws/nitrate/nsbc_nitrate_surface.nc", calendar)
+            summary = compute_statistics(matched_dir=matched, results_dir=results)
+            assert summary.n.values[0] == 18
+            monthly = pd.read_csv(f"{results}/statistics/monthly.csv")
+            assert list(monthly.month.unique()) == list(range(1, 13))
+            with xr.open_dataset(f"{results}/monthly_mean/monthlymean_nitrate.nc") as ds:
+                assert list(ds.time.dt.month.values) == list(range(1, 13))
+
+    def test_regional(self):
+        rng = np.random.default_rng(1)
+        model = rng.random((3, 6, 8))
+        observation = model + rng.normal(0, 0.2, model.shape)
+        observation[0, 2, 2] = np.nan
+        weights = rng.random((6, 8)) + 0.5
+        masks = {"all": np.ones((6, 8), dtype="bool"), "west": np.zeros((6, 8), dtype="bool")}
+        masks["west"][:, :3] = True
+        masks["north"] = np.zeros((6, 8), dtype="bool")
+        masks["north"][4:, 2:5] = True
+        labels, membership, names = label_regions(masks)
+        assert names == ["all", "west", "north"]
+        regional = regional_statistics(model, observation, labels, membership, weights)
+        for j, name in enumerate(names):
+            for i in range(3):
+                valid = masks[name] & np.isfinite(observation[i])
+                x = model[i][valid]
+                y = observation[i][valid]
+                w = weights[valid]
+                assert regional["n"][i, j] == valid.sum()
+                assert np.isclose(regional["bias"][i, j], np.average(x - y, weights=w))
+                assert np.isclose(regional["rmse"][i, j], np.sqrt(np.average((x - y) ** 2, weights=w)))
+                cov = np.cov(x, y, aweights=w)
+                assert np.isclose(regional["cor"][i, j], cov[0, 1] / np.sqrt(cov[0, 0] * cov[1, 1]))
+
+    def test_point_histograms(self, tmp_path):
+        rng = np.random.default_rng(2)
+        n = 500
+        df = pd.DataFrame(
+            {
+                "lon": rng.uniform(-5, 10, n),
+                "lat": rng.uniform(50, 55, n),
+                "year": 2000,
+                "month": rng.integers(1, 13, n),
+                "day": 1,
+                "observation": rng.random(n) * 10,
+            }
+        ).assign(model=lambda x: x.observation + rng.normal(0, 1, n))
+        ff = tmp_path / "matched/point/nws/surface/nitrate/ices_surface_nitrate.csv"
+        os.makedirs(ff.parent)
+        df.to_csv(ff, index=False)
+        compute_statistics(matched_dir=str(tmp_path / "matched"), results_dir=str(tmp_path / "results"))
+
+        df_locs, df_raw, df_binned = point_frames(str(ff), "nitrate")
+        assert df_raw.lon.max() < 9
+        df_hist = pd.read_csv(histograms_path("surface", "nitrate", str(tmp_path / "results")))
+        assert df_hist.query("month == 'All months'").n.sum() == len(df_binned)
+        assert df_hist.query("month != 'All months'").n.sum() == len(df_binned)
+        assert df_hist.query("month == 'Jan'").n.sum() == (df_binned.month == 1).sum()